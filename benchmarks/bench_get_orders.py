@@ -0,0 +1,118 @@
+"""
+Замер времени get_orders на записанной странице заказов без обращения к реальному Kaspi API.
+
+Записанная страница — JSON-файл вида {"<путь относительно KASPI_API_URL>": <тело ответа>}, например:
+    {"orders": {...}, "orders/123/entries": {...}, "orderentries/456/product": {...}}
+Без файла генерируется синтетическая страница (20 заказов по 3 товара), с --compound — составной документ.
+
+Запуск:
+    python benchmarks/bench_get_orders.py [recorded_page.json] --latency 0.15 --concurrency 1 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('KASPI_API', 'bench')
+# Лимиты клиента не должны влиять на сравнение уровней параллельности
+os.environ.setdefault('KASPI_RATE_LIMIT', '10000')
+os.environ.setdefault('KASPI_RATE_BURST', '10000')
+os.environ.setdefault('KASPI_CONCURRENCY', '100')
+
+import httpx  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from services import http_client, kaspi_api  # noqa: E402
+from services.product_cache import product_cache  # noqa: E402
+
+
+def compound_page(orders: int = 20, entries: int = 3) -> dict:
+    """
+    Та же страница, но позиции и товары уже лежат в included (include=entries.product)
+    """
+    responses = synthetic_page(orders, entries)
+    page = responses['orders']
+    page['included'] = []
+    for order in page['data']:
+        order_entries = responses.pop(f"orders/{order['id']}/entries")['data']
+        order['relationships'] = {'entries': {'data': [{'type': 'orderentries', 'id': e['id']} for e in order_entries]}}
+        for entry in order_entries:
+            product = responses.pop(f"orderentries/{entry['id']}/product")['data']
+            product_id = f"p-{entry['id']}"
+            page['included'].append({**entry, 'relationships': {'product': {'data': {'type': 'masterproducts', 'id': product_id}}}})
+            page['included'].append({'type': 'masterproducts', 'id': product_id, 'attributes': product['attributes']})
+    return responses
+
+
+def synthetic_page(orders: int = 20, entries: int = 3) -> dict:
+    responses = {'orders': {'data': [
+        {'id': f'o{i}', 'type': 'orders', 'attributes': {
+            'code': str(100000 + i), 'status': 'ACCEPTED_BY_MERCHANT', 'state': 'DELIVERY',
+            'creationDate': 1700000000000 + i, 'totalPrice': 1000 * entries,
+        }} for i in range(orders)
+    ]}}
+    for i in range(orders):
+        responses[f'orders/o{i}/entries'] = {'data': [
+            {'id': f'o{i}e{j}', 'type': 'orderentries', 'attributes': {'quantity': 1, 'totalPrice': 1000}}
+            for j in range(entries)
+        ]}
+        for j in range(entries):
+            responses[f'orderentries/o{i}e{j}/product'] = {'data': {'attributes': {'name': f'Товар {i}-{j}'}}}
+    return responses
+
+
+def make_transport(responses: dict, latency: float, counter: list) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        counter[0] += 1
+        await asyncio.sleep(latency)
+        path = request.url.path.split('/shop/api/v2/', 1)[-1]
+        if path not in responses:
+            return httpx.Response(404, json={'errors': [{'title': 'not found'}]})
+        return httpx.Response(200, json=responses[path])
+    return httpx.MockTransport(handler)
+
+
+async def run(responses: dict, latency: float, concurrency: int, warm_cache: bool) -> tuple[float, int, int]:
+    if not warm_cache:
+        product_cache.clear()
+    counter = [0]
+    transport = make_transport(responses, latency, counter)
+    await http_client.set_transport(transport)
+    try:
+        started = time.perf_counter()
+        orders = await kaspi_api.get_orders(concurrency=concurrency)
+        return time.perf_counter() - started, counter[0], len(orders)
+    finally:
+        await http_client.close_http_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recorded', nargs='?', help='JSON-файл с записанными ответами API')
+    parser.add_argument('--latency', type=float, default=0.15, help='задержка одного ответа, сек')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--compound', action='store_true', help='синтетическая страница с included (позиции и товары в одном ответе)')
+    parser.add_argument('--warm-cache', action='store_true', help='не сбрасывать кэш товаров между прогонами')
+    args = parser.parse_args()
+
+    if args.recorded:
+        with open(args.recorded, encoding='utf-8') as f:
+            responses = json.load(f)
+    elif args.compound:
+        responses = compound_page()
+    else:
+        responses = synthetic_page()
+
+    logger.remove()
+    baseline = None
+    for concurrency in args.concurrency:
+        elapsed, requests, orders = asyncio.run(run(responses, args.latency, concurrency, args.warm_cache))
+        baseline = baseline or elapsed
+        print(f'concurrency={concurrency:>3}: {elapsed:6.2f} с, запросов {requests}, заказов {orders}, ускорение x{baseline / elapsed:.1f}')
+
+
+if __name__ == '__main__':
+    main()
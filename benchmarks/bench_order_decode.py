@@ -0,0 +1,105 @@
+"""
+Микро-бенчмарк разбора страницы заказов: прежний путь (json.loads + словарь из 25 ключей на заказ)
+против типизированной модели services.order_model (msgspec).
+
+Запуск:
+    python benchmarks/bench_order_decode.py --orders 1000 --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.order_model import Order, OrderEntry, order_resource_decoder, orders_page_decoder  # noqa: E402
+
+
+def synthetic_page(orders: int) -> bytes:
+    return json.dumps({'data': [
+        {'id': f'T3JkZXI{i:06d}', 'type': 'orders', 'attributes': {
+            'code': str(500000000 + i), 'totalPrice': 15990, 'paymentMode': 'PAY_WITH_CREDIT',
+            'creationDate': 1700000000000 + i * 1000, 'deliveryCostForSeller': 0, 'isKaspiDelivery': True,
+            'deliveryMode': 'DELIVERY_PICKUP', 'deliveryType': 'PICKUP', 'signatureRequired': False,
+            'status': 'ACCEPTED_BY_MERCHANT', 'state': 'KASPI_DELIVERY', 'assembled': False,
+            'customer': {'id': 'c', 'name': 'Иван', 'cellPhone': '7771234567', 'firstName': 'Иван', 'lastName': 'Иванов'},
+            'deliveryAddress': {'streetName': 'Абая', 'streetNumber': '1', 'town': 'Алматы', 'formattedAddress': 'Алматы, Абая 1'},
+            'kaspiDelivery': {'waybill': None, 'courierTransmissionDate': None, 'express': False, 'returnedToWarehouse': False},
+            'paymentMethod': 'CREDIT', 'creditTerm': 0, 'plannedDeliveryDate': 1700100000000,
+        }, 'relationships': {'entries': {'links': {'related': f'https://kaspi.kz/shop/api/v2/orders/{i}/entries'}}}}
+        for i in range(orders)
+    ], 'meta': {'pageCount': 1, 'totalCount': orders}}).encode()
+
+
+def legacy_decode(content: bytes) -> list[dict]:
+    data = json.loads(content)
+    orders = []
+    for order_data in data['data']:
+        attributes = order_data.get('attributes', {})
+        products_info = [{'name': 'Товар', 'quantity': 1, 'price': 15990}]
+        orders.append({
+            'order_id': order_data.get('id'),
+            'code': attributes.get('code'),
+            'product_name': products_info[0]['name'] if products_info else 'Товар',
+            'products': products_info,
+            'status': attributes.get('status'),
+            'state': attributes.get('state'),
+            'date': attributes.get('creationDate'),
+            'price': attributes.get('totalPrice'),
+            'customer': attributes.get('customer', {}),
+            'totalPrice': attributes.get('totalPrice'),
+            'deliveryMode': attributes.get('deliveryMode'),
+            'deliveryType': attributes.get('deliveryType'),
+            'signatureRequired': attributes.get('signatureRequired'),
+            'paymentMethod': attributes.get('paymentMethod'),
+            'paymentStatus': attributes.get('paymentStatus'),
+            'deliveryAddress': attributes.get('deliveryAddress', {}),
+            'pickupPoint': attributes.get('pickupPoint', {}),
+            'comment': attributes.get('comment', ''),
+            'waybillNumber': attributes.get('waybillNumber'),
+            'assembled': attributes.get('assembled'),
+            'courierTransmissionDate': attributes.get('kaspiDelivery', {}).get('courierTransmissionDate'),
+            'waybill': attributes.get('kaspiDelivery', {}).get('waybill'),
+        })
+    return orders
+
+
+def typed_decode(content: bytes) -> list[Order]:
+    page = orders_page_decoder.decode(content)
+    # Как в kaspi_api._decode_orders: заказы страницы декодируются по одному
+    return [Order.from_resource(order_resource_decoder.decode(raw), [OrderEntry(price=15990)]) for raw in page.data]
+
+
+def measure(decode, content: bytes, repeat: int) -> tuple[float, int]:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode(content)
+    per_page = (time.perf_counter() - started) / repeat
+    # Память, которую удерживают разобранные заказы после разбора
+    tracemalloc.start()
+    result = decode(content)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return per_page, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    content = synthetic_page(args.orders)
+    legacy_time, legacy_mem = measure(legacy_decode, content, args.repeat)
+    typed_time, typed_mem = measure(typed_decode, content, args.repeat)
+    print(f'заказов на странице: {args.orders}, размер ответа: {len(content) / 1024:.0f} КБ')
+    print(f'dict:    {legacy_time * 1000:7.2f} мс/страница, {legacy_mem / args.orders:7.0f} байт/заказ')
+    print(f'msgspec: {typed_time * 1000:7.2f} мс/страница, {typed_mem / args.orders:7.0f} байт/заказ')
+    print(f'ускорение x{legacy_time / typed_time:.1f}, память x{legacy_mem / typed_mem:.1f} меньше')
+
+
+if __name__ == '__main__':
+    main()
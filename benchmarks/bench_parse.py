@@ -0,0 +1,141 @@
+"""
+Бенчмарк разбора страниц товаров на сохранённых HTML-страницах: parse_price_and_competitors прямо в цикле
+событий (loop) против parse_page (pool: встроенное состояние читается в цикле, разметка разбирается в пуле
+из PARSE_WORKERS процессов). Страницы разбирают --concurrency задач, как в PriceCrawler. Пока идёт разбор,
+в том же цикле работает таймер с шагом --tick: задержка его срабатываний — это время, на которое цикл был
+занят и не обрабатывал обновления Telegram и опрос заказов.
+
+Выводятся страниц в секунду, суммарная задержка цикла (stall), p99 и максимальная задержка одного шага.
+
+Страницы берутся из --fixtures (все *.html в каталоге, например сохранённые страницы Kaspi) или
+генерируются симулятором (benchmarks/kaspi_simulator.py): --sellers продавцов на странице, со встроенным
+JSON-состоянием (state) и только с разметкой (css). --save сохраняет сгенерированные страницы в каталог.
+
+Запуск:
+    python benchmarks/bench_parse.py --pages 200 --sellers 8 200
+    python benchmarks/bench_parse.py --sellers 500 --save /tmp/kaspi-pages
+    PARSE_WORKERS=2 python benchmarks/bench_parse.py --fixtures /tmp/kaspi-pages
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['MONGO_URI'] = ''
+
+from loguru import logger  # noqa: E402
+
+from benchmarks.kaspi_simulator import KaspiSimulator, SimulatorConfig  # noqa: E402
+from services import kaspi_parser  # noqa: E402
+
+
+def generate(pages: int, sellers: int, embedded_state: bool) -> list[str]:
+    simulator = KaspiSimulator(SimulatorConfig(orders=0, sellers=sellers, embedded_state=embedded_state))
+    return [simulator._product_page(number) for number in range(pages)]
+
+
+def load(directory: str) -> list[str]:
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+def save(directory: str, name: str, pages: list[str]):
+    os.makedirs(directory, exist_ok=True)
+    for number, html in enumerate(pages):
+        with open(os.path.join(directory, f'{name}-{number:04d}.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+
+async def measure(pages: list[str], use_pool: bool, concurrency: int, tick: float) -> dict:
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append(max(0.0, time.perf_counter() - started - tick))
+
+    timer = asyncio.create_task(ticker())
+    await asyncio.sleep(tick * 2)
+    queue = iter(pages)
+
+    async def worker():
+        for html in queue:
+            if use_pool:
+                await kaspi_parser.parse_page(html)
+            else:
+                kaspi_parser.parse_price_and_competitors(html)
+            # Как у задач PriceCrawler: между страницами цикл получает управление (там — на загрузке)
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    done.set()
+    await timer
+    lags.sort()
+    return {
+        'pages/s': len(pages) / wall,
+        'stall': sum(lags),
+        'p99': lags[int(len(lags) * 0.99)] if lags else 0.0,
+        'max': lags[-1] if lags else 0.0,
+    }
+
+
+async def warm_up(pages: list[str]):
+    # Процессы пула запускаются до замера
+    await asyncio.gather(*(kaspi_parser.parse_page(pages[0]) for _ in range(kaspi_parser.PARSE_WORKERS * 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='каталог с сохранёнными страницами *.html')
+    parser.add_argument('--pages', type=int, default=200, help='страниц в наборе, если они генерируются')
+    parser.add_argument('--sellers', type=int, nargs='+', default=[8, 200], help='продавцов на странице')
+    parser.add_argument('--concurrency', type=int, default=8, help='задач разбора')
+    parser.add_argument('--tick', type=float, default=0.005, help='шаг таймера цикла событий, сек')
+    parser.add_argument('--save', help='сохранить сгенерированные страницы в каталог')
+    args = parser.parse_args()
+
+    logger.remove()
+    if args.fixtures:
+        sets = {os.path.basename(os.path.normpath(args.fixtures)): load(args.fixtures)}
+    else:
+        sets = {}
+        for sellers in args.sellers:
+            sets[f'state, {sellers} прод.'] = generate(args.pages, sellers, True)
+            sets[f'css, {sellers} прод.'] = generate(args.pages, sellers, False)
+    if args.save and not args.fixtures:
+        for name, pages in sets.items():
+            save(args.save, name.replace(', ', '-').replace(' прод.', ''), pages)
+
+    print(f'процессов разбора: {kaspi_parser.PARSE_WORKERS}')
+    print(f"{'страницы':<20} {'КБ/стр':>7} {'режим':>6} {'pages/s':>9} {'stall, мс':>10} {'p99, мс':>8} {'max, мс':>8}")
+    for name, pages in sets.items():
+        if not pages:
+            continue
+        size = sum(len(html.encode()) for html in pages) / len(pages) / 1024
+        modes = [('loop', False)] + ([('pool', True)] if kaspi_parser.PARSE_WORKERS > 0 else [])
+        for mode, use_pool in modes:
+            async def run():
+                if use_pool:
+                    await warm_up(pages)
+                return await measure(pages, use_pool, args.concurrency, args.tick)
+
+            result = asyncio.run(run())
+            print(
+                f"{name:<20} {size:>7.0f} {mode:>6} {result['pages/s']:>9.0f} {result['stall'] * 1000:>10.1f} "
+                f"{result['p99'] * 1000:>8.2f} {result['max'] * 1000:>8.2f}"
+            )
+    kaspi_parser.close_parse_pool()
+
+
+if __name__ == '__main__':
+    main()
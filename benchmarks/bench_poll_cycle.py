@@ -0,0 +1,174 @@
+"""
+Сквозной бенчмарк цикла опроса заказов: show_new_orders против локального симулятора Kaspi API
+(benchmarks/kaspi_simulator.py) через настоящий HTTP-клиент, лимитер и хранилище заказов в памяти.
+
+Для каждого размера магазина выполняется холодный цикл (пустые отпечатки и отметки синхронизации)
+и несколько повторных циклов, как у планировщика. Выводятся запросы за цикл, время цикла,
+p50/p99 времени ответа API и пиковая память холодного цикла (tracemalloc, отдельным прогоном).
+
+Запуск:
+    python benchmarks/bench_poll_cycle.py --orders 10 100 1000 10000 --latency 0.05 --cycles 3
+    KASPI_CONCURRENCY=20 python benchmarks/bench_poll_cycle.py --orders 1000 --throttle-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+PORT = _free_port()
+os.environ['KASPI_API_URL'] = f'http://127.0.0.1:{PORT}/shop/api/v2/'
+os.environ.setdefault('KASPI_API', 'bench')
+# Один магазин: симулятор обслуживает один токен
+os.environ['KASPI_SHOPS'] = ''
+# Хранилище заказов и отметки синхронизации — в памяти, без записи в рабочую базу
+os.environ['MONGO_URI'] = ''
+# Лимиты клиента по умолчанию не должны определять результат; задайте их явно, чтобы измерить реальный режим
+os.environ.setdefault('KASPI_RATE_LIMIT', '10000')
+os.environ.setdefault('KASPI_RATE_BURST', '10000')
+
+from loguru import logger  # noqa: E402
+
+from benchmarks.kaspi_simulator import KaspiSimulator, SimulatorConfig  # noqa: E402
+from services import http_client, order_checker, order_store, order_sync  # noqa: E402
+from services.orders_snapshot import orders_snapshot  # noqa: E402
+from services.product_cache import product_cache  # noqa: E402
+from services.shops import get_shop  # noqa: E402
+
+
+class CycleMetrics:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.notified = 0
+
+    async def on_request(self, request):
+        request.extensions['bench_started'] = time.perf_counter()
+
+    async def on_response(self, response):
+        started = response.request.extensions.get('bench_started')
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def reset_state():
+    product_cache.clear()
+    order_store._memory_fingerprints.clear()
+    order_store._delivering.clear()
+    order_sync._memory_watermarks.clear()
+    orders_snapshot.replace([])
+    get_shop().breaker.record_success()
+
+
+async def run_cycle(simulator: KaspiSimulator, metrics: CycleMetrics) -> dict:
+    client = http_client.get_client()
+    client.event_hooks = {'request': [metrics.on_request], 'response': [metrics.on_response]}
+    requests_before = simulator.stats.requests
+    started = time.perf_counter()
+    await order_checker.show_new_orders(None)
+    return {
+        'wall': time.perf_counter() - started,
+        'requests': simulator.stats.requests - requests_before,
+        'notified': metrics.notified,
+        'latencies': metrics.latencies,
+    }
+
+
+async def bench_shop(config: SimulatorConfig, cycles: int, new_per_cycle: int, measure_memory: bool) -> list[dict]:
+    simulator = KaspiSimulator(config)
+    runner = await simulator.start(port=PORT)
+    original_show = order_checker.show_order_notification
+    metrics = CycleMetrics()
+
+    async def counting_show(bot, order, **kwargs):
+        metrics.notified += 1
+        return await original_show(bot, order, **kwargs)
+
+    order_checker.show_order_notification = counting_show
+    results = []
+    try:
+        reset_state()
+        for cycle in range(cycles):
+            if cycle:
+                for i in range(new_per_cycle):
+                    simulator.add_order(config.orders + cycle * new_per_cycle + i)
+            metrics = CycleMetrics()
+            results.append(await run_cycle(simulator, metrics))
+        if measure_memory:
+            reset_state()
+            metrics = CycleMetrics()
+            tracemalloc.start()
+            await run_cycle(simulator, metrics)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[0]['peak'] = peak
+    finally:
+        order_checker.show_order_notification = original_show
+        await http_client.close_http_clients()
+        await runner.cleanup()
+    return results
+
+
+def report(orders: int, results: list[dict]):
+    cold, steady = results[0], results[1:]
+    peak = f"{cold['peak'] / 2 ** 20:8.1f}" if 'peak' in cold else f"{'-':>8}"
+    print(
+        f"{orders:>7} {'cold':>7} {cold['requests']:>9} {cold['wall']:>8.2f} "
+        f"{percentile(cold['latencies'], 0.5) * 1000:>8.1f} {percentile(cold['latencies'], 0.99) * 1000:>8.1f} "
+        f"{cold['notified']:>9} {peak}"
+    )
+    if steady:
+        latencies = [latency for result in steady for latency in result['latencies']]
+        print(
+            f"{orders:>7} {'steady':>7} {statistics.mean(r['requests'] for r in steady):>9.1f} "
+            f"{statistics.median(r['wall'] for r in steady):>8.2f} "
+            f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+            f"{statistics.mean(r['notified'] for r in steady):>9.1f} {'-':>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, nargs='+', default=[10, 100, 1000, 10000], help='размеры магазинов')
+    parser.add_argument('--entries', type=int, default=2, help='позиций в заказе')
+    parser.add_argument('--latency', type=float, default=0.05, help='средняя задержка ответа симулятора, сек')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--no-include', action='store_true', help='симулятор не поддерживает include[orders]')
+    parser.add_argument('--cycles', type=int, default=3, help='циклов на магазин: первый холодный, остальные повторные')
+    parser.add_argument('--new-per-cycle', type=int, default=1, help='новых заказов перед каждым повторным циклом')
+    parser.add_argument('--no-memory', action='store_true', help='не замерять пиковую память')
+    args = parser.parse_args()
+
+    logger.remove()
+    print(f"{'orders':>7} {'cycle':>7} {'requests':>9} {'wall, s':>8} {'p50, ms':>8} {'p99, ms':>8} {'notified':>9} {'peak, MB':>8}")
+    for orders in args.orders:
+        config = SimulatorConfig(
+            orders=orders, entries_per_order=args.entries, latency=args.latency,
+            error_rate=args.error_rate, throttle_rate=args.throttle_rate, include=not args.no_include,
+        )
+        results = asyncio.run(bench_shop(config, max(1, args.cycles), args.new_per_cycle, not args.no_memory))
+        report(orders, results)
+    print(f'лимитер: {get_shop().limiter.stats()}')
+
+
+if __name__ == '__main__':
+    main()
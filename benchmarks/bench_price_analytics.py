@@ -0,0 +1,87 @@
+"""
+Бенчмарк аналитики цен (services/price_analytics.py) на синтетическом каталоге: --sellers продавцов
+на товар, проверка цен раз в час за --days дней, при каждой проверке цена продавца меняется
+с вероятностью --change-rate; в историю, как у PriceCrawler, попадают только изменившиеся снимки.
+
+Выводятся записи истории, время сборки столбцов из записей (как после чтения из MongoDB), время
+расчёта по всему каталогу и время запроса «где я не в топ-1» по готовому результату.
+
+Запуск:
+    python benchmarks/bench_price_analytics.py --products 1000 10000 --days 7
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['MONGO_URI'] = ''
+
+from services.price_analytics import Codes, PriceAnalytics, PriceFrame  # noqa: E402
+
+ME = 'Мой магазин'
+
+
+def synthetic(products: int, sellers: int, days: int, change_rate: float, seed: int = 1):
+    """
+    Последние снимки (товар, продавец, цена, 0) и история (товар, продавец, цена, секунды)
+    """
+    rng = random.Random(seed)
+    started = time.time() - days * 86400
+    history, snapshot = [], []
+    for product in range(products):
+        names = [ME] + [f'Продавец {rng.randint(1, 2000)}' for _ in range(sellers - 1)]
+        base = 1000 * rng.randint(5, 300)
+        prices = [base + 100 * rng.randint(0, 50) for _ in names]
+        for hour in range(days * 24):
+            changed = hour == 0
+            for i in range(len(prices)):
+                if rng.random() < change_rate:
+                    prices[i] = max(100, prices[i] + 100 * rng.randint(-5, 5))
+                    changed = True
+            if changed:
+                ts = started + hour * 3600
+                history.extend((product, name, price, ts) for name, price in zip(names, prices))
+        snapshot.extend((product, name, price, 0) for name, price in zip(names, prices))
+    return snapshot, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--sellers', type=int, default=8, help='продавцов на товар')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--change-rate', type=float, default=0.02, help='вероятность изменения цены продавца за проверку')
+    parser.add_argument('--repeat', type=int, default=20, help='повторов запроса «не в топ-1»')
+    args = parser.parse_args()
+
+    analytics = PriceAnalytics(merchants=[ME], window_days=args.days)
+    print(f"{'products':>8} {'history':>9} {'columns, мс':>12} {'compute, мс':>12} {'not_top1, мс':>13} {'not top-1':>10}")
+    for products in args.products:
+        snapshot_rows, history_rows = synthetic(products, args.sellers, args.days, args.change_rate)
+        started = time.perf_counter()
+        codes, sellers = Codes(), Codes()
+        snapshot = PriceFrame.from_rows(snapshot_rows, codes, sellers)
+        history = PriceFrame.from_rows(history_rows, codes, sellers)
+        columns = time.perf_counter() - started
+
+        started = time.perf_counter()
+        catalog = analytics.compute(snapshot, history, codes, sellers)
+        compute = time.perf_counter() - started
+
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            behind = catalog.not_top1()
+            [catalog.product_report(code) for code in behind[:20]]
+            timings.append(time.perf_counter() - started)
+        print(
+            f'{products:>8} {len(history):>9} {columns * 1000:>12.0f} {compute * 1000:>12.1f} '
+            f'{statistics.median(timings) * 1000:>13.3f} {len(behind):>10}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Бенчмарк проверки цен: PriceCrawler.crawl против страниц товаров локального симулятора
+(benchmarks/kaspi_simulator.py) через общий HTTP-клиент kaspi_site и лимитер сайта. Запись в MongoDB
+не выполняется: товары передаются списком, операции записи только подсчитываются.
+
+Первый проход холодный, перед каждым следующим у доли --change-rate товаров меняются цены:
+повторные проходы показывают ответы 304 (not_mod), страницы с прежним отпечатком (same) и число записей.
+
+Запуск:
+    python benchmarks/bench_price_crawl.py --products 100 1000 5000 --latency 0.2
+    python benchmarks/bench_price_crawl.py --products 1000 --cycles 3 --change-rate 0.05 --no-validators
+    PRICE_CRAWL_HOST_RATE=5 python benchmarks/bench_price_crawl.py --products 1000 --throttle-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['MONGO_URI'] = ''
+# По умолчанию лимит сайта не должен определять результат; задайте его явно, чтобы измерить реальный режим
+os.environ.setdefault('PRICE_CRAWL_HOST_RATE', '10000')
+os.environ.setdefault('PRICE_CRAWL_HOST_CONCURRENCY', '20')
+
+from loguru import logger  # noqa: E402
+
+from benchmarks.kaspi_simulator import KaspiSimulator, SimulatorConfig  # noqa: E402
+from services import http_client  # noqa: E402
+from services.price_monitor import PriceCrawler  # noqa: E402
+
+
+async def bench(products: int, config: SimulatorConfig, concurrency: int | None, cycles: int, change_rate: float) -> list[dict]:
+    simulator = KaspiSimulator(config)
+    runner = await simulator.start()
+    crawler = PriceCrawler(**({'concurrency': concurrency} if concurrency else {}))
+    catalog = [{'_id': i, 'name': f'Товар {i}', 'link': simulator.product_url(i)} for i in range(products)]
+    results = []
+    try:
+        for cycle in range(cycles):
+            if cycle:
+                simulator.change_pages(range(products), change_rate)
+            requests_before = simulator.stats.requests
+            started = time.perf_counter()
+            result = await crawler.crawl(catalog)
+            result['wall'] = time.perf_counter() - started
+            result['requests'] = simulator.stats.requests - requests_before
+            results.append(result)
+    finally:
+        await http_client.close_http_clients()
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=[100, 1000, 5000], help='размеры каталога')
+    parser.add_argument('--latency', type=float, default=0.2, help='средняя задержка ответа сайта, сек')
+    parser.add_argument('--sellers', type=int, default=8, help='продавцов на странице')
+    parser.add_argument('--concurrency', type=int, default=None, help='одновременно проверяемых товаров')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--cycles', type=int, default=3, help='проходов по каталогу')
+    parser.add_argument('--change-rate', type=float, default=0.05, help='доля товаров с новой ценой перед повторным проходом')
+    parser.add_argument('--no-validators', action='store_true', help='сайт не отдаёт ETag/Last-Modified')
+    args = parser.parse_args()
+
+    logger.remove()
+    print(
+        f"{'products':>8} {'cycle':>5} {'requests':>9} {'wall, s':>8} {'pages/s':>8} "
+        f"{'not_mod':>8} {'same':>6} {'updated':>8} {'writes':>7} {'errors':>7}"
+    )
+    for products in args.products:
+        config = SimulatorConfig(
+            orders=0, latency=args.latency, sellers=args.sellers,
+            error_rate=args.error_rate, throttle_rate=args.throttle_rate, page_validators=not args.no_validators,
+        )
+        results = asyncio.run(bench(products, config, args.concurrency, max(1, args.cycles), args.change_rate))
+        for cycle, result in enumerate(results):
+            print(
+                f"{products:>8} {cycle:>5} {result['requests']:>9} {result['wall']:>8.2f} "
+                f"{result['checked'] / result['wall']:>8.1f} {result['not_modified']:>8} {result['unchanged']:>6} "
+                f"{result['updated']:>8} {result['writes']:>7} {result['errors']:>7}"
+            )
+
+
+if __name__ == '__main__':
+    main()
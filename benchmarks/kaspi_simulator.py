@@ -0,0 +1,380 @@
+"""
+Локальный симулятор Kaspi Shop API для проверок и бенчмарков без обращения к production.
+
+Поддерживаемые эндпоинты (относительно /shop/api/v2/):
+    GET   orders                     — фильтры state/status/code/creationDate, page[number]/page[size], include[orders]
+    GET   orders/{id}
+    GET   orders/{id}/entries
+    GET   orderentries/{id}/product
+    GET   masterproducts/{id}
+    PATCH orders/{id}                — status=ASSEMBLE помечает заказ собранным и выдаёт накладную
+    POST  orders                     — выдача заказа (status=COMPLETED)
+
+Страницы товаров сайта (для проверки цен): GET /shop/p/{slug}/ — цена и продавцы, без токена, в разметке
+и во встроенном состоянии BACKEND.components.item (embedded_state=False — только разметка).
+С ETag и Last-Modified (на условный запрос к неизменившейся странице — 304); change_pages меняет цены
+части товаров. В каждой странице есть случайный токен, поэтому тело ответа никогда не повторяется.
+
+Задержка, доля ошибок 5xx и ответов 429 (с Retry-After) настраиваются, как и размер магазина.
+
+Запуск отдельным процессом:
+    python benchmarks/kaspi_simulator.py --orders 1000 --latency 0.05 --error-rate 0.01 --throttle-rate 0.02
+    KASPI_API_URL=http://127.0.0.1:8081/shop/api/v2/ KASPI_API=sim python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from email.utils import formatdate
+
+from aiohttp import web
+
+API_PREFIX = '/shop/api/v2/'
+STATES = ('KASPI_DELIVERY', 'DELIVERY')
+
+
+@dataclass
+class SimulatorConfig:
+    orders: int = 100
+    entries_per_order: int = 2
+    products: int = 500
+    latency: float = 0.05  # средняя задержка ответа, сек
+    jitter: float = 0.5  # разброс задержки, доля от latency
+    max_page_size: int = 100
+    error_rate: float = 0.0  # доля ответов 500
+    throttle_rate: float = 0.0  # доля ответов 429
+    retry_after: float = 1.0
+    include: bool = True  # поддержка include[orders]=entries.product
+    days: int = 3  # заказы распределяются по последним days дням
+    sellers: int = 8  # продавцов на странице товара
+    page_validators: bool = True  # ETag/Last-Modified и ответы 304 на страницах товаров
+    embedded_state: bool = True  # встроенное JSON-состояние товара на странице
+    seed: int = 1
+
+
+@dataclass
+class SimulatorStats:
+    requests: int = 0
+    errors: int = 0
+    throttled: int = 0
+    not_modified: int = 0
+    by_endpoint: dict = field(default_factory=dict)
+
+    def reset(self):
+        self.requests = self.errors = self.throttled = self.not_modified = 0
+        self.by_endpoint = {}
+
+
+class KaspiSimulator:
+    """
+    Синтетический магазин: заказы в состояниях KASPI_DELIVERY и DELIVERY с позициями и товарами
+    """
+
+    def __init__(self, config: SimulatorConfig):
+        self.config = config
+        self.stats = SimulatorStats()
+        self.random = random.Random(config.seed)
+        self.orders: dict[str, dict] = {}
+        self.entries: dict[str, dict] = {}
+        self.products: dict[str, dict] = {}
+        self.base_url = f'http://127.0.0.1{API_PREFIX}'
+        self.site_url = 'http://127.0.0.1'
+        self.page_versions: dict[int, int] = {}
+        self.page_modified: dict[int, float] = {}
+        self.started = time.time()
+        self._generate()
+
+    def _generate(self):
+        config = self.config
+        now = int(time.time() * 1000)
+        span = config.days * 24 * 3600 * 1000
+        for p in range(config.products):
+            self.products[f'mp{p}'] = {'name': f'Товар {p}', 'code': f'{100000 + p}'}
+        for i in range(config.orders):
+            self.add_order(i, now - span + span * i // max(1, config.orders))
+
+    def add_order(self, number: int, created: int | None = None) -> dict:
+        """
+        Добавляет заказ (например, чтобы имитировать новый заказ между циклами опроса)
+        """
+        order_id = f'T3JkZXI{number:08d}'
+        entry_ids = []
+        total = 0
+        for j in range(self.config.entries_per_order):
+            entry_id = f'{order_id}e{j}'
+            price = self.random.randint(10, 500) * 100
+            total += price
+            self.entries[entry_id] = {
+                'order_id': order_id, 'quantity': 1, 'totalPrice': price,
+                'product_id': f'mp{self.random.randrange(self.config.products)}',
+            }
+            entry_ids.append(entry_id)
+        state = STATES[number % len(STATES)]
+        order = {
+            'id': order_id,
+            'entries': entry_ids,
+            'attributes': {
+                'code': str(500000000 + number),
+                'totalPrice': total,
+                'status': 'ACCEPTED_BY_MERCHANT',
+                'state': state,
+                'creationDate': created or int(time.time() * 1000),
+                'deliveryMode': 'DELIVERY_PICKUP' if state == 'KASPI_DELIVERY' else 'DELIVERY_LOCAL',
+                'deliveryType': 'PICKUP' if state == 'KASPI_DELIVERY' else 'DELIVERY',
+                'signatureRequired': False,
+                'paymentMethod': 'PAY_WITH_CREDIT',
+                'assembled': False,
+                'customer': {'firstName': 'Клиент', 'lastName': str(number), 'cellPhone': f'77{number:08d}'},
+                'deliveryAddress': {'town': 'Алматы', 'streetName': 'Абая', 'streetNumber': str(number % 200)},
+                'kaspiDelivery': {'courierTransmissionDate': None, 'waybill': None} if state == 'KASPI_DELIVERY' else None,
+            },
+        }
+        self.orders[order_id] = order
+        return order
+
+    # Ответы в формате JSON:API
+
+    def _order_resource(self, order: dict) -> dict:
+        return {
+            'type': 'orders',
+            'id': order['id'],
+            'attributes': order['attributes'],
+            'relationships': {'entries': {
+                'links': {'related': f'{self.base_url}orders/{order["id"]}/entries'},
+                'data': [{'type': 'orderentries', 'id': entry_id} for entry_id in order['entries']],
+            }},
+        }
+
+    def _entry_resource(self, entry_id: str) -> dict:
+        entry = self.entries[entry_id]
+        return {
+            'type': 'orderentries',
+            'id': entry_id,
+            'attributes': {'quantity': entry['quantity'], 'totalPrice': entry['totalPrice']},
+            'relationships': {'product': {'data': {'type': 'masterproducts', 'id': entry['product_id']}}},
+        }
+
+    def _product_resource(self, product_id: str) -> dict:
+        return {'type': 'masterproducts', 'id': product_id, 'attributes': self.products[product_id]}
+
+    def product_url(self, number: int) -> str:
+        return f'{self.site_url}/shop/p/tovar-{number}/'
+
+    def change_pages(self, numbers, fraction: float) -> int:
+        """
+        Меняет цены у доли fraction товаров из numbers; возвращает число изменённых страниц
+        """
+        numbers = list(numbers)
+        changed = self.random.sample(numbers, int(len(numbers) * fraction))
+        for number in changed:
+            self.page_versions[number] = self.page_versions.get(number, 0) + 1
+            self.page_modified[number] = time.time()
+        return len(changed)
+
+    def _product_page(self, number: int, version: int = 0) -> str:
+        rng = random.Random(number * 1000 + version)
+        base = 1000 * rng.randint(5, 300)
+        prices = sorted(base + 100 * rng.randint(0, 50) for _ in range(self.config.sellers))
+        names = [f'Продавец {rng.randint(1, 500)}' for _ in prices]
+        sellers = ''.join(
+            f'<div class="seller-item"><a class="seller-name">{name}</a>'
+            f'<div class="price">{price:,} ₸</div><button>В корзину</button></div>'.replace(',', ' ')
+            for name, price in zip(names, prices)
+        )
+        state = ''
+        if self.config.embedded_state:
+            item = {
+                'card': {'id': str(number), 'title': f'Товар {number}', 'price': prices[0]},
+                'offers': [{'merchantName': name, 'price': price} for name, price in zip(names, prices)],
+            }
+            state = f'<script>BACKEND.components.item = {json.dumps(item, ensure_ascii=False)};</script>'
+        return (
+            f'<html><head><title>Товар {number}</title><meta name="csrf-token" content="{uuid.uuid4().hex}">{state}</head><body>'
+            + f'<h1>Товар {number}</h1><div data-test="product-price">{prices[0]:,} ₸</div>'.replace(',', ' ')
+            + f'<div class="sellers">{sellers}</div>'
+            + '<footer>' + 'Описание товара. ' * 200 + '</footer></body></html>'
+        )
+
+    # Обработчики
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        config = self.config
+        self.stats.requests += 1
+        resource = request.match_info.route.resource
+        endpoint = f'{request.method} {(resource.canonical if resource else request.path).removeprefix(API_PREFIX)}'
+        self.stats.by_endpoint[endpoint] = self.stats.by_endpoint.get(endpoint, 0) + 1
+        if config.latency:
+            await asyncio.sleep(max(0.0, self.random.gauss(config.latency, config.latency * config.jitter / 2)))
+        roll = self.random.random()
+        if roll < config.throttle_rate:
+            self.stats.throttled += 1
+            return web.json_response(
+                {'errors': [{'title': 'Too Many Requests'}]}, status=429,
+                headers={'Retry-After': f'{config.retry_after:g}'},
+            )
+        if roll < config.throttle_rate + config.error_rate:
+            self.stats.errors += 1
+            return web.json_response({'errors': [{'title': 'Internal Server Error'}]}, status=500)
+        if request.path.startswith(API_PREFIX) and not request.headers.get('X-Auth-Token'):
+            return web.json_response({'errors': [{'title': 'Unauthorized'}]}, status=401)
+        return await handler(request)
+
+    async def list_orders(self, request: web.Request) -> web.Response:
+        query = request.query
+        number = int(query.get('page[number]', 0))
+        size = int(query.get('page[size]', 20))
+        if size > self.config.max_page_size:
+            return web.json_response({'errors': [{'title': f'page[size] must be <= {self.config.max_page_size}'}]}, status=400)
+        include = query.get('include[orders]')
+        if include and (not self.config.include or include != 'entries.product'):
+            return web.json_response({'errors': [{'title': f'include {include} is not supported'}]}, status=400)
+
+        date_from = int(query.get('filter[orders][creationDate][$ge]', 0))
+        date_to = int(query.get('filter[orders][creationDate][$le]', 2 ** 62))
+        filters = {
+            key: query.get(f'filter[orders][{key}]')
+            for key in ('state', 'status', 'code', 'deliveryType')
+        }
+        matched = [
+            order for order in self.orders.values()
+            if date_from <= order['attributes']['creationDate'] <= date_to
+            and all(value is None or order['attributes'].get(key) == value for key, value in filters.items())
+        ]
+        page = matched[number * size:(number + 1) * size]
+        body = {
+            'data': [self._order_resource(order) for order in page],
+            'meta': {'pageCount': (len(matched) + size - 1) // size, 'totalCount': len(matched)},
+        }
+        if include:
+            entry_ids = [entry_id for order in page for entry_id in order['entries']]
+            product_ids = {self.entries[entry_id]['product_id'] for entry_id in entry_ids}
+            body['included'] = (
+                [self._entry_resource(entry_id) for entry_id in entry_ids]
+                + [self._product_resource(product_id) for product_id in sorted(product_ids)]
+            )
+        return web.json_response(body)
+
+    def _get_order(self, request: web.Request) -> dict:
+        order = self.orders.get(request.match_info['order_id'])
+        if order is None:
+            raise web.HTTPNotFound(text='{"errors": [{"title": "Not Found"}]}', content_type='application/json')
+        return order
+
+    async def get_order(self, request: web.Request) -> web.Response:
+        return web.json_response({'data': self._order_resource(self._get_order(request))})
+
+    async def order_entries(self, request: web.Request) -> web.Response:
+        order = self._get_order(request)
+        return web.json_response({'data': [self._entry_resource(entry_id) for entry_id in order['entries']]})
+
+    async def entry_product(self, request: web.Request) -> web.Response:
+        entry = self.entries.get(request.match_info['entry_id'])
+        if entry is None:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': self._product_resource(entry['product_id'])})
+
+    async def master_product(self, request: web.Request) -> web.Response:
+        product_id = request.match_info['product_id']
+        if product_id not in self.products:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': self._product_resource(product_id)})
+
+    async def patch_order(self, request: web.Request) -> web.Response:
+        order = self._get_order(request)
+        attributes = (await request.json()).get('data', {}).get('attributes', {})
+        if attributes.get('status') == 'ASSEMBLE':
+            order['attributes']['assembled'] = True
+            if order['attributes'].get('kaspiDelivery') is not None:
+                order['attributes']['kaspiDelivery']['waybill'] = f'{self.base_url}waybills/{order["id"]}.pdf'
+        return web.json_response({'data': self._order_resource(order)})
+
+    async def post_order(self, request: web.Request) -> web.Response:
+        data = (await request.json()).get('data', {})
+        order = self.orders.get(data.get('id'))
+        if order is None:
+            raise web.HTTPNotFound()
+        if request.headers.get('X-Security-Code'):
+            order['attributes']['status'] = 'COMPLETED'
+            order['attributes']['state'] = 'ARCHIVE'
+        return web.json_response({'data': self._order_resource(order)})
+
+    async def product_page(self, request: web.Request) -> web.Response:
+        number = int(request.match_info['slug'].rsplit('-', 1)[-1])
+        version = self.page_versions.get(number, 0)
+        headers = {}
+        if self.config.page_validators:
+            headers = {
+                'ETag': f'"p{number}-v{version}"',
+                'Last-Modified': formatdate(self.page_modified.get(number, self.started), usegmt=True),
+            }
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match == headers['ETag'] or (if_none_match is None and request.headers.get('If-Modified-Since') == headers['Last-Modified']):
+                self.stats.not_modified += 1
+                return web.Response(status=304, headers=headers)
+        return web.Response(text=self._product_page(number, version), content_type='text/html', headers=headers)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get(API_PREFIX + 'orders', self.list_orders)
+        app.router.add_post(API_PREFIX + 'orders', self.post_order)
+        app.router.add_get(API_PREFIX + 'orders/{order_id}', self.get_order)
+        app.router.add_patch(API_PREFIX + 'orders/{order_id}', self.patch_order)
+        app.router.add_get(API_PREFIX + 'orders/{order_id}/entries', self.order_entries)
+        app.router.add_get(API_PREFIX + 'orderentries/{entry_id}/product', self.entry_product)
+        app.router.add_get(API_PREFIX + 'masterproducts/{product_id}', self.master_product)
+        app.router.add_get('/shop/p/{slug}/', self.product_page)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+        """
+        Запускает сервер в текущем цикле событий; port=0 — свободный порт. Адрес API — self.base_url
+        """
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        self.base_url = f'http://{host}:{port}{API_PREFIX}'
+        self.site_url = f'http://{host}:{port}'
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--orders', type=int, default=100)
+    parser.add_argument('--entries', type=int, default=2, help='позиций в заказе')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--no-include', action='store_true', help='отвечать 400 на include[orders]')
+    args = parser.parse_args()
+
+    simulator = KaspiSimulator(SimulatorConfig(
+        orders=args.orders, entries_per_order=args.entries, latency=args.latency,
+        max_page_size=args.max_page_size, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, include=not args.no_include,
+    ))
+
+    async def serve():
+        runner = await simulator.start(args.host, args.port)
+        print(f'Симулятор Kaspi API: {simulator.base_url} ({args.orders} заказов)')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
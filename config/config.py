@@ -11,10 +11,131 @@ ADMIN_ID = int(_admin_id) if _admin_id and _admin_id.isdigit() else None
 MONGO_URI = os.getenv('MONGO_URI')
 KASPI_API = os.getenv('KASPI_API')
 
+
+def _parse_shops(value: str | None) -> dict[str, str]:
+    shops = {}
+    for item in (value or '').split(';'):
+        name, _, token = item.partition('=')
+        if name.strip() and token.strip():
+            shops[name.strip()] = token.strip()
+    return shops
+
+
+# Магазины Kaspi: KASPI_SHOPS="Магазин 1=token1;Магазин 2=token2". Без KASPI_SHOPS — один магазин с токеном KASPI_API
+KASPI_SHOPS = _parse_shops(os.getenv('KASPI_SHOPS')) or ({'Kaspi': KASPI_API} if KASPI_API else {})
+# Адрес Kaspi Shop API; для локального симулятора: http://127.0.0.1:8081/shop/api/v2/
+KASPI_API_URL = os.getenv('KASPI_API_URL', 'https://kaspi.kz/shop/api/v2/')
+
 # Интервал проверки заказов (в секундах)
-ORDER_CHECK_INTERVAL = 3600  # Интервал проверки заказов в секундах (например, 3600 = 1 час)
-PRICE_CHECK_INTERVAL = 'hourly'
+ORDER_CHECK_INTERVAL = 3600  # Интервал проверки заказов в секундах (например, 3600 = 1 час); при адаптивном опросе — максимальный
+PRICE_CHECK_INTERVAL = 'hourly'  # '30min', 'hourly' или 'daily'
+PRICE_CHECK_INTERVALS = {'30min': 1800, 'hourly': 3600, 'daily': 24 * 3600}
 NOTIFY_IF_NOT_TOP1 = False
 ORDER_LOOKBACK_DAYS = 4  # Количество дней, за которые ищутся заказы
 
 ORDER_NOTIFY_ENABLED = True
+
+# Максимум одновременных запросов к Kaspi API при загрузке товаров заказов
+KASPI_CONCURRENCY = int(os.getenv('KASPI_CONCURRENCY', 10))
+
+# Общие HTTP-клиенты (пулы соединений) для обращений к Kaspi
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', '1') == '1'
+HTTP_CLIENTS = {
+    # Kaspi Shop API: заказы, накладные, выдача заказов
+    'kaspi_api': {'timeout': 30, 'max_connections': 20, 'max_keepalive_connections': 10, 'keepalive_expiry': 60},
+    # Публичный сайт Kaspi: страницы товаров и PDF накладных
+    'kaspi_site': {'timeout': 30, 'max_connections': 20, 'max_keepalive_connections': 10, 'keepalive_expiry': 30},
+}
+
+# Кэш названий товаров (по ID позиции заказа и ID товара)
+PRODUCT_CACHE_SIZE = 5000  # Максимум записей в памяти
+PRODUCT_CACHE_TTL = 24 * 3600  # Время жизни записи в секундах
+PRODUCT_CACHE_PERSIST = True  # Дублировать кэш в MongoDB, чтобы он переживал перезапуск
+
+# Инкрементальная синхронизация заказов: планировщик запрашивает только заказы новее сохранённой отметки
+ORDER_SYNC_INCREMENTAL = True
+ORDER_SYNC_OVERLAP_MINUTES = 120  # Перекрытие окна для заказов, появившихся с опозданием
+# Раз в этот интервал планировщик перечитывает всё окно ORDER_LOOKBACK_DAYS: изменения старых заказов
+# (сборка, накладная, переход в KASPI_DELIVERY/DELIVERY позже перекрытия) инкрементальный запрос не видит
+ORDER_SYNC_FULL_SWEEP_INTERVAL = 900  # сек
+
+# Состояния заказов, которые проверяет бот (запрашиваются параллельно)
+ORDER_CHECK_STATES = ['KASPI_DELIVERY', 'DELIVERY']
+
+# Ограничение запросов к Kaspi API на стороне бота
+KASPI_RATE_LIMIT = float(os.getenv('KASPI_RATE_LIMIT', 10))  # Запросов в секунду
+KASPI_RATE_BURST = int(os.getenv('KASPI_RATE_BURST', 20))  # Допустимый всплеск запросов
+KASPI_MAX_RETRIES = 3  # Повторов при 429/5xx
+
+# Логирование
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_BODY_SAMPLE_RATE = float(os.getenv('LOG_BODY_SAMPLE_RATE', 0.0))  # Доля ответов API, тело которых пишется на уровне INFO
+LOG_BODY_MAX_CHARS = 2000  # Длинные тела ответов обрезаются до этого размера
+
+# Запрашивать позиции и товары вместе с заказами (JSON:API include). Пустая строка — отключить
+KASPI_ORDERS_INCLUDE = os.getenv('KASPI_ORDERS_INCLUDE', 'entries.product')
+
+# Автомат защиты Kaspi API и снимок заказов в памяти
+KASPI_BREAKER_FAILURES = 5  # Ошибок подряд до приостановки запросов
+KASPI_BREAKER_RESET = 60  # Пауза перед пробным запросом, сек
+KASPI_BREAKER_PROBE_TIMEOUT = 30  # Пробный запрос без ответа дольше этого считается ошибкой, сек
+ORDER_SNAPSHOT_MAX_AGE = 3600  # Снимок магазина старше этого перечитывается целиком (обычно его обновляет планировщик), сек
+ORDER_SNAPSHOT_CHECK_INTERVAL = 60  # Проверка возраста снимка и восстановления Kaspi API, сек
+
+# Очередь исходящих сообщений Telegram
+TELEGRAM_RATE_LIMIT = 25  # Сообщений в секунду на бота (лимит Telegram — 30)
+TELEGRAM_CHAT_INTERVAL = 1.0  # Минимальный интервал между сообщениями в один чат, сек
+TELEGRAM_BATCH_WINDOW = 1.0  # Сколько ждать карточки заказов, чтобы отправить их одним сообщением, сек
+TELEGRAM_QUEUE_SIZE = 1000  # Максимум сообщений в очереди
+TELEGRAM_MAX_RETRIES = 5  # Повторов при сетевых ошибках Telegram
+
+# Адаптивный интервал проверки заказов: пока приходят заказы — ORDER_CHECK_MIN_INTERVAL,
+# без новых заказов интервал растёт в ORDER_CHECK_BACKOFF раз до ORDER_CHECK_INTERVAL
+ORDER_CHECK_MIN_INTERVAL = 300
+ORDER_CHECK_BACKOFF = 2
+ORDER_CHECK_JITTER = 0.1  # Случайный разброс интервала, доля
+ORDER_CHECK_BUSINESS_HOURS = (9, 22)  # Рабочие часы; вне их проверка раз в ORDER_CHECK_INTERVAL
+ORDER_CHECK_TIMEZONE = 'Asia/Almaty'
+
+# Карточки заказов: при изменении заказа править отправленное сообщение, а не слать новое
+ORDER_CARDS_EDIT = True
+ORDER_CARD_TTL_DAYS = 7  # Сколько дней помнить сообщения с карточками
+
+# Режим webhook: если задан WEBHOOK_URL (публичный адрес сервиса), бот получает обновления через
+# встроенный aiohttp-сервер на PORT вместо long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Без него секрет выводится из BOT_TOKEN
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', 8080))
+HEALTH_PATH = os.getenv('HEALTH_PATH', '/health')
+
+# Состояния FSM (незавершённые действия администратора) в MongoDB с кэшем в памяти
+FSM_CACHE_SIZE = 1000  # Записей в кэше
+# Изменения других экземпляров бота кэш узнаёт из change stream MongoDB (нужен реплика-сет). Без него состояние
+# перечитывается из базы через FSM_CACHE_TTL секунд — тогда обновления одного чата должны приходить в один экземпляр
+FSM_CACHE_TTL = 300
+FSM_STATE_TTL = 24 * 3600  # Незавершённое действие сбрасывается через сутки
+FSM_FLUSH_INTERVAL = 0.5  # Изменения за этот интервал записываются одной пачкой, сек
+
+# Аренда роли ведущего в MongoDB: при нескольких экземплярах бота планировщик заказов работает в одном
+LEASE_TTL = 15  # Аренда без продления истекает через, сек
+LEASE_RENEW_INTERVAL = 5  # Продление аренды и попытки её получить, сек
+
+# Проверка цен товаров: страницы загружаются параллельно, с ограничением на каждый сайт
+PRICE_CRAWL_CONCURRENCY = int(os.getenv('PRICE_CRAWL_CONCURRENCY', 32))  # Одновременно проверяемых товаров
+PRICE_CRAWL_HOST_CONCURRENCY = int(os.getenv('PRICE_CRAWL_HOST_CONCURRENCY', 8))  # Запросов к одному сайту одновременно
+PRICE_CRAWL_HOST_RATE = float(os.getenv('PRICE_CRAWL_HOST_RATE', 10))  # Запросов к одному сайту в секунду
+PRICE_CRAWL_BATCH = 500  # Цен в одной записи bulk_write
+# Процессов для разбора страниц товаров вне цикла событий; 0 — разбор в самом цикле
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# История цен и аналитика по ней
+# Мои продавцы — как они называются на странице товара: MERCHANT_NAMES="Магазин 1,Магазин 2".
+# Обязательно для аналитики цен; названия из KASPI_SHOPS не подставляются — это только метки в сообщениях бота
+MERCHANT_NAMES = [name.strip() for name in os.getenv('MERCHANT_NAMES', '').split(',') if name.strip()]
+PRICE_HISTORY_RETENTION_DAYS = 30  # Подробная история, дальше — только дневные агрегаты
+PRICE_HISTORY_DAILY_RETENTION_DAYS = 365
+PRICE_HISTORY_MEMORY_ROWS = 200_000  # Без MongoDB: сколько последних записей истории держать в памяти
+PRICE_ANALYTICS_WINDOW_DAYS = 7  # Окно скользящего минимума и медианы цены топ-1
+PRICE_ANALYTICS_MAX_AGE = 300  # Аналитика по запросу из бота пересчитывается не чаще, сек
@@ -1,5 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from config.config import MONGO_URI
  
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.get_default_database() 
\ No newline at end of file
+# Без MONGO_URI бот работает без базы: db = None, обработчики и сервисы это проверяют
+client = AsyncIOMotorClient(MONGO_URI) if MONGO_URI else None
+db = client.get_default_database() if client is not None else None
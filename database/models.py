@@ -1,5 +1,19 @@
-# products: { name, link, last_price, min_price, last_order_date }
-# orders: { order_id, status, date, product_name }
+# products: { name, link, last_price, min_price, competitors: [{ seller, price }], last_checked_at, page_etag, page_last_modified, page_hash, last_order_date }
+# orders: { order_id, code, status, state, date, products, ...поля заказа, fingerprint, first_seen_at, updated_at }
+# order_sync: { _id: '<shop>:<state>', cursor, swept_at, updated_at }
+# product_cache: { _id: 'entry:<id>' | 'product:<id>', name, product_id, updated_at }
+# order_messages: { _id: '<chat_id>:<message_id>', chat_id, message_id, orders: [{ order_id, fingerprint, label }], updated_at }
+# leases: { _id: name, holder, acquired_at, renewed_at, expires_at }
+# fsm_states: { _id: '<bot_id>:<chat_id>:<user_id>:<thread_id>:<destiny>', state, data, updated_at }
+# price_history (time-series): { ts, meta: { product, seller }, price, rank }
+# price_history_daily (time-series): { ts: начало суток, meta: { product, seller }, min, max, last, best_rank, samples }
  
 PRODUCTS_COLLECTION = 'products'
-ORDERS_COLLECTION = 'orders' 
\ No newline at end of file
+ORDERS_COLLECTION = 'orders'
+PRODUCT_CACHE_COLLECTION = 'product_cache'
+ORDER_SYNC_COLLECTION = 'order_sync'
+ORDER_MESSAGES_COLLECTION = 'order_messages'
+FSM_STATES_COLLECTION = 'fsm_states'
+LEASES_COLLECTION = 'leases'
+PRICE_HISTORY_COLLECTION = 'price_history'
+PRICE_HISTORY_DAILY_COLLECTION = 'price_history_daily'
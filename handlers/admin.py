@@ -1,8 +1,12 @@
 from aiogram import Router, types, F
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from database.db import db
 from database.models import PRODUCTS_COLLECTION
-from config.config import ADMIN_ID, ORDER_NOTIFY_ENABLED, ORDER_CHECK_INTERVAL, PRICE_CHECK_INTERVAL, NOTIFY_IF_NOT_TOP1
+from config.config import (
+    ADMIN_ID, ORDER_NOTIFY_ENABLED, ORDER_CHECK_INTERVAL, ORDER_CHECK_MIN_INTERVAL, ORDER_CHECK_BUSINESS_HOURS,
+    PRICE_CHECK_INTERVAL, NOTIFY_IF_NOT_TOP1,
+)
 from services.order_checker import  order_check_scheduler, show_new_orders
 from utils.keyboards import main_menu_kb, prices_menu_kb, prices_interval_kb, invoices_menu_kb, settings_menu_kb, cancel_kb, confirm_kb
 from loguru import logger
@@ -11,7 +15,13 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMar
 from aiogram.fsm.state import StatesGroup, State
 from datetime import datetime, timedelta
 from services.invoice_service import create_invoice, download_invoice_pdf
-from services.kaspi_api import get_orders
+from services.order_store import find_order, resolve_order
+from services.order_sync import request_full_sweep
+from services.telegram_queue import telegram_queue
+from services.shops import get_shop, shops
+from services.leader_lease import scheduler_lease
+from services.price_monitor import price_crawler
+from services.price_analytics import price_analytics
 import io
 import mimetypes
 from services.kaspi_order_complete import send_order_code, complete_order
@@ -84,7 +94,8 @@ async def cmd_delete(message: types.Message, state: FSMContext):
             await message.answer('📋 Список товаров пуст.', reply_markup=main_menu_kb())
             return
         text = '\n'.join([f"{idx+1}. <b>{p['name']}</b>" for idx, p in enumerate(products)])
-        await state.update_data(products=products)
+        # В состоянии FSM (оно хранится в MongoDB) — только id и названия, а не документы целиком
+        await state.update_data(products=[[str(p['_id']), p['name']] for p in products])
         await state.set_state('await_delete_number')
         await message.answer(f'🗑️ <b>Удаление товара</b>\nВыберите номер товара для удаления:\n{text}', reply_markup=cancel_kb)
     except Exception as e:
@@ -98,7 +109,17 @@ async def cmd_check_price(message: types.Message):
         await message.answer('⛔️ Доступ запрещён')
         return
     logger.info('Пользователь инициировал проверку цен')
-    await message.answer('🔄 Проверяю цены... (скоро будет доступно)', reply_markup=main_menu_kb())
+    if db is None:
+        await message.answer('❌ База данных недоступна. Проверьте подключение к MongoDB.', reply_markup=main_menu_kb())
+        return
+    await message.answer('🔄 Проверяю цены...', reply_markup=main_menu_kb())
+    try:
+        # Если плановая проверка уже идёт, дожидаемся её результата
+        result = await price_crawler.crawl_in_background()
+        await message.answer(price_crawler.describe(result), reply_markup=main_menu_kb())
+    except Exception as e:
+        logger.error(f'Ошибка при проверке цен: {e}')
+        await message.answer('❌ Ошибка при проверке цен.', reply_markup=main_menu_kb())
 
 @router.message(F.text == 'Проверить заказы')
 async def cmd_check_orders(message: types.Message, bot):
@@ -111,6 +132,11 @@ async def cmd_check_orders(message: types.Message, bot):
     try:
         date_from = (datetime.now() + timedelta(days=1) - timedelta(days=3)).strftime('%Y-%m-%d')
         await show_new_orders(bot, date_from=date_from)
+        # Ручная проверка перезапускает расписание всех магазинов с минимальным интервалом
+        for shop in shops.values():
+            shop.schedule.reset()
+        # Карточки заказов отправляются очередью; итоговое сообщение — после них
+        await telegram_queue.flush(timeout=60)
         await message.answer('', reply_markup=main_menu_kb())
     except Exception as e:
         logger.error(f'Ошибка при проверке заказов: {e}')
@@ -122,7 +148,7 @@ async def cancel_any(message: types.Message, state: FSMContext):
     await state.clear()
     await message.answer('❌ Действие отменено.', reply_markup=main_menu_kb())
 
-@router.message(F.state == 'await_delete_number')
+@router.message(StateFilter('await_delete_number'))
 async def process_delete_number(message: types.Message, state: FSMContext):
     # Проверяем, что пользователь - администратор
     if not message.from_user or message.from_user.id != ADMIN_ID:
@@ -145,13 +171,13 @@ async def process_delete_number(message: types.Message, state: FSMContext):
         logger.warning('Пользователь ввёл некорректный номер товара для удаления')
         await message.answer('⚠️ Введите корректный номер!', reply_markup=cancel_kb)
         return
-    product = products[idx]
-    logger.info(f'Пользователь выбрал товар для удаления: {product["name"]}')
+    _, name = products[idx]
+    logger.info(f'Пользователь выбрал товар для удаления: {name}')
     await state.update_data(delete_idx=idx)
     await state.set_state('await_delete_confirm')
-    await message.answer(f'Удалить <b>{product["name"]}</b>?', reply_markup=confirm_kb)
+    await message.answer(f'Удалить <b>{name}</b>?', reply_markup=confirm_kb)
 
-@router.message(F.state == 'await_delete_confirm')
+@router.message(StateFilter('await_delete_confirm'))
 async def process_delete_confirm(message: types.Message, state: FSMContext):
     # Проверяем, что пользователь - администратор
     if not message.from_user or message.from_user.id != ADMIN_ID:
@@ -167,9 +193,9 @@ async def process_delete_confirm(message: types.Message, state: FSMContext):
         products = data.get('products', [])
         idx = data.get('delete_idx')
         if idx is not None and 0 <= idx < len(products):
-            product = products[idx]
-            logger.info(f'Товар удалён: {product["name"]}')
-            await message.answer(f"🗑️ Товар <b>{product['name']}</b> удалён! (Удаление из базы отключено)", reply_markup=main_menu_kb())
+            _, name = products[idx]
+            logger.info(f'Товар удалён: {name}')
+            await message.answer(f"🗑️ Товар <b>{name}</b> удалён! (Удаление из базы отключено)", reply_markup=main_menu_kb())
         else:
             logger.error('Ошибка удаления товара: индекс вне диапазона')
             await message.answer('⚠️ Ошибка удаления.', reply_markup=main_menu_kb())
@@ -231,6 +257,11 @@ async def check_orders_now(message: types.Message, bot):
     try:
         date_from = (datetime.now() + timedelta(days=1) - timedelta(days=3)).strftime('%Y-%m-%d')
         await show_new_orders(bot, date_from=date_from)
+        # Ручная проверка перезапускает расписание всех магазинов с минимальным интервалом
+        for shop in shops.values():
+            shop.schedule.reset()
+        # Карточки заказов отправляются очередью; итоговое сообщение — после них
+        await telegram_queue.flush(timeout=60)
         await message.answer('Готово! Если появятся новые заказы, вы увидите их здесь.', reply_markup=await orders_menu_kb())
     except Exception as e:
         logger.error(f'Ошибка при проверке заказов: {e}')
@@ -245,10 +276,11 @@ async def toggle_order_notifications(message: types.Message, bot):
     global order_notify_task, order_notify_enabled
     if not order_notify_enabled:
         # Включаем уведомления
-        if order_notify_task is None or order_notify_task.done():
-            order_notify_task = asyncio.create_task(order_check_scheduler(bot))
+        # Планировщик запускается через аренду: при нескольких экземплярах бота он работает только в одном
+        if not scheduler_lease.running and (order_notify_task is None or order_notify_task.done()):
+            order_notify_task = asyncio.create_task(scheduler_lease.run(lambda: order_check_scheduler(bot)))
         order_notify_enabled = True
-        await message.answer('🔔 Уведомления о заказах включены. Теперь бот будет проверять заказы каждый час.', reply_markup=await orders_menu_kb())
+        await message.answer(f'🔔 Уведомления о заказах включены. Бот проверяет заказы каждые {ORDER_CHECK_MIN_INTERVAL // 60}–{ORDER_CHECK_INTERVAL // 60} мин: чаще, пока приходят заказы.', reply_markup=await orders_menu_kb())
     else:
         # Отключаем уведомления
         if order_notify_task and not order_notify_task.done():
@@ -315,6 +347,12 @@ async def toggle_top1_notify(message: types.Message):
         return
     status = 'включены' if NOTIFY_IF_NOT_TOP1 else 'отключены'
     await message.answer(f'🔔 Оповещения о позиции в топе {status}. (Менять можно только в config/settings.py)', reply_markup=prices_menu_kb())
+    try:
+        catalog = await price_analytics.get()
+        await message.answer(catalog.describe_not_top1(), reply_markup=prices_menu_kb())
+    except Exception as e:
+        logger.error(f'Ошибка аналитики цен: {e}')
+        await message.answer('❌ Не удалось получить позиции в выдаче.', reply_markup=prices_menu_kb())
 
 @router.message(F.text == '⬅️ Назад')
 async def back_to_prices_menu(message: types.Message):
@@ -347,14 +385,15 @@ async def set_order_notify_interval(message: types.Message):
     if not message.from_user or message.from_user.id != ADMIN_ID:
         await message.answer('⛔️ Доступ запрещён')
         return
-    current = ORDER_CHECK_INTERVAL
-    text = '⏱ Выберите интервал уведомлений о заказах:'
-    if current == 'hourly':
-        text += '\n(Текущий: раз в час)'
-    elif current == '30min':
-        text += '\n(Текущий: каждые 30 мин)'
-    elif current == 'daily':
-        text += '\n(Текущий: раз в день)'
+    start, end = ORDER_CHECK_BUSINESS_HOURS
+    current = '; '.join(f'{shop.name}: {shop.schedule.describe()}' for shop in shops.values()) or 'магазины не настроены'
+    text = (
+        '⏱ Выберите интервал уведомлений о заказах:\n'
+        f'(Сейчас: {current}; '
+        f'от {ORDER_CHECK_MIN_INTERVAL // 60} до {ORDER_CHECK_INTERVAL // 60} мин, '
+        f'рабочие часы {start}:00–{end}:00; '
+        f'проверяет {scheduler_lease.describe()})'
+    )
     kb = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text='Раз в час')],
@@ -373,10 +412,6 @@ async def order_interval_selected(message: types.Message):
         return
     await message.answer('Изменение интервала отключено. Теперь настройки задаются только в config/settings.py', reply_markup=settings_menu_kb())
 
-@router.message()
-async def fallback_handler(message: types.Message):
-    await message.answer('Пожалуйста, используйте кнопки для работы с ботом.', reply_markup=main_menu_kb())
-
 # Переопределить orders_menu_kb чтобы менять текст кнопки
 async def orders_menu_kb():
     enabled = ORDER_NOTIFY_ENABLED
@@ -400,9 +435,16 @@ async def process_create_invoice_callback(callback: CallbackQuery):
         return
     order_id = callback.data.split(':', 1)[1]
     await callback.answer('Формирую накладную...')
-    result = await create_invoice(order_id)
+    # Магазин заказа — по снимку или сохранённому заказу, без запросов к Kaspi API
+    order = await find_order(order_id)
+    shop = get_shop(order.shop if order else None)
+    result = await create_invoice(order_id, shop=shop)
     if result.get('success', True) and (not result.get('error')):
         await callback.message.answer(f'🧾 Накладная для заказа {order_id} успешно сформирована!')
+        # Ближайшая проверка перечитает всё окно заказов магазина, и карточка заменит кнопку ссылкой на накладную
+        await request_full_sweep(shop.name if shop else None)
+        if shop:
+            shop.schedule.reset()
     else:
         await callback.message.answer(f'❌ Ошибка при формировании накладной для заказа {order_id}: {result.get("error", result)}')
 
@@ -414,18 +456,18 @@ async def process_download_invoice_callback(callback: CallbackQuery):
         return
     order_id = callback.data.split(':', 1)[1]
     await callback.answer('Скачиваю накладную...')
-    # Получаем заказ по order_id
-    orders = await get_orders()
-    order = next((o for o in orders if o.get('order_id') == order_id or o.get('code') == order_id), None)
+    # Получаем заказ по order_id: из локального индекса или одним запросом к API
+    order = await resolve_order(order_id, required=('waybill',))
     if not order:
         await callback.message.answer(f'❌ Заказ {order_id} не найден.')
         return
-    waybill_url = order.get('waybill')
-    if not waybill_url:
-        # Попробуем достать из kaspiDelivery, если есть
-        waybill_url = order.get('kaspiDelivery', {}).get('waybill')
+    waybill_url = order.waybill
     if not waybill_url:
-        await callback.message.answer(f'❌ У заказа {order_id} нет PDF накладной.')
+        shop = get_shop(order.shop)
+        if shop and shop.breaker.is_open:
+            await callback.message.answer(f'⚠️ Kaspi API временно недоступен, накладная заказа {order_id} ещё не загружена. Попробуйте позже.')
+        else:
+            await callback.message.answer(f'❌ У заказа {order_id} нет PDF накладной.')
         return
     try:
         pdf_bytes = await download_invoice_pdf(waybill_url)
@@ -461,16 +503,16 @@ async def process_give_order_callback(callback: CallbackQuery, state: FSMContext
         if callback.message:
             await callback.message.answer('❌ Не удалось определить ID заказа.')
         return
-    # Получаем список заказов, ищем нужный
-    orders = await get_orders()
-    order = next((o for o in orders if o.get('order_id') == order_id or o.get('code') == order_id), None)
+    # Получаем заказ из локального индекса или одним запросом к API
+    order = await resolve_order(order_id, required=('code',))
     if not order:
         if callback.message:
             await callback.message.answer(f'❌ Заказ {order_id} не найден.')
         return
-    order_code = order.get('code')
+    order_code = order.code
     # 1. Отправляем код клиенту через Kaspi API
-    result = await send_order_code(order_id, order_code)
+    shop = get_shop(order.shop)
+    result = await send_order_code(order_id, order_code, shop=shop)
     if result.get('error'):
         if callback.message:
             await callback.message.answer(f'❌ Ошибка при отправке кода клиенту: {result["error"]}')
@@ -478,10 +520,10 @@ async def process_give_order_callback(callback: CallbackQuery, state: FSMContext
     if callback.message:
         await callback.message.answer('✅ Код для выдачи заказа отправлен клиенту в Kaspi.kz. Попросите клиента назвать код из приложения и введите его сюда:')
     # Ждём следующий текст от админа как код
-    await state.update_data(order_id=order_id, order_code=order_code)
+    await state.update_data(order_id=order_id, order_code=order_code, shop=shop.name if shop else None)
     await state.set_state('await_security_code')
 
-@router.message(F.state == 'await_security_code')
+@router.message(StateFilter('await_security_code'))
 async def process_security_code(message: types.Message, state: FSMContext):
     if not message.from_user or message.from_user.id != ADMIN_ID:
         await message.answer('⛔️ Доступ запрещён')
@@ -495,9 +537,14 @@ async def process_security_code(message: types.Message, state: FSMContext):
     order_code = data.get('order_code')
     security_code = message.text.strip()
     # 2. Завершаем заказ с кодом клиента
-    result = await complete_order(order_id, order_code, security_code)
+    result = await complete_order(order_id, order_code, security_code, shop=get_shop(data.get('shop')))
     if result.get('error'):
         await message.answer(f'❌ Ошибка при завершении заказа: {result["error"]}', reply_markup=main_menu_kb())
     else:
         await message.answer(f'✅ Заказ {order_code} успешно выдан! Статус: {result.get("data", {}).get("attributes", {}).get("status", "-")}', reply_markup=main_menu_kb())
-    await state.clear() 
\ No newline at end of file
+    await state.clear() 
+
+# Последним: иначе перехватит сообщения обработчиков выше по состоянию FSM
+@router.message()
+async def fallback_handler(message: types.Message):
+    await message.answer('Пожалуйста, используйте кнопки для работы с ботом.', reply_markup=main_menu_kb())
@@ -1,11 +1,20 @@
 import asyncio
+from contextlib import asynccontextmanager
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
-from config.config import BOT_TOKEN, ADMIN_ID
+from config.config import BOT_TOKEN, ADMIN_ID, WEBHOOK_URL
 from loguru import logger
 from handlers import admin
 from services.order_checker import order_check_scheduler
+from services.orders_snapshot import orders_snapshot
+from services.http_client import init_http_clients, close_http_clients
+from services.kaspi_parser import close_parse_pool
+from services.telegram_queue import telegram_queue
+from services.fsm_storage import MongoStorage
+from services.leader_lease import scheduler_lease, price_lease
+from services.price_monitor import price_crawler
+from services.webhook import run_webhook
+from utils.log import setup_logging
 from aiogram.client.default import DefaultBotProperties
 from utils.keyboards import main_menu_kb
 
@@ -24,11 +33,38 @@ def admin_only(handler):
         return await handler(*args, **kwargs)
     return wrapper
 
+@asynccontextmanager
+async def background_tasks(bot):
+    """
+    Фоновые задачи бота (планировщик заказов с обновлением снимка и проверка цен — только в ведущем
+    экземпляре); при выходе они отменяются, очередь Telegram отправляется до конца, закрываются HTTP-клиенты
+    и пул разбора страниц
+    """
+    async def check_orders():
+        await asyncio.gather(order_check_scheduler(bot), orders_snapshot.run())
+
+    await init_http_clients()
+    tasks = [
+        asyncio.create_task(scheduler_lease.run(check_orders)),
+        asyncio.create_task(price_lease.run(lambda: price_crawler.run(bot=bot))),
+    ]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await telegram_queue.close()
+        await close_http_clients()
+        close_parse_pool()
+
 async def main():
+    setup_logging()
     if not BOT_TOKEN:
         raise ValueError('BOT_TOKEN не задан в config/config.py или .env')
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=MemoryStorage())
+    # Состояния FSM в MongoDB: незавершённые действия переживают перезапуск
+    dp = Dispatcher(storage=MongoStorage())
     dp.include_router(admin.router)
 
     @dp.message(Command('start'))
@@ -36,9 +72,20 @@ async def main():
     async def start_cmd(message: types.Message, **kwargs):
         await message.answer('👋 Привет! Это приватный Kaspi-бот.', reply_markup=main_menu_kb())
 
-    logger.info('Бот запущен')
-    asyncio.create_task(order_check_scheduler(bot))
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK_URL:
+            logger.info('Бот запущен (webhook)')
+            await run_webhook(dp, bot, background_tasks(bot))
+        else:
+            logger.info('Бот запущен (long polling)')
+            async with background_tasks(bot):
+                # Вебхук, оставшийся от запуска в режиме webhook, мешает getUpdates
+                await bot.delete_webhook()
+                await dp.start_polling(bot)
+    finally:
+        # Состояния FSM, ещё не записанные в MongoDB
+        await dp.storage.close()
+        await logger.complete()
 
 if __name__ == '__main__':
     asyncio.run(main()) 
\ No newline at end of file
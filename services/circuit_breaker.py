@@ -0,0 +1,78 @@
+import time
+from loguru import logger
+
+
+class CircuitOpenError(Exception):
+    """
+    API временно считается недоступным: запрос не отправлялся
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f'{name} временно недоступен, повтор через {retry_in:.0f} с')
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты: после failure_threshold ошибок подряд запросы сразу отклоняются (open)
+    на reset_timeout секунд, затем пропускается один пробный запрос (half_open).
+    Успех пробного запроса закрывает автомат, ошибка — снова открывает. Пробный запрос, который
+    завершился без ответа (отмена, другая ошибка), освобождается release_probe; зависший дольше
+    probe_timeout секунд не мешает следующему.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, probe_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_request(self) -> bool:
+        """
+        Разрешает запрос или выбрасывает CircuitOpenError; True — этот запрос пробный
+        """
+        if self.state == 'closed':
+            return False
+        now = time.monotonic()
+        retry_in = self.reset_timeout - (now - self.opened_at)
+        if self.state == 'open' and retry_in <= 0:
+            self.state = 'half_open'
+        if self.state == 'half_open':
+            if self._probe_started is None or now - self._probe_started > self.probe_timeout:
+                self._probe_started = now
+                return True
+            retry_in = self.probe_timeout - (now - self._probe_started)
+        raise CircuitOpenError(self.name, max(retry_in, 0))
+
+    def release_probe(self):
+        """
+        Пробный запрос завершился без результата: следующий запрос снова станет пробным
+        """
+        self._probe_started = None
+
+    def record_success(self):
+        if self.state != 'closed':
+            logger.info(f'{self.name}: API снова отвечает, автомат закрыт')
+        self.state = 'closed'
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_started = None
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.warning(f'{self.name}: {self.failures} ошибок подряд, запросы приостановлены на {self.reset_timeout:.0f} с')
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        return {'state': self.state, 'failures': self.failures}
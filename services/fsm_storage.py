@@ -0,0 +1,270 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from loguru import logger
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+from config.config import FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_STATE_TTL, FSM_FLUSH_INTERVAL
+from database.db import db
+from database.models import FSM_STATES_COLLECTION
+
+FLUSH_RETRY_DELAY = 5
+
+
+class FsmRecord:
+    __slots__ = ('state', 'data', 'updated_at', 'cached_at', 'dirty')
+
+    def __init__(self, state: str | None = None, data: dict | None = None, updated_at: float | None = None):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at or time.time()
+        self.cached_at = time.monotonic()
+        self.dirty = False
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class MongoStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в MongoDB (FSM_STATES_COLLECTION), чтобы незавершённые действия
+    (ввод кода выдачи, удаление товара) переживали перезапуск и были видны другим экземплярам бота.
+    Чтение идёт из ограниченного LRU-кэша в памяти (cache_size записей), запись — сразу в кэш, а в MongoDB
+    пачкой из фоновой задачи раз в flush_interval. Записи, изменённые в базе другими экземплярами бота,
+    вычёркиваются из кэша по change stream коллекции; если он недоступен (MongoDB без реплика-сета),
+    запись перечитывается из базы через cache_ttl секунд. Состояния, не менявшиеся state_ttl секунд,
+    считаются устаревшими и удаляются (в базе — TTL-индексом). Без MongoDB работает как MemoryStorage
+    с тем же ограничением и TTL; пустые состояния тогда не кэшируются.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL,
+                 state_ttl: float = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self._records: OrderedDict[str, FsmRecord] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._indexes_ready = False
+        self._loop = None
+        self._wakeup: asyncio.Event | None = None
+        self._flusher: asyncio.Task | None = None
+        self._watcher: asyncio.Task | None = None
+        self.watching = False
+        self._generation = 0  # Растёт с каждым изменением из change stream
+        self.counters = {'hits': 0, 'loads': 0, 'expired': 0, 'flushes': 0, 'writes': 0, 'invalidated': 0}
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f'{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ""}:{key.destiny}'
+
+    def _expired(self, record: FsmRecord) -> bool:
+        return time.time() - record.updated_at > self.state_ttl
+
+    async def _record(self, key: StorageKey) -> FsmRecord:
+        storage_key = self._key(key)
+        record = self._records.get(storage_key)
+        if db is not None:
+            self._ensure_watcher()
+        fresh = record is not None and (
+            record.dirty or db is None or self.watching or time.monotonic() - record.cached_at < self.cache_ttl
+        )
+        if fresh:
+            self._records.move_to_end(storage_key)
+            self.counters['hits'] += 1
+        else:
+            record = await self._load(storage_key)
+        if not record.empty and self._expired(record):
+            self.counters['expired'] += 1
+            record.state, record.data = None, {}
+            self._mark_dirty(storage_key, record)
+        return record
+
+    async def _load(self, storage_key: str) -> FsmRecord:
+        record = FsmRecord()
+        if db is None:
+            # В памяти пустая запись ничего не хранит: не занимаем ею место незавершённых действий
+            return record
+        self.counters['loads'] += 1
+        generation = self._generation
+        try:
+            doc = await db[FSM_STATES_COLLECTION].find_one({'_id': storage_key})
+            if doc:
+                record = FsmRecord(doc.get('state'), doc.get('data'), doc['updated_at'].replace(tzinfo=timezone.utc).timestamp())
+        except Exception as e:
+            logger.warning(f'Ошибка чтения состояния FSM {storage_key} из MongoDB: {e}')
+        # Пока документ читался, пришли изменения: прочитанное могло устареть, не кэшируем
+        if generation == self._generation:
+            self._put(storage_key, record)
+        return record
+
+    def _put(self, storage_key: str, record: FsmRecord):
+        self._records[storage_key] = record
+        self._records.move_to_end(storage_key)
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        # Незаписанные состояния не вытесняются, пока их не сохранит фоновая задача
+        evicted = []
+        for candidate in self._records:
+            if candidate not in self._dirty:
+                evicted.append(candidate)
+                if len(evicted) == excess:
+                    break
+        for candidate in evicted:
+            del self._records[candidate]
+
+    def _mark_dirty(self, storage_key: str, record: FsmRecord):
+        record.dirty = True
+        self._put(storage_key, record)
+        if db is None:
+            if record.empty:
+                self._records.pop(storage_key, None)
+            return
+        self._dirty.add(storage_key)
+        self._ensure_flusher()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        record.updated_at = time.time()
+        self._mark_dirty(self._key(key), record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = copy.deepcopy(data)
+        record.updated_at = time.time()
+        self._mark_dirty(self._key(key), record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return copy.deepcopy((await self._record(key)).data)
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flusher = None
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def _ensure_watcher(self):
+        # Завершившийся сам watcher означает, что change stream не поддерживается: работаем по cache_ttl
+        watcher = self._watcher
+        if watcher is None or watcher.get_loop() is not asyncio.get_running_loop() or watcher.cancelled():
+            self._watcher = asyncio.create_task(self._watch())
+
+    def _drop_clean(self):
+        self._generation += 1
+        for storage_key in [key for key, record in self._records.items() if not record.dirty]:
+            del self._records[storage_key]
+
+    async def _watch(self):
+        """
+        Вычёркивает из кэша записи, изменённые в базе (в том числе этим экземпляром — следующее чтение
+        просто перечитает их). Пока поток переподключается, кэш живёт по cache_ttl
+        """
+        while True:
+            try:
+                async with db[FSM_STATES_COLLECTION].watch() as stream:
+                    # События, пропущенные до подключения, неизвестны: чистые записи перечитаются
+                    self._drop_clean()
+                    self.watching = True
+                    async for change in stream:
+                        self._generation += 1
+                        storage_key = change.get('documentKey', {}).get('_id')
+                        record = self._records.get(storage_key)
+                        if record is not None and not record.dirty:
+                            del self._records[storage_key]
+                            self.counters['invalidated'] += 1
+            except OperationFailure as e:
+                if e.code == 40573:  # Change stream доступен только в реплика-сете
+                    logger.warning(f'Change stream состояний FSM недоступен, кэш перечитывается раз в {self.cache_ttl} с: {e}')
+                    return
+                logger.warning(f'Ошибка change stream состояний FSM: {e}')
+            except Exception as e:
+                logger.warning(f'Ошибка change stream состояний FSM: {e}')
+            finally:
+                self.watching = False
+            await asyncio.sleep(FLUSH_RETRY_DELAY)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Изменения, пришедшие за flush_interval, уходят одним bulk_write
+            await asyncio.sleep(self.flush_interval)
+            if not await self.flush():
+                # MongoDB недоступна: повторяем реже, состояния пока живут в кэше
+                await asyncio.sleep(FLUSH_RETRY_DELAY)
+                self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """
+        Записывает изменённые состояния в MongoDB одной пачкой; False — запись не удалась
+        """
+        if not self._dirty or db is None:
+            return True
+        keys, self._dirty = self._dirty, set()
+        operations = []
+        for storage_key in keys:
+            record = self._records.get(storage_key)
+            if record is None:
+                continue
+            record.dirty = False
+            record.cached_at = time.monotonic()
+            if record.empty:
+                operations.append(DeleteOne({'_id': storage_key}))
+            else:
+                operations.append(UpdateOne({'_id': storage_key}, {'$set': {
+                    'state': record.state,
+                    'data': record.data,
+                    'updated_at': datetime.utcfromtimestamp(record.updated_at),
+                }}, upsert=True))
+        if not operations:
+            return True
+        try:
+            collection = db[FSM_STATES_COLLECTION]
+            if not self._indexes_ready:
+                await collection.create_index('updated_at', expireAfterSeconds=int(self.state_ttl))
+                self._indexes_ready = True
+            await collection.bulk_write(operations, ordered=False)
+            self.counters['flushes'] += 1
+            self.counters['writes'] += len(operations)
+            return True
+        except Exception as e:
+            logger.warning(f'Ошибка записи состояний FSM в MongoDB ({len(operations)}): {e}')
+            # Повторим с ближайшей пачкой, если состояние не изменилось ещё раз
+            for storage_key in keys:
+                record = self._records.get(storage_key)
+                if record is not None:
+                    record.dirty = True
+                    self._dirty.add(storage_key)
+            return False
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+            self.watching = False
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.counters, 'cached': len(self._records), 'pending': len(self._dirty), 'watching': self.watching}
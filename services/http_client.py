@@ -0,0 +1,70 @@
+import httpx
+from loguru import logger
+from config.config import HTTP_CLIENTS, HTTP2_ENABLED
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Один долгоживущий клиент на сервис: соединения (TCP+TLS) переиспользуются между запросами
+_clients: dict[str, httpx.AsyncClient] = {}
+# Подменный транспорт для бенчмарков и локального симулятора
+_transport = None
+
+
+def _create_client(service: str) -> httpx.AsyncClient:
+    settings = HTTP_CLIENTS.get(service, {})
+    limits = httpx.Limits(
+        max_connections=settings.get('max_connections', 10),
+        max_keepalive_connections=settings.get('max_keepalive_connections', 5),
+        keepalive_expiry=settings.get('keepalive_expiry', 30),
+    )
+    http2 = HTTP2_ENABLED and HTTP2_AVAILABLE and _transport is None
+    logger.info(f'Создан HTTP-клиент {service}: {limits}, http2={http2}')
+    return httpx.AsyncClient(
+        timeout=settings.get('timeout', 30),
+        limits=limits,
+        http2=http2,
+        transport=_transport,
+    )
+
+
+def get_client(service: str = 'kaspi_api') -> httpx.AsyncClient:
+    """
+    Возвращает общий HTTP-клиент сервиса. Если init_http_clients ещё не вызывался, клиент создаётся при первом обращении.
+    """
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        client = _clients[service] = _create_client(service)
+    return client
+
+
+async def init_http_clients():
+    """
+    Создаёт клиенты всех сервисов из HTTP_CLIENTS. Вызывается при старте бота.
+    """
+    if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+        logger.warning('HTTP/2 включён, но пакет h2 не установлен — используется HTTP/1.1')
+    for service in HTTP_CLIENTS:
+        get_client(service)
+
+
+async def close_http_clients():
+    """
+    Закрывает все клиенты и их пулы соединений. Вызывается при остановке бота.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def set_transport(transport):
+    """
+    Подменяет транспорт всех клиентов (например, httpx.MockTransport в бенчмарках)
+    """
+    global _transport
+    await close_http_clients()
+    _transport = transport
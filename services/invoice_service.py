@@ -1,17 +1,10 @@
 import httpx
-from config.config import KASPI_API
+from config.config import KASPI_API_URL
 from loguru import logger
+from services.http_client import get_client
+from services.shops import KaspiShop, get_shop
 
-KASPI_API_URL = 'https://kaspi.kz/shop/api/v2/'
-
-headers = {
-    'Content-Type': 'application/vnd.api+json',
-    'X-Auth-Token': KASPI_API,
-    'Accept': 'application/vnd.api+json',
-    'User-Agent': 'KaspiBot/1.0',
-}
-
-async def create_invoice(order_id: str, number_of_space: int = 1):
+async def create_invoice(order_id: str, number_of_space: int = 1, shop: KaspiShop | None = None):
     """
     Формирует накладную (меняет статус заказа на ASSEMBLE) через Kaspi API
     """
@@ -27,21 +20,21 @@ async def create_invoice(order_id: str, number_of_space: int = 1):
         }
     }
     logger.info(f'Запрос формирования накладной для заказа {order_id} через API (numberOfSpace={number_of_space})')
-    if not KASPI_API:
-        logger.error('KASPI_API не настроен! Добавьте KASPI_API в файл .env')
+    shop = shop or get_shop()
+    if shop is None:
+        logger.error('KASPI_API не настроен! Добавьте KASPI_API или KASPI_SHOPS в файл .env')
         return {'success': False, 'error': 'no_api_key'}
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            resp = await client.patch(url, headers=headers, json=payload)
-            resp.raise_for_status()
-            logger.info('Накладная успешно сформирована через API (статус ASSEMBLE)')
-            return resp.json()
-        except httpx.TimeoutException:
-            logger.error('Таймаут при формировании накладной')
-            return {'success': False, 'error': 'timeout'}
-        except Exception as e:
-            logger.error(f'Ошибка при формировании накладной через API: {e}')
-            return {'success': False, 'error': str(e)}
+    try:
+        resp = await shop.limiter.request(get_client(), 'PATCH', url, headers=shop.headers, json=payload, timeout=10)
+        resp.raise_for_status()
+        logger.info('Накладная успешно сформирована через API (статус ASSEMBLE)')
+        return resp.json()
+    except httpx.TimeoutException:
+        logger.error('Таймаут при формировании накладной')
+        return {'success': False, 'error': 'timeout'}
+    except Exception as e:
+        logger.error(f'Ошибка при формировании накладной через API: {e}')
+        return {'success': False, 'error': str(e)}
 
 async def download_invoice_pdf(waybill_url: str, filename: str = None) -> bytes:
     """
@@ -56,7 +49,6 @@ async def download_invoice_pdf(waybill_url: str, filename: str = None) -> bytes:
         'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
         'Referer': 'https://kaspi.kz/'
     }
-    async with httpx.AsyncClient(timeout=30, headers=browser_headers) as client:
-        resp = await client.get(waybill_url)
-        resp.raise_for_status()
-        return resp.content
\ No newline at end of file
+    resp = await get_client('kaspi_site').get(waybill_url, headers=browser_headers, timeout=30)
+    resp.raise_for_status()
+    return resp.content
\ No newline at end of file
@@ -1,20 +1,22 @@
 import os
+import asyncio
+import contextlib
 import httpx
-from config.config import KASPI_API
+import msgspec
+from config.config import KASPI_API_URL, KASPI_CONCURRENCY, KASPI_ORDERS_INCLUDE
+from services.http_client import get_client
+from services.product_cache import product_cache
+from services.shops import KaspiShop, get_shop
+from services.order_model import (
+    Order, OrderEntry, OrderResource, OrdersPage, EntryResource, EntryAttributes, IncludedResource, ResourceId,
+    orders_page_decoder, order_resource_decoder, order_document_decoder, entries_page_decoder, product_document_decoder,
+)
+from utils.log import log_body
 from loguru import logger
 from datetime import datetime, timedelta
 
-KASPI_API_URL = 'https://kaspi.kz/shop/api/v2/'
 
-headers = {
-    'Content-Type': 'application/vnd.api+json',
-    'X-Auth-Token': KASPI_API,
-    'Accept': 'application/vnd.api+json',
-    'User-Agent': 'KaspiBot/1.0',
-}
-
-
-async def get_order_products(order_data: dict) -> list[dict]:
+async def get_order_products(order_data: dict, shop: KaspiShop | None = None) -> list[OrderEntry]:
     """
     Загружает список товаров по ссылке order['relationships']['entries']['links']['related']
     """
@@ -30,55 +32,140 @@ async def get_order_products(order_data: dict) -> list[dict]:
             logger.warning(f"Нет ссылки на товары для заказа {order_data.get('id')}")
             return []
 
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(related_url, headers=headers)
-            response.raise_for_status()
-            data = response.json().get("data", [])
-
-            products = []
-            for item in data:
-                attr = item.get("attributes", {})
-                product = attr.get("product", {})
-                products.append({
-                    "name": product.get("name", "Товар"),
-                    "quantity": attr.get("quantity", 1),
-                    "price": attr.get("totalPrice", 0),
-                })
-
-            return products
+        shop = shop or get_shop()
+        response = await shop.limiter.request(get_client(), 'GET', related_url, headers=shop.headers, timeout=10)
+        response.raise_for_status()
+        data = response.json().get("data", [])
+
+        products = []
+        for item in data:
+            attr = item.get("attributes", {})
+            product = attr.get("product", {})
+            products.append(OrderEntry(
+                name=product.get("name", "Товар"),
+                quantity=attr.get("quantity", 1),
+                price=attr.get("totalPrice", 0),
+            ))
+
+        return products
     except Exception as e:
         logger.error(f"❌ Ошибка при получении товаров для заказа {order_data.get('id')}: {e}")
         return []
 
 
-async def get_product_name(product_id: str):
+async def get_product_name(product_id: str, shop: KaspiShop | None = None):
+    cached = await product_cache.get(f'product:{product_id}')
+    if cached:
+        return cached['name']
     url = f"{KASPI_API_URL}masterproducts/{product_id}"
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            resp = await client.get(url, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            return data.get('data', {}).get('attributes', {}).get('name', 'Товар')
-        except Exception:
+    try:
+        shop = shop or get_shop()
+        resp = await shop.limiter.request(get_client(), 'GET', url, headers=shop.headers, timeout=10)
+        resp.raise_for_status()
+        document = product_document_decoder.decode(resp.content)
+        name = document.data.attributes.name if document.data else None
+        if not name:
             return 'Товар'
+        await product_cache.set(f'product:{product_id}', {'name': name, 'product_id': product_id})
+        return name
+    except Exception:
+        return 'Товар'
 
-aKASPI_API_URL = 'https://kaspi.kz/shop/api/v2/'
+# Сбрасывается, если API отвечает 400 на запрос с include
+_include_supported = True
 
-headers = {
-    'Content-Type': 'application/vnd.api+json',
-    'X-Auth-Token': KASPI_API,
-    'Accept': 'application/vnd.api+json',
-    'User-Agent': 'KaspiBot/1.0',
-}
+async def _fetch_entry_product(client: httpx.AsyncClient, shop: KaspiShop, entry: EntryResource, semaphore: asyncio.Semaphore) -> OrderEntry:
+    """
+    Загружает название товара для одной позиции заказа. Ошибка не прерывает обработку остальных позиций.
+    """
+    entry_id = entry.id
+    name = "Товар"
+    try:
+        async def fetch_product():
+            async with semaphore:
+                product_resp = await shop.limiter.request(client, 'GET', f"{KASPI_API_URL}orderentries/{entry_id}/product", headers=shop.headers)
+            if product_resp.status_code != 200:
+                return None
+            product = product_document_decoder.decode(product_resp.content).data
+            if not product or not product.attributes.name:
+                return None
+            value = {'name': product.attributes.name, 'product_id': product.id}
+            if product.id:
+                await product_cache.set(f"product:{product.id}", value)
+            return value
 
-async def get_orders(page=0, size=20, state=None, status=None, date_from=None, date_to=None, delivery_type=None):
-    url = KASPI_API_URL + 'orders'
+        cached = await product_cache.get_or_fetch(f'entry:{entry_id}', fetch_product)
+        if cached:
+            name = cached['name']
+    except Exception as e:
+        logger.warning(f'Не удалось получить товар для позиции {entry_id}: {e}')
+    return OrderEntry(name=name, quantity=entry.attributes.quantity, price=entry.attributes.totalPrice)
 
+
+async def _fetch_order_products(client: httpx.AsyncClient, shop: KaspiShop, order_id: str, semaphore: asyncio.Semaphore) -> list[OrderEntry]:
+    """
+    Загружает позиции заказа и параллельно их товары. Ошибка одного заказа не прерывает обработку страницы.
+    """
+    try:
+        async with semaphore:
+            entries_resp = await shop.limiter.request(client, 'GET', f"{KASPI_API_URL}orders/{order_id}/entries", headers=shop.headers)
+        entries_resp.raise_for_status()
+        entries = entries_page_decoder.decode(entries_resp.content).data
+        return list(await asyncio.gather(*(_fetch_entry_product(client, shop, entry, semaphore) for entry in entries)))
+    except Exception as e:
+        logger.error(f"❌ Ошибка при получении товаров для заказа {order_id}: {e}")
+        return []
+
+
+def _included_entries(resource: OrderResource, included: dict) -> list[IncludedResource] | None:
+    """
+    Позиции заказа из included составного документа или None, если их там нет (нужна отдельная загрузка)
+    """
+    relationship = resource.relationships.get('entries')
+    if relationship is None or not isinstance(relationship.data, list):
+        return None
+    entries = [included.get((entry.type, entry.id)) for entry in relationship.data]
+    if any(entry is None for entry in entries):
+        return None
+    return entries
+
+
+async def _entry_from_included(client: httpx.AsyncClient, shop: KaspiShop, entry: IncludedResource, included: dict, semaphore: asyncio.Semaphore) -> OrderEntry:
+    """
+    Собирает позицию заказа из included; если товара в included нет, загружает его отдельным запросом
+    """
+    attributes = EntryAttributes(
+        quantity=entry.attributes.get('quantity') or 1,
+        totalPrice=entry.attributes.get('totalPrice') or 0,
+    )
+    relationship = entry.relationships.get('product')
+    product = None
+    if relationship is not None and isinstance(relationship.data, ResourceId):
+        product = included.get((relationship.data.type, relationship.data.id))
+    name = product.attributes.get('name') if product else None
+    if not name:
+        return await _fetch_entry_product(client, shop, EntryResource(id=entry.id, attributes=attributes), semaphore)
+    value = {'name': name, 'product_id': product.id}
+    await product_cache.set(f'entry:{entry.id}', value)
+    await product_cache.set(f'product:{product.id}', value)
+    return OrderEntry(name=name, quantity=attributes.quantity, price=attributes.totalPrice)
+
+
+async def _resolve_order_products(client: httpx.AsyncClient, shop: KaspiShop, resource: OrderResource, included: dict, semaphore: asyncio.Semaphore) -> list[OrderEntry]:
+    entries = _included_entries(resource, included)
+    if entries is None:
+        return await _fetch_order_products(client, shop, resource.id, semaphore)
+    return list(await asyncio.gather(*(_entry_from_included(client, shop, entry, included, semaphore) for entry in entries)))
+
+
+def _build_order_params(page, size, state, status, date_from, date_to, delivery_type) -> dict:
     if not date_from:
-        date_from_dt = datetime.now() - timedelta(days=3)
+        date_from_ms = int((datetime.now() - timedelta(days=3)).timestamp() * 1000)
+    elif isinstance(date_from, int):
+        # Уже готовый timestamp в миллисекундах (инкрементальная синхронизация)
+        date_from_ms = date_from
     else:
-        date_from_dt = datetime.strptime(date_from, '%Y-%m-%d')
-    date_from_ms = int(date_from_dt.timestamp() * 1000)
+        date_from_ms = int(datetime.strptime(date_from, '%Y-%m-%d').timestamp() * 1000)
 
     params = {
         'page[number]': page,
@@ -96,92 +183,208 @@ async def get_orders(page=0, size=20, state=None, status=None, date_from=None, d
         date_to_dt = datetime.strptime(date_to, '%Y-%m-%d')
         date_to_ms = int(date_to_dt.timestamp() * 1000)
         params['filter[orders][creationDate][$le]'] = date_to_ms
+    if KASPI_ORDERS_INCLUDE and _include_supported:
+        params['include[orders]'] = KASPI_ORDERS_INCLUDE
+    return params
+
+
+def _decode_orders(page: OrdersPage, shop: KaspiShop) -> list[OrderResource]:
+    """
+    Заказы страницы по одному: заказ, который не удалось разобрать, пропускается с ошибкой в логе
+    """
+    resources = []
+    for raw in page.data:
+        try:
+            resources.append(order_resource_decoder.decode(raw))
+        except msgspec.ValidationError as e:
+            logger.error(f'Заказ [{shop.name}] пропущен, ответ Kaspi API не разобран: {e}; {bytes(raw)[:300]!r}')
+    return resources
+
+
+async def _fetch_orders_page(client: httpx.AsyncClient, shop: KaspiShop, params: dict, semaphore: asyncio.Semaphore) -> tuple[list[Order], dict]:
+    """
+    Загружает одну страницу заказов вместе с товарами. Возвращает (заказы, meta ответа).
+    Сетевые и HTTP ошибки (кроме 401/403/404) пробрасываются вызывающему.
+    """
+    global _include_supported
+    url = KASPI_API_URL + 'orders'
+    logger.debug('Запрос заказов через Kaspi API: {}, параметры: {}', url, params)
+
+    resp = await shop.limiter.request(client, 'GET', url, headers=shop.headers, params=params)
+    logger.debug('Получен ответ от API: статус {}', resp.status_code)
+    log_body('Текст ответа от Kaspi API', lambda: resp.text)
+
+    if resp.status_code == 400 and 'include[orders]' in params:
+        logger.warning(f'Kaspi API не принимает include={params["include[orders]"]}, позиции будут загружаться отдельно')
+        _include_supported = False
+        params = {key: value for key, value in params.items() if key != 'include[orders]'}
+        resp = await shop.limiter.request(client, 'GET', url, headers=shop.headers, params=params)
 
-    logger.info(f'Запрос заказов через Kaspi API: {url}')
-    logger.info(f'Параметры запроса: {params}')
+    if resp.status_code in [401, 403, 404]:
+        logger.error(f'Ошибка API [{shop.name}]: {resp.status_code}')
+        return [], {'pageCount': 0}
 
-    if not KASPI_API:
-        logger.error('KASPI_API не настроен! Добавьте KASPI_API в файл .env')
+    resp.raise_for_status()
+    page = orders_page_decoder.decode(resp.content)
+    resources = _decode_orders(page, shop)
+    included = {(resource.type, resource.id): resource for resource in page.included}
+
+    # Позиции и товары берутся из included; чего там нет, загружается параллельно,
+    # не более concurrency запросов одновременно
+    products_by_order = await asyncio.gather(*(
+        _resolve_order_products(client, shop, resource, included, semaphore)
+        for resource in resources
+    ))
+    orders = []
+    for resource, products_info in zip(resources, products_by_order):
+        order = Order.from_resource(resource, products_info, shop.name)
+        orders.append(order)
+        logger.debug('Обработан заказ: {} - {} - {}', order.code, order.status, order.state)
+    logger.info('Получена страница {} ({}, {}): {} заказов', params['page[number]'], shop.name, params.get('filter[orders][state]', '-'), len(orders))
+
+    return orders, page.meta
+
+
+async def get_orders(page=0, size=20, state=None, status=None, date_from=None, date_to=None, delivery_type=None, concurrency=None, shop: KaspiShop | None = None):
+    params = _build_order_params(page, size, state, status, date_from, date_to, delivery_type)
+
+    shop = shop or get_shop()
+    if shop is None:
+        logger.error('KASPI_API не настроен! Добавьте KASPI_API или KASPI_SHOPS в файл .env')
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency or KASPI_CONCURRENCY)
+
+    try:
+        orders, _ = await _fetch_orders_page(get_client(), shop, params, semaphore)
+        return orders
+
+    except httpx.TimeoutException:
+        logger.error('Таймаут при запросе к Kaspi API (30 секунд)')
         return []
+    except httpx.HTTPStatusError as e:
+        logger.error(f'HTTP ошибка: {e.response.status_code}')
+        return []
+    except Exception as e:
+        logger.error(f'Ошибка при получении заказов: {e}')
+        return []
+
+
+async def get_order(order_key: str, shop: KaspiShop | None = None) -> Order | None:
+    """
+    Загружает один заказ по ID (GET orders/{id}) или по коду заказа (фильтр по code) за один запрос,
+    без позиций и товаров. Возвращает None, если заказ не найден или API недоступен.
+    """
+    shop = shop or get_shop()
+    if shop is None:
+        logger.error('KASPI_API не настроен! Добавьте KASPI_API или KASPI_SHOPS в файл .env')
+        return None
+    try:
+        if order_key.isdigit():
+            # Коды заказов Kaspi — числа, ID — base64-строки
+            resp = await shop.limiter.request(get_client(), 'GET', KASPI_API_URL + 'orders', headers=shop.headers, params={'filter[orders][code]': order_key})
+        else:
+            resp = await shop.limiter.request(get_client(), 'GET', f'{KASPI_API_URL}orders/{order_key}', headers=shop.headers)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        if order_key.isdigit():
+            resources = _decode_orders(orders_page_decoder.decode(resp.content), shop)
+            resource = resources[0] if resources else None
+        else:
+            resource = order_document_decoder.decode(resp.content).data
+        return Order.from_resource(resource, [], shop.name) if resource else None
+    except Exception as e:
+        logger.error(f'Ошибка при получении заказа {order_key}: {e}')
+        return None
+
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
+async def iter_order_pages(state=None, status=None, date_from=None, date_to=None, delivery_type=None, size=20, concurrency=None, semaphore=None, shop: KaspiShop | None = None):
+    """
+    Асинхронно обходит все страницы заказов и отдаёт каждую страницу сразу после её разбора.
+    Следующая страница загружается, пока вызывающий обрабатывает текущую, поэтому в памяти
+    одновременно находится не больше двух страниц. Ошибки API пробрасываются вызывающему.
+    """
+    shop = shop or get_shop()
+    if shop is None:
+        logger.error('KASPI_API не настроен! Добавьте KASPI_API или KASPI_SHOPS в файл .env')
+        return
+
+    semaphore = semaphore or asyncio.Semaphore(concurrency or KASPI_CONCURRENCY)
+
+    client = get_client()
+
+    def fetch_page(number):
+        params = _build_order_params(number, size, state, status, date_from, date_to, delivery_type)
+        return asyncio.create_task(_fetch_orders_page(client, shop, params, semaphore))
+
+    page = 0
+    next_page = fetch_page(page)
+    try:
+        while next_page is not None:
+            orders, meta = await next_page
+            next_page = None
+            page_count = meta.get('pageCount')
+            has_more = page + 1 < page_count if page_count is not None else len(orders) >= size
+            if has_more:
+                page += 1
+                next_page = fetch_page(page)
+            yield orders
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await next_page
+
+
+async def iter_orders(state=None, status=None, date_from=None, date_to=None, delivery_type=None, size=20, concurrency=None, shop: KaspiShop | None = None):
+    """
+    Асинхронно отдаёт заказы по одному со всех страниц (см. iter_order_pages)
+    """
+    async for orders in iter_order_pages(state, status, date_from, date_to, delivery_type, size, concurrency, shop=shop):
+        for order in orders:
+            yield order
+
+
+async def iter_order_pages_by_states(states, date_from=None, status=None, size=20, concurrency=None, shop: KaspiShop | None = None):
+    """
+    Параллельно обходит заказы нескольких состояний и отдаёт кортежи (state, orders, error) по мере загрузки страниц.
+    Заказ, уже отданный для другого состояния, повторно не отдаётся. date_from может быть словарём {state: date_from}.
+    Ошибка одного состояния приходит как error и не прерывает остальные. Все состояния делят один лимит
+    одновременных запросов, поэтому время цикла почти не растёт с числом состояний.
+    """
+    semaphore = asyncio.Semaphore(concurrency or KASPI_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=len(states))
+    done = object()
+
+    async def pump(state):
+        state_date_from = date_from.get(state) if isinstance(date_from, dict) else date_from
         try:
-            resp = await client.get(url, headers=headers, params=params)
-            logger.info(f'Получен ответ от API: статус {resp.status_code}')
-            logger.info(f'Текст ответа от Kaspi API: {resp.text}')
-
-            if resp.status_code in [401, 403, 404]:
-                logger.error(f'Ошибка API: {resp.status_code}')
-                return []
-
-            resp.raise_for_status()
-            data = resp.json()
-
-            orders = []
-
-            if 'data' in data:
-                for order_data in data['data']:
-                    attributes = order_data.get('attributes', {})
-                    order_id = order_data.get('id')
-
-                    products_info = []
-                    entries_url = f"{KASPI_API_URL}orders/{order_id}/entries"
-                    entries_resp = await client.get(entries_url, headers=headers)
-                    entries = entries_resp.json().get("data", [])
-
-                    for entry in entries:
-                        entry_id = entry['id']
-                        quantity = entry['attributes'].get('quantity', 1)
-                        price = entry['attributes'].get('totalPrice', 0)
-
-                        product_resp = await client.get(f"{KASPI_API_URL}orderentries/{entry_id}/product", headers=headers)
-                        name = "Товар"
-                        if product_resp.status_code == 200:
-                            name = product_resp.json().get("data", {}).get("attributes", {}).get("name", "Товар")
-
-                        products_info.append({
-                            'name': name,
-                            'quantity': quantity,
-                            'price': price
-                        })
-
-                    order = {
-                        'order_id': order_id,
-                        'code': attributes.get('code'),
-                        'product_name': products_info[0]['name'] if products_info else 'Товар',
-                        'products': products_info,
-                        'status': attributes.get('status'),
-                        'state': attributes.get('state'),
-                        'date': attributes.get('creationDate'),
-                        'price': attributes.get('totalPrice'),
-                        'customer': attributes.get('customer', {}),
-                        'totalPrice': attributes.get('totalPrice'),
-                        'deliveryMode': attributes.get('deliveryMode'),
-                        'deliveryType': attributes.get('deliveryType'),
-                        'signatureRequired': attributes.get('signatureRequired'),
-                        'paymentMethod': attributes.get('paymentMethod'),
-                        'paymentStatus': attributes.get('paymentStatus'),
-                        'deliveryAddress': attributes.get('deliveryAddress', {}),
-                        'pickupPoint': attributes.get('pickupPoint', {}),
-                        'comment': attributes.get('comment', ''),
-                        'waybillNumber': attributes.get('waybillNumber'),
-                        'assembled': attributes.get('assembled'),
-                        'courierTransmissionDate': attributes.get('kaspiDelivery', {}).get('courierTransmissionDate'),
-                        'waybill': attributes.get('kaspiDelivery', {}).get('waybill'),
-                    }
-                    orders.append(order)
-                    logger.info(f'Обработан заказ: {order["code"]} - {order["status"]} - {order["state"]}')
-            else:
-                logger.warning('В ответе API нет поля "data"')
-
-            return orders
-
-        except httpx.TimeoutException:
-            logger.error('Таймаут при запросе к Kaspi API (30 секунд)')
-            return []
-        except httpx.HTTPStatusError as e:
-            logger.error(f'HTTP ошибка: {e.response.status_code}')
-            return []
+            async for orders in iter_order_pages(state=state, status=status, date_from=state_date_from, size=size, semaphore=semaphore, shop=shop):
+                await queue.put((state, orders, None))
+        except asyncio.CancelledError:
+            # Потребитель закрыл генератор: очередь никто не читает, и put на полной очереди ждал бы вечно
+            raise
         except Exception as e:
-            logger.error(f'Ошибка при получении заказов: {e}')
-            return []
\ No newline at end of file
+            await queue.put((state, None, e))
+        await queue.put((state, done, None))
+
+    tasks = [asyncio.create_task(pump(state)) for state in states]
+    seen_ids = set()
+    remaining = len(tasks)
+    try:
+        while remaining:
+            state, orders, error = await queue.get()
+            if orders is done:
+                remaining -= 1
+                continue
+            if error is not None:
+                yield state, [], error
+                continue
+            unique = [order for order in orders if order.order_id not in seen_ids]
+            seen_ids.update(order.order_id for order in unique)
+            yield state, unique, None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,18 +1,13 @@
-import httpx
-from config.config import KASPI_API
+from config.config import KASPI_API_URL as KASPI_API_BASE_URL
 from loguru import logger
+from services.http_client import get_client
+from services.shops import KaspiShop, get_shop
+from utils.log import truncate
 
-KASPI_API_URL = 'https://kaspi.kz/shop/api/v2/orders'
+KASPI_API_URL = KASPI_API_BASE_URL + 'orders'
 
-headers_base = {
-    'Content-Type': 'application/vnd.api+json',
-    'X-Auth-Token': KASPI_API,
-    'Accept': 'application/vnd.api+json',
-    'User-Agent': 'KaspiBot/1.0',
-}
 
-
-async def send_order_code(order_id: str, order_code: str) -> dict:
+async def send_order_code(order_id: str, order_code: str, shop: KaspiShop | None = None) -> dict:
     """
     Первый этап: отправить код клиенту (X-Security-Code пустой)
     """
@@ -26,25 +21,27 @@ async def send_order_code(order_id: str, order_code: str) -> dict:
             }
         }
     }
-    headers = headers_base.copy()
+    shop = shop or get_shop()
+    if shop is None:
+        return {"error": "KASPI_API не настроен"}
+    headers = shop.headers.copy()
     headers['X-Security-Code'] = ''
     headers['X-Send-Code'] = 'true'
 
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(KASPI_API_URL, headers=headers, json=payload)
-            if resp.status_code == 200:
-                logger.success(f"[КОД КЛИЕНТУ] Код выдан для заказа {order_id}. Ответ: {resp.text}")
-                return resp.json()
-            else:
-                logger.error(f"[ОШИБКА КОДА КЛИЕНТУ] Статус: {resp.status_code}, Тело: {resp.text}")
-                return {"error": f"Status {resp.status_code}", "response": resp.text}
+        resp = await shop.limiter.request(get_client(), 'POST', KASPI_API_URL, headers=headers, json=payload, timeout=15)
+        if resp.status_code == 200:
+            logger.success(f"[КОД КЛИЕНТУ] Код выдан для заказа {order_id}. Ответ: {truncate(resp.text)}")
+            return resp.json()
+        else:
+            logger.error(f"[ОШИБКА КОДА КЛИЕНТУ] Статус: {resp.status_code}, Тело: {truncate(resp.text)}")
+            return {"error": f"Status {resp.status_code}", "response": resp.text}
     except Exception as e:
         logger.exception(f"[ИСКЛЮЧЕНИЕ КОД КЛИЕНТУ] {e}")
         return {"error": str(e)}
 
 
-async def complete_order(order_id: str, order_code: str, security_code: str) -> dict:
+async def complete_order(order_id: str, order_code: str, security_code: str, shop: KaspiShop | None = None) -> dict:
     """
     Второй этап: подтверждение выдачи заказа с кодом клиента
     """
@@ -58,19 +55,21 @@ async def complete_order(order_id: str, order_code: str, security_code: str) ->
             }
         }
     }
-    headers = headers_base.copy()
+    shop = shop or get_shop()
+    if shop is None:
+        return {"error": "KASPI_API не настроен"}
+    headers = shop.headers.copy()
     headers['X-Security-Code'] = security_code
     headers['X-Send-Code'] = 'true'
 
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(KASPI_API_URL, headers=headers, json=payload)
-            if resp.status_code == 200:
-                logger.success(f"[ЗАКАЗ ЗАВЕРШЁН] Заказ {order_id} выдан. Ответ: {resp.text}")
-                return resp.json()
-            else:
-                logger.error(f"[ОШИБКА ВЫДАЧИ] Статус: {resp.status_code}, Тело: {resp.text}")
-                return {"error": f"Status {resp.status_code}", "response": resp.text}
+        resp = await shop.limiter.request(get_client(), 'POST', KASPI_API_URL, headers=headers, json=payload, timeout=15)
+        if resp.status_code == 200:
+            logger.success(f"[ЗАКАЗ ЗАВЕРШЁН] Заказ {order_id} выдан. Ответ: {truncate(resp.text)}")
+            return resp.json()
+        else:
+            logger.error(f"[ОШИБКА ВЫДАЧИ] Статус: {resp.status_code}, Тело: {truncate(resp.text)}")
+            return {"error": f"Status {resp.status_code}", "response": resp.text}
     except Exception as e:
         logger.exception(f"[ИСКЛЮЧЕНИЕ ВЫДАЧА ЗАКАЗА] {e}")
         return {"error": str(e)}
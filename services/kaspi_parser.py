@@ -1,43 +1,198 @@
-import httpx
+import hashlib
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import msgspec
 from selectolax.parser import HTMLParser
 from loguru import logger
 import traceback
 import asyncio
+from config.config import PARSE_WORKERS
+from services.http_client import get_client
+from utils.log import log_body
 
 async def fetch_kaspi_page(url: str, retries: int = 3, delay: int = 5) -> str:
     logger.info(f'Загрузка страницы Kaspi: {url}')
+    client = get_client('kaspi_site')
     for attempt in range(1, retries + 1):
-        async with httpx.AsyncClient(timeout=30) as client:
-            try:
-                resp = await client.get(url)
-                resp.raise_for_status()
-                logger.info(f'Страница успешно загружена: {url}')
-                return resp.text
-            except Exception as e:
-                logger.error(f'Попытка {attempt}: Ошибка загрузки страницы Kaspi: {url}, тип: {type(e).__name__}, ошибка: {e}\n{traceback.format_exc()}')
-                if attempt < retries:
-                    await asyncio.sleep(delay)
-                else:
-                    raise
+        try:
+            resp = await client.get(url)
+            resp.raise_for_status()
+            logger.debug('Страница успешно загружена: {}', url)
+            return resp.text
+        except Exception as e:
+            logger.error(f'Попытка {attempt}: Ошибка загрузки страницы Kaspi: {url}, тип: {type(e).__name__}, ошибка: {e}\n{traceback.format_exc()}')
+            if attempt < retries:
+                await asyncio.sleep(delay)
+            else:
+                raise
 
-def parse_price_and_competitors(html: str) -> tuple[int, list[dict]]:
-    logger.info('Парсинг HTML для получения цены и конкурентов')
+# Состояние товара, которое сайт встраивает в страницу для своего фронтенда:
+# <script>BACKEND.components.item = {...};</script>. Неизвестные поля пропускаются декодером
+
+
+class StateCard(msgspec.Struct, gc=False):
+    price: int | float | None = None
+
+
+class StateOffer(msgspec.Struct, gc=False):
+    merchantName: str = ''
+    price: int | float | None = None
+
+
+class ProductState(msgspec.Struct):
+    card: StateCard = msgspec.field(default_factory=StateCard)
+    offers: list[StateOffer] | None = None
+
+
+product_state_decoder = msgspec.json.Decoder(ProductState, strict=False)
+PRODUCT_STATE_RE = re.compile(r'BACKEND\.components\.item\s*=\s*(\{.*?\})\s*;?\s*</script>', re.S)
+
+# Разметка страницы (может отличаться, зависит от верстки Kaspi) — запасной путь, если состояния нет
+PRICE_SELECTOR = '[data-test="product-price"]'
+SELLER_ITEM_SELECTOR = 'div.seller-item'
+SELLER_NAME_SELECTOR = '.seller-name'
+SELLER_PRICE_SELECTOR = '.price'
+
+
+def _to_price(text: str) -> int:
+    return int(text.replace('₸', '').replace(' ', '').replace('\xa0', ''))
+
+
+def parse_product_state(html: str) -> tuple[int | None, list[dict] | None] | None:
+    """
+    Цена и продавцы из встроенного состояния страницы; None — состояния нет или оно не читается.
+    Продавцы None — в состоянии их нет, их придётся брать из разметки
+    """
+    match = PRODUCT_STATE_RE.search(html)
+    if match is None:
+        return None
+    try:
+        state = product_state_decoder.decode(match.group(1).encode())
+    except msgspec.DecodeError as e:
+        logger.debug(f'Встроенное состояние страницы не разобрано: {e}')
+        return None
+    price = int(state.card.price) if state.card.price is not None else None
+    if state.offers is None:
+        return price, None
+    competitors = [
+        {'seller': offer.merchantName, 'price': int(offer.price) if offer.price is not None else None}
+        for offer in state.offers
+    ]
+    return price, competitors
+
+
+def parse_markup(html: str) -> tuple[int | None, list[dict]]:
+    """
+    Цена и продавцы из разметки страницы (DOM и CSS-селекторы) — медленный путь для больших страниц
+    """
     tree = HTMLParser(html)
-    # Пример: ищем цену товара
-    price_node = tree.css_first('[data-test="product-price"]')
-    price = int(price_node.text().replace('₸', '').replace(' ', '')) if price_node else None
-    # Пример: ищем конкурентов (может отличаться, зависит от верстки Kaspi)
+    price_node = tree.css_first(PRICE_SELECTOR)
+    price = _to_price(price_node.text()) if price_node else None
     competitors = []
-    for node in tree.css('div.seller-item'):
-        seller = node.css_first('.seller-name')
-        seller_name = seller.text(strip=True) if seller else ''
-        price_node = node.css_first('.price')
-        comp_price = int(price_node.text().replace('₸', '').replace(' ', '')) if price_node else None
-        competitors.append({'seller': seller_name, 'price': comp_price})
-    logger.info(f'Результат парсинга: price={price}, competitors={competitors}')
+    for node in tree.css(SELLER_ITEM_SELECTOR):
+        seller = node.css_first(SELLER_NAME_SELECTOR)
+        price_node = node.css_first(SELLER_PRICE_SELECTOR)
+        competitors.append({
+            'seller': seller.text(strip=True) if seller else '',
+            'price': _to_price(price_node.text()) if price_node else None,
+        })
+    return price, competitors
+
+
+def _complete(state) -> bool:
+    return state is not None and state[0] is not None and state[1] is not None
+
+
+def _merge(state, markup) -> tuple[int, list[dict]]:
+    price, competitors = state if state is not None else (None, None)
+    if markup is not None:
+        price = price if price is not None else markup[0]
+        competitors = competitors if competitors is not None else markup[1]
+    logger.debug('Результат парсинга: price={}, конкурентов: {}', price, len(competitors))
+    log_body('Конкуренты', competitors)
     return price, competitors
 
+
+def parse_price_and_competitors(html: str) -> tuple[int, list[dict]]:
+    logger.debug('Парсинг HTML для получения цены и конкурентов')
+    state = parse_product_state(html)
+    return _merge(state, None if _complete(state) else parse_markup(html))
+
+
+# Элементы разметки, которые читает parse_markup (PRICE_SELECTOR, SELLER_NAME_SELECTOR, SELLER_PRICE_SELECTOR):
+# class может содержать и другие классы, а текст — вложенные строчные теги, поэтому фрагмент идёт до
+# ближайшего блочного тега. Остальная разметка (реклама, токены, счётчики) на отпечаток не влияет
+MARKUP_FRAGMENT_RE = re.compile(
+    r'(?:data-test="product-price"|class="(?:[^"]*\s)?(?:seller-name|price)(?:\s[^"]*)?")[^>]*>'
+    r'(?:[^<]+|<(?!/?(?:div|li|ul|ol|p|tr|td|table|section|article|script)\b)[^>]*>)*'
+)
+
+
+def page_fingerprint(html: str) -> str:
+    """
+    Хэш того, что читает разбор страницы, без разбора HTML: цена и продавцы из встроенного состояния,
+    а если их там не хватает — элементы разметки, которые разбирает parse_markup. Совпадает —
+    цены и продавцы не менялись
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    state = parse_product_state(html)
+    digest.update(msgspec.json.encode(state))
+    if not _complete(state):
+        for fragment in MARKUP_FRAGMENT_RE.finditer(html):
+            digest.update(fragment.group().encode())
+    return digest.hexdigest()
+
+
+_parse_pool: ProcessPoolExecutor | None = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor | None:
+    """
+    Пул процессов для разбора страниц; None — PARSE_WORKERS=0, разбор в цикле событий
+    """
+    global _parse_pool
+    if _parse_pool is None and PARSE_WORKERS > 0:
+        # Не fork: в процессе уже работают потоки (loguru enqueue, мониторы pymongo), и дочерний процесс
+        # может унаследовать захваченную ими блокировку. forkserver есть не везде (нет в Windows) — тогда spawn
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _parse_pool
+
+
+async def parse_page(html: str) -> tuple[int, list[dict]]:
+    """
+    То же, что parse_price_and_competitors, но без долгих блокировок цикла событий: встроенное состояние
+    читается сразу (регулярное выражение и msgspec — десятки микросекунд), а разбор разметки, если
+    состояния нет или в нём не хватает данных, идёт в пуле процессов
+    """
+    global _parse_pool
+    state = parse_product_state(html)
+    if _complete(state):
+        return _merge(state, None)
+    pool = get_parse_pool()
+    if pool is None:
+        return _merge(state, parse_markup(html))
+    try:
+        markup = await asyncio.get_running_loop().run_in_executor(pool, parse_markup, html)
+    except BrokenProcessPool:
+        # Процесс пула упал (например, по памяти): следующий вызов создаст новый пул
+        logger.error('Пул разбора страниц остановлен, страница разбирается в цикле событий')
+        if _parse_pool is pool:
+            _parse_pool = None
+        markup = parse_markup(html)
+    return _merge(state, markup)
+
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
 async def get_kaspi_prices(url: str):
     logger.info(f'Получение цен и конкурентов для: {url}')
     html = await fetch_kaspi_page(url)
-    return parse_price_and_competitors(html) 
\ No newline at end of file
+    return await parse_page(html) 
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from loguru import logger
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config.config import LEASE_TTL, LEASE_RENEW_INTERVAL
+from database.db import db
+from database.models import LEASES_COLLECTION
+
+
+class LeaderLease:
+    """
+    Аренда роли ведущего в MongoDB (LEASES_COLLECTION): из нескольких экземпляров бота задачу run(work)
+    выполняет только держатель аренды. Держатель продлевает её каждые renew_interval секунд; если он
+    упал или потерял связь с базой, аренда истекает через ttl и её забирает другой экземпляр при
+    ближайшей попытке (тоже раз в renew_interval). При остановке аренда освобождается сразу.
+    Без MongoDB процесс всегда ведущий.
+    """
+
+    def __init__(self, name: str, ttl: float = LEASE_TTL, renew_interval: float = LEASE_RENEW_INTERVAL):
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.holder_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.is_leader = False
+        self.running = False
+        self.holder: str | None = None
+        self.acquired_at: datetime | None = None
+        self.checked_at: float | None = None
+        self._indexes_ready = False
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        # Истёкшие аренды удаляет и сама MongoDB; переход роли от этого не зависит
+        await db[LEASES_COLLECTION].create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    async def try_acquire(self) -> bool:
+        """
+        Берёт или продлевает аренду; False — аренда у другого живого экземпляра
+        """
+        if db is None:
+            self.is_leader, self.holder = True, self.holder_id
+            self.acquired_at = self.acquired_at or datetime.utcnow()
+            return True
+        now = datetime.utcnow()
+        collection = db[LEASES_COLLECTION]
+        await self._ensure_indexes()
+        try:
+            # Конвейер обновления: acquired_at сохраняется при продлении и сбрасывается при смене держателя
+            doc = await collection.find_one_and_update(
+                {'_id': self.name, '$or': [{'holder': self.holder_id}, {'expires_at': {'$lt': now}}]},
+                [{'$set': {
+                    'acquired_at': {'$cond': [{'$eq': ['$holder', self.holder_id]}, '$acquired_at', now]},
+                    'holder': self.holder_id,
+                    'renewed_at': now,
+                    'expires_at': now + timedelta(seconds=self.ttl),
+                }}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Документ есть и аренда не истекла: ведущий — другой экземпляр
+            doc = await collection.find_one({'_id': self.name})
+        self.checked_at = time.time()
+        self.holder = doc.get('holder') if doc else None
+        self.acquired_at = doc.get('acquired_at') if doc else None
+        self.is_leader = self.holder == self.holder_id
+        return self.is_leader
+
+    async def release(self):
+        if db is not None and self.is_leader:
+            try:
+                await db[LEASES_COLLECTION].delete_one({'_id': self.name, 'holder': self.holder_id})
+                logger.info(f'Аренда {self.name} освобождена')
+            except Exception as e:
+                logger.warning(f'Не удалось освободить аренду {self.name}: {e}')
+        self.is_leader = False
+
+    def _expire(self, task: asyncio.Task):
+        if not task.done():
+            logger.warning(f'Аренда {self.name} не продлена вовремя, задача ведущего остановлена')
+            task.cancel()
+        self.is_leader = False
+
+    async def run(self, work):
+        """
+        Выполняет work() (корутинную функцию), пока этот экземпляр — ведущий; при потере аренды
+        work отменяется, при повторном получении — запускается заново. Попытка продления ограничена
+        renew_interval, а work отменяется по местному сроку (последнее продление + ttl - renew_interval),
+        даже если MongoDB так и не ответила, — раньше, чем аренду сможет забрать другой экземпляр
+        """
+        self.running = True
+        task: asyncio.Task | None = None
+        watchdog: asyncio.TimerHandle | None = None
+        renewed_at = time.monotonic()
+        try:
+            while True:
+                started, renewed = time.monotonic(), False
+                try:
+                    leader = await asyncio.wait_for(self.try_acquire(), self.renew_interval)
+                    renewed_at, renewed = started, True
+                except Exception as e:
+                    reason = f'нет ответа за {self.renew_interval} с' if isinstance(e, asyncio.TimeoutError) else e
+                    logger.warning(f'Ошибка продления аренды {self.name}: {reason}')
+                    # Без связи с базой роль сохраняется, пока аренда заведомо не истекла
+                    leader = self.is_leader and time.monotonic() - renewed_at < self.ttl - self.renew_interval
+                if task is not None and task.done():
+                    if not task.cancelled() and task.exception():
+                        logger.error(f'Задача ведущего {self.name} завершилась с ошибкой: {task.exception()}')
+                    # Упавшая или остановленная по сроку аренды задача перезапускается; завершившаяся штатно — нет
+                    if task.cancelled() or task.exception():
+                        task = None
+                if leader and task is None:
+                    logger.info(f'Экземпляр {self.holder_id} ведущий ({self.name})')
+                    task = asyncio.create_task(work())
+                elif not leader and task is not None:
+                    logger.warning(f'Аренда {self.name} потеряна, ведущий: {self.holder}')
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    task = None
+                if renewed and leader and task is not None:
+                    if watchdog is not None:
+                        watchdog.cancel()
+                    deadline = renewed_at + self.ttl - self.renew_interval - time.monotonic()
+                    watchdog = asyncio.get_running_loop().call_later(deadline, self._expire, task)
+                self.is_leader = leader
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            self.running = False
+            if watchdog is not None:
+                watchdog.cancel()
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            await asyncio.shield(self.release())
+
+    def status(self) -> dict:
+        age = (datetime.utcnow() - self.acquired_at).total_seconds() if self.acquired_at else None
+        return {
+            'name': self.name,
+            'instance': self.holder_id,
+            'is_leader': self.is_leader,
+            'holder': self.holder,
+            'lease_age': round(age) if age is not None else None,
+            'checked_ago': round(time.time() - self.checked_at) if self.checked_at else None,
+        }
+
+    def describe(self) -> str:
+        status = self.status()
+        if status['holder'] is None:
+            return 'ведущий экземпляр ещё не выбран'
+        who = 'этот экземпляр' if self.is_leader else f'экземпляр {self.holder}'
+        return f'{who}, аренда {status["lease_age"]} с'
+
+
+# Планировщик проверки заказов работает только в одном экземпляре бота
+scheduler_lease = LeaderLease('order_scheduler')
+# Проверка цен — тоже
+price_lease = LeaderLease('price_crawler')
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+
+import msgspec
+from loguru import logger
+
+from config.config import ADMIN_ID, ORDER_CARDS_EDIT, ORDER_CARD_TTL_DAYS
+from database.db import db
+from database.models import ORDER_MESSAGES_COLLECTION
+from services.order_model import Order
+from services.orders_snapshot import orders_snapshot
+from services.telegram_queue import telegram_queue, compose, MESSAGE_LIMIT
+from utils.notifications import notify_admin
+
+RENDER_CACHE_SIZE = 2000
+
+
+def card_version(order: Order) -> str:
+    """
+    Версия карточки: хэш всех полей заказа, из которых она рисуется (в отличие от order_fingerprint,
+    учитывает товары, клиента, комментарий и сумму)
+    """
+    return hashlib.sha1(msgspec.json.encode(order)).hexdigest()[:16]
+
+
+class CardMessage:
+    """
+    Отправленное сообщение с карточками заказов; orders — {order_id: (версия карточки, label)} в порядке карточек
+    """
+    __slots__ = ('chat_id', 'message_id', 'orders')
+
+    def __init__(self, chat_id: int, message_id: int, orders: dict | None = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.orders: dict[str, tuple[str, str | None]] = orders or {}
+
+    @property
+    def key(self) -> str:
+        return f'{self.chat_id}:{self.message_id}'
+
+    def to_doc(self) -> dict:
+        return {
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'orders': [{'order_id': order_id, 'fingerprint': fp, 'label': label} for order_id, (fp, label) in self.orders.items()],
+            'updated_at': datetime.utcnow(),
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> 'CardMessage':
+        return cls(doc['chat_id'], doc['message_id'], {
+            item['order_id']: (item.get('fingerprint'), item.get('label')) for item in doc.get('orders', [])
+        })
+
+
+class OrderCards:
+    """
+    Карточки заказов в Telegram: какой заказ в каком сообщении показан и в какой версии (card_version).
+    Изменившийся заказ правит своё сообщение (edit_message_text или только клавиатуру), неизменившийся
+    не стоит ни отрисовки, ни запроса к Telegram: отрисованные карточки кэшируются по (order_id, версия).
+    Сообщения помнятся в памяти и в ORDER_MESSAGES_COLLECTION (ORDER_CARD_TTL_DAYS дней).
+    """
+
+    def __init__(self, render_cache_size: int = RENDER_CACHE_SIZE):
+        self.render_cache_size = render_cache_size
+        self._rendered: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        self._messages: dict[str, CardMessage] = {}
+        self._by_key: dict[str, CardMessage] = {}
+        self._indexes_ready = False
+        self.counters = {'rendered': 0, 'render_hits': 0, 'sent': 0, 'edited': 0, 'unchanged': 0}
+
+    async def has(self, order_id: str) -> bool:
+        """
+        Отправлялась ли карточка заказа (в том числе до перезапуска — по MongoDB)
+        """
+        return await self._find(order_id) is not None
+
+    def card(self, order: Order, render, fingerprint: str | None = None) -> tuple:
+        key = (order.order_id, fingerprint or card_version(order))
+        cached = self._rendered.get(key)
+        if cached is not None:
+            self._rendered.move_to_end(key)
+            self.counters['render_hits'] += 1
+            return cached
+        cached = render(order)
+        self.counters['rendered'] += 1
+        self._rendered[key] = cached
+        while len(self._rendered) > self.render_cache_size:
+            self._rendered.popitem(last=False)
+        return cached
+
+    async def publish(self, bot, order: Order, render, edit: bool = True) -> asyncio.Future | None:
+        """
+        Показывает карточку заказа: правит уже отправленную (edit=True) или отправляет новую.
+        Возвращает future отправки или правки; None — карточка уже актуальна или бота нет
+        """
+        fingerprint = card_version(order)
+        message = await self._find(order.order_id) if edit and ORDER_CARDS_EDIT else None
+        if message is not None and message.orders[order.order_id][0] == fingerprint:
+            self.counters['unchanged'] += 1
+            return None
+        text, markup = self.card(order, render, fingerprint)
+        if not bot:
+            return None
+        label = order.code or order.order_id
+        if message is not None:
+            future = await self._edit(bot, message, order, fingerprint, render)
+            if future is not None:
+                return future
+        return await self._send(bot, order.order_id, fingerprint, label, text, markup)
+
+    async def _send(self, bot, order_id: str, fingerprint: str, label: str, text: str, markup) -> asyncio.Future:
+        # Карточки, накопившиеся в очереди, уходят одним сообщением
+        future = await notify_admin(bot, text, reply_markup=markup, batch=True, label=label)
+        self.counters['sent'] += 1
+        future.add_done_callback(lambda done: self._register(done, order_id, fingerprint, label))
+        return future
+
+    def _register(self, future: asyncio.Future, order_id: str, fingerprint: str, label: str):
+        if future.cancelled() or future.exception() is not None or not hasattr(future.result(), 'message_id'):
+            return
+        sent = future.result()
+        # Карточки одной пачки получают один и тот же Message, колбэки вызываются в порядке карточек
+        key = f'{sent.chat.id}:{sent.message_id}'
+        message = self._by_key.get(key) or self._by_key.setdefault(key, CardMessage(sent.chat.id, sent.message_id))
+        self._detach(order_id)
+        message.orders[order_id] = (fingerprint, label)
+        self._messages[order_id] = message
+        self._save_later(message)
+
+    def _detach(self, order_id: str):
+        previous = self._messages.pop(order_id, None)
+        if previous is not None:
+            previous.orders.pop(order_id, None)
+            if not previous.orders:
+                self._by_key.pop(previous.key, None)
+            self._save_later(previous)
+
+    async def _edit(self, bot, message: CardMessage, order: Order, fingerprint: str, render) -> asyncio.Future | None:
+        """
+        Правит сообщение с карточкой; возвращает future правки. None — править нельзя (нет карточек
+        соседей по пачке или текст не помещается), тогда вызывающий отправит новую карточку
+        """
+        old_parts, new_parts = [], []
+        for order_id, (fp, label) in message.orders.items():
+            if order_id == order.order_id:
+                old = self._rendered.get((order_id, fp))
+                new = self.card(order, render, fingerprint)
+            else:
+                neighbour = orders_snapshot.get(order_id)
+                old = new = self._rendered.get((order_id, fp))
+                if new is None and neighbour is not None and card_version(neighbour) == fp:
+                    old = new = self.card(neighbour, render, fp)
+            if new is None:
+                self._detach(order.order_id)
+                return None
+            old_parts.append(old and (old[0], old[1], label))
+            new_parts.append((new[0], new[1], label))
+        text, markup = compose(new_parts)
+        if len(text) > MESSAGE_LIMIT:
+            self._detach(order.order_id)
+            return None
+        edit_text = not all(old_parts) or compose(old_parts)[0] != text
+        message.orders[order.order_id] = (fingerprint, message.orders[order.order_id][1])
+        future = await telegram_queue.edit(bot, message.chat_id, message.message_id, text, markup, edit_text=edit_text)
+        self.counters['edited'] += 1
+        self._save_later(message)
+
+        def on_done(done: asyncio.Future):
+            if done.cancelled() or done.exception() is None:
+                return
+            # Сообщение удалено или слишком старое: отправляем карточку заново
+            logger.warning(f'Карточку заказа {order.code} не удалось изменить: {done.exception()}')
+            self._detach(order.order_id)
+            card_text, card_markup = self.card(order, render, fingerprint)
+            asyncio.create_task(self._send(bot, order.order_id, fingerprint, order.code or order.order_id, card_text, card_markup))
+
+        future.add_done_callback(on_done)
+        return future
+
+    async def _find(self, order_id: str) -> CardMessage | None:
+        message = self._messages.get(order_id)
+        if message is not None or db is None:
+            return message
+        try:
+            doc = await db[ORDER_MESSAGES_COLLECTION].find_one({'orders.order_id': order_id, 'chat_id': ADMIN_ID})
+        except Exception as e:
+            logger.warning(f'Ошибка чтения карточки заказа {order_id} из MongoDB: {e}')
+            return None
+        if not doc:
+            return None
+        message = self._by_key.setdefault(doc['_id'], CardMessage.from_doc(doc))
+        for known_id in message.orders:
+            self._messages.setdefault(known_id, message)
+        return self._messages.get(order_id)
+
+    def _save_later(self, message: CardMessage):
+        if db is not None:
+            asyncio.create_task(self._save(message))
+
+    async def _save(self, message: CardMessage):
+        try:
+            collection = db[ORDER_MESSAGES_COLLECTION]
+            if not self._indexes_ready:
+                await collection.create_index('orders.order_id')
+                await collection.create_index('updated_at', expireAfterSeconds=ORDER_CARD_TTL_DAYS * 24 * 3600)
+                self._indexes_ready = True
+            if message.orders:
+                await collection.replace_one({'_id': message.key}, message.to_doc(), upsert=True)
+            else:
+                await collection.delete_one({'_id': message.key})
+        except Exception as e:
+            logger.warning(f'Ошибка сохранения карточки заказа в MongoDB: {e}')
+
+    def stats(self) -> dict:
+        return {**self.counters, 'messages': len(self._by_key)}
+
+
+order_cards = OrderCards()
@@ -1,19 +1,29 @@
 import asyncio
+import time
 from loguru import logger
 from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from utils.notifications import notify_admin
-from services.kaspi_api import get_orders
-from config.config import ORDER_CHECK_INTERVAL, ORDER_LOOKBACK_DAYS
+from services.kaspi_api import iter_order_pages_by_states
+from services.circuit_breaker import CircuitOpenError
+from services.product_cache import product_cache
+from services.orders_snapshot import orders_snapshot
+from services.telegram_queue import telegram_queue
+from services.shops import KaspiShop, get_shop, shops
+from services.order_cards import order_cards
+from services.order_sync import load_watermark, save_watermark
+from services.order_store import confirm_delivery, upsert_orders
+from services.order_model import Order, OrderEntry, Customer, Address
+from config.config import ORDER_CHECK_STATES, ORDER_LOOKBACK_DAYS, ORDER_SYNC_INCREMENTAL
 
 
-async def safe_notify(bot, message: str, reply_markup=None):
+async def safe_notify(bot, message: str, reply_markup=None, batch: bool = False, label: str | None = None):
     """
-    Безопасная отправка уведомлений администратору через Telegram
+    Безопасная отправка уведомлений администратору через Telegram (очередь отправки, без ожидания доставки)
     """
     if bot:
-        await notify_admin(bot, message, reply_markup=reply_markup)
+        return await notify_admin(bot, message, reply_markup=reply_markup, batch=batch, label=label)
 
 
 def format_order_date(order_date) -> str:
@@ -34,24 +44,24 @@ def format_order_date(order_date) -> str:
         return str(order_date)
 
 
-def format_address(address: dict) -> str:
+def format_address(address: Address | None) -> str:
     """
     Форматирует адрес Kaspi в строку
     """
     if not address:
         return "-"
     parts = []
-    if address.get('town'):
-        parts.append(address['town'])
-    if address.get('streetName'):
-        parts.append(address['streetName'])
-    if address.get('streetNumber'):
-        parts.append(f"{address['streetNumber']}")
-    if address.get('apartment'):
-        parts.append(f"кв. {address['apartment']}")
+    if address.town:
+        parts.append(address.town)
+    if address.streetName:
+        parts.append(address.streetName)
+    if address.streetNumber:
+        parts.append(f"{address.streetNumber}")
+    if address.apartment:
+        parts.append(f"кв. {address.apartment}")
     return ", ".join(parts)
 
-def format_products(products: list, fallback: str = 'Товар') -> str:
+def format_products(products: list[OrderEntry], fallback: str = 'Товар') -> str:
     """
     Форматирует список товаров в виде: 1. Название xКол-во = Цена
     """
@@ -59,10 +69,7 @@ def format_products(products: list, fallback: str = 'Товар') -> str:
         return fallback
     lines = []
     for i, product in enumerate(products, 1):
-        name = product.get('name', '—')
-        qty = product.get('quantity', 1)
-        price = product.get('price', 0)
-        lines.append(f"{i}. {name} x{qty} = {price:,} ₸")
+        lines.append(f"{i}. {product.name} x{product.quantity} = {product.price:,} ₸")
     return "\n".join(lines)
 
 
@@ -81,62 +88,150 @@ def get_delivery_text(state, status) -> tuple[str, str]:
     return '📋 Готов к выдаче', '📋'
 
 
-async def check_orders_by_states(bot, states, date_from=None):
+async def check_orders_by_states(bot, states, date_from=None, shop: KaspiShop | None = None):
     """
-    Проверяет заказы по списку состояний и отправляет уведомления
+    Проверяет заказы магазина по списку состояний и отправляет уведомления. Возвращает число показанных заказов.
+    Без явного date_from (запуск планировщиком) уведомления отправляются только о новых или изменившихся
+    заказах, а с ORDER_SYNC_INCREMENTAL запрашиваются только заказы новее сохранённой отметки
+    синхронизации каждого состояния; раз в ORDER_SYNC_FULL_SWEEP_INTERVAL — всё окно, чтобы увидеть
+    изменения старых заказов.
+    Пока автомат защиты Kaspi API магазина открыт, планировщик пропускает цикл, а ручная проверка
+    сразу показывает заказы из снимка с отметкой его возраста.
     """
+    shop = shop or get_shop()
+    if shop is None:
+        logger.error('KASPI_API не настроен! Добавьте KASPI_API или KASPI_SHOPS в файл .env')
+        return 0
+    only_changed = date_from is None
+    if shop.breaker.is_open:
+        logger.warning(f'Kaspi API {shop.name} недоступен, проверка заказов по снимку ({orders_snapshot.describe_age()})')
+        if not only_changed:
+            await show_snapshot_orders(bot, states, shop)
+        return 0
+    incremental = date_from is None and ORDER_SYNC_INCREMENTAL
     if date_from is None:
         date_from = (datetime.now() + timedelta(days=1) - timedelta(days=ORDER_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
-    found_any = False
-    for state in states:
+    found = 0
+    watermarks = {}
+    states_date_from = date_from
+    sweep_started = time.time()
+    if incremental:
+        lookback_ms = int(datetime.strptime(date_from, '%Y-%m-%d').timestamp() * 1000)
+        loaded = await asyncio.gather(*(load_watermark(state, shop.name) for state in states))
+        watermarks = dict(zip(states, loaded))
+        states_date_from = {state: watermark.date_from(lookback_ms) for state, watermark in watermarks.items()}
+    # Цикл планировщика, читающий всё окно, заодно заменяет снимок заказов магазина
+    full_window = only_changed and set(states) == set(ORDER_CHECK_STATES) and (
+        not incremental or all(value == lookback_ms for value in states_date_from.values())
+    )
+    window_orders = []
+    failed_states = set()
+    # Все состояния запрашиваются параллельно; уведомления по странице отправляются, пока остальные ещё загружаются
+    async for state, orders, error in iter_order_pages_by_states(states, date_from=states_date_from, shop=shop):
         try:
-            orders = await get_orders(state=state, date_from=date_from)
-            if not orders:
-                continue
-            for order in orders:
-                if state == 'KASPI_DELIVERY' and order.get('courierTransmissionDate') is not None:
-                    continue
-                await show_order_notification(bot, order)
-                found_any = True
+            if error is not None:
+                raise error
+            if state in watermarks:
+                for order in orders:
+                    watermarks[state].observe(order)
+            changed = await upsert_orders(orders)
+            if full_window:
+                window_orders.extend(orders)
+            changed_ids = {order.order_id for order in changed}
+            for order in changed if only_changed else orders:
+                transmitted = order.state == 'KASPI_DELIVERY' and order.courierTransmissionDate is not None
+                delivery = None
+                # Переданный курьеру заказ не показывается, но его уже отправленная карточка обновляется
+                if not transmitted or (only_changed and await order_cards.has(order.order_id)):
+                    delivery = await show_order_notification(bot, order, edit=only_changed)
+                    if not transmitted:
+                        found += 1
+                if order.order_id in changed_ids:
+                    # Заказ считается показанным, только когда уведомление доставлено
+                    await confirm_delivery(order, delivery)
+        except CircuitOpenError as e:
+            # Пока идёт пробный запрос после паузы автомата, запросы остальных состояний отклоняются:
+            # это не ошибка для администратора, состояние перечитается следующим циклом
+            failed_states.add(state)
+            logger.warning(f'Заказы {shop.name} со статусом {state} не запрошены: {e}')
         except Exception as e:
-            await safe_notify(bot, f"❌ Ошибка при получении заказов со статусом {state}: {e}")
-    if not found_any:
+            failed_states.add(state)
+            await safe_notify(bot, f"{shop.tag}❌ Ошибка при получении заказов со статусом {state}: {e}")
+    for state, watermark in watermarks.items():
+        if state not in failed_states:
+            if states_date_from[state] == lookback_ms:
+                # Окно прочитано целиком: следующий полный проход — через ORDER_SYNC_FULL_SWEEP_INTERVAL
+                watermark.swept_at = sweep_started
+            await save_watermark(watermark)
+    if full_window and not failed_states:
+        orders_snapshot.replace(window_orders, shop.name)
+    logger.info(f'Кэш товаров: {product_cache.stats()}')
+    logger.info(f'Лимитер Kaspi API {shop.name}: {shop.limiter.stats()}')
+    logger.info(f'Очередь Telegram: {telegram_queue.stats()}, карточки: {order_cards.stats()}')
+    return found
+
+
+async def show_snapshot_orders(bot, states, shop: KaspiShop):
+    """
+    Показывает заказы магазина из последнего удачного снимка, не обращаясь к Kaspi API
+    """
+    orders = [
+        order for order in orders_snapshot.orders(states)
+        if get_shop(order.shop) is shop and not (order.state == 'KASPI_DELIVERY' and order.courierTransmissionDate is not None)
+    ]
+    await safe_notify(
+        bot,
+        f"{shop.tag}⚠️ <b>Kaspi API временно недоступен</b>\nПоказаны сохранённые заказы ({orders_snapshot.describe_age()}): {len(orders)}",
+    )
+    for order in orders:
+        await show_order_notification(bot, order, edit=False)
+
+
+async def show_new_orders(bot, date_from=None, shop: KaspiShop | None = None):
+    """
+    Проверяет новые заказы с состояниями из ORDER_CHECK_STATES (по умолчанию 'KASPI_DELIVERY' и 'DELIVERY')
+    в магазине shop, а без него — во всех магазинах параллельно. Возвращает число показанных заказов.
+    """
+    logger.info(f'Запрос заказов (state={", ".join(ORDER_CHECK_STATES)}, магазин: {shop.name if shop else "все"})')
+    targets = [shop] if shop else list(shops.values())
+    found = sum(await asyncio.gather(*(
+        check_orders_by_states(bot, ORDER_CHECK_STATES, date_from=date_from, shop=target) for target in targets
+    )))
+    # Планировщик при адаптивном интервале проверяет часто, поэтому «ничего нет» сообщается только при ручной проверке
+    if not found and date_from is not None:
         await safe_notify(bot, "📭 <b>Новых заказов не найдено</b>")
+    return found
 
 
-async def show_new_orders(bot, date_from=None):
+async def show_order_notification(bot, order: Order, edit: bool = True) -> asyncio.Future | None:
     """
-    Проверяет новые заказы с state='KASPI_DELIVERY' и 'DELIVERY'
+    Отправляет карточку заказа администратору. С edit=True уже отправленная карточка изменившегося
+    заказа правится на месте, а неизменившегося — не трогается (order_cards). Возвращает future доставки
     """
-    logger.info('Запрос заказов (state=KASPI_DELIVERY, DELIVERY)')
-    await check_orders_by_states(bot, ['KASPI_DELIVERY', 'DELIVERY'], date_from=date_from)
+    return await order_cards.publish(bot, order, render_order_card, edit=edit)
 
 
-async def show_order_notification(bot, order):
+def render_order_card(order: Order) -> tuple[str, InlineKeyboardMarkup | None]:
     """
-    Формирует и отправляет уведомление об одном заказе администратору
+    Формирует текст и клавиатуру карточки заказа
     """
-    order_date_str = format_order_date(order.get('date'))
-    customer = order.get('customer', {})
-    customer_name = f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip() or 'Клиент'
-    customer_phone = customer.get('cellPhone', '')
-    customer_email = customer.get('email', '')
-    products_text = format_products(order.get('products', []), order.get('product_name', 'Товар'))
-    total_price = order.get('totalPrice', order.get('price', 0))
-    status = order.get('status', '')
-    state = order.get('state', '')
-    delivery_type = order.get('deliveryType', '')
-    delivery_mode = order.get('deliveryMode', '')
-    address_text = format_address(order.get('deliveryAddress', {}))
-    payment_method = order.get('paymentMethod', '')
-    payment_status = order.get('paymentStatus', '')
-    payment_text = f"{payment_method} ({payment_status})" if payment_status else payment_method
-    comment_text = f"\n💬 Комментарий: {order.get('comment')}" if order.get('comment') else ""
-    signature_text = "\n✍️ Требуется подпись" if order.get('signatureRequired') else ""
+    order_date_str = format_order_date(order.date)
+    customer = order.customer or Customer()
+    customer_name = f"{customer.firstName or ''} {customer.lastName or ''}".strip() or 'Клиент'
+    customer_phone = customer.cellPhone or ''
+    products_text = format_products(order.products, order.product_name)
+    total_price = order.totalPrice
+    status = order.status or ''
+    state = order.state or ''
+    delivery_type = order.deliveryType or ''
+    address_text = format_address(order.deliveryAddress)
+    comment_text = f"\n💬 Комментарий: {order.comment}" if order.comment else ""
+    signature_text = "\n✍️ Требуется подпись" if order.signatureRequired else ""
     delivery_text, emoji = get_delivery_text(state, status)
+    shop = get_shop(order.shop)
     message = (
-        f"{emoji} <b>Новый заказ!</b>\n"
-        f"№{order.get('code', order.get('order_id'))}\n\n"
+        f"{shop.tag if shop else ''}{emoji} <b>Новый заказ!</b>\n"
+        f"№{order.code or order.order_id}\n\n"
         f"📦 <b>Товары:</b>\n{products_text}\n"
         f"💰 <b>Сумма:</b> {total_price:,} ₸\n\n"
         f"👤 <b>Клиент:</b> {customer_name}\n"
@@ -155,43 +250,51 @@ async def show_order_notification(bot, order):
         f"{comment_text}"
         f"{signature_text}"
     )
-    assembled = order.get('assembled')
-    courier_transmission = order.get('courierTransmissionDate')
+    assembled = order.assembled
+    courier_transmission = order.courierTransmissionDate
+    kb = None
     if state == 'DELIVERY':
         kb = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text='Выдать заказ', callback_data=f'give_order:{order.get("order_id") or order.get("code")}')
+            InlineKeyboardButton(text='Выдать заказ', callback_data=f'give_order:{order.order_id or order.code}')
         ]])
-        await safe_notify(bot, message, reply_markup=kb)
     elif state == 'KASPI_DELIVERY':
         if assembled is False and courier_transmission is None:
             kb = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text='Сформировать накладную', callback_data=f'create_invoice:{order.get("order_id") or order.get("code")}')
+                InlineKeyboardButton(text='Сформировать накладную', callback_data=f'create_invoice:{order.order_id or order.code}')
             ]])
-            await safe_notify(bot, message, reply_markup=kb)
         elif assembled is True and courier_transmission is None:
-            waybill_url = order.get('waybill')
+            waybill_url = order.waybill
             if waybill_url:
                 message += f"\n\n<a href=\"{waybill_url}\">📄 Скачать накладную (PDF)</a>"
-                await safe_notify(bot, message)
             else:
                 kb = InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(text='Скачать накладную', callback_data=f'download_invoice:{order.get("order_id") or order.get("code")}')
+                    InlineKeyboardButton(text='Скачать накладную', callback_data=f'download_invoice:{order.order_id or order.code}')
                 ]])
-                await safe_notify(bot, message, reply_markup=kb)
-        else:
-            await safe_notify(bot, message)
-    else:
-        await safe_notify(bot, message)
+        elif courier_transmission is not None:
+            message += "\n\n📤 Передан курьеру"
+    return message, kb
 
 
 async def order_check_scheduler(bot):
     """
-    Планировщик регулярной проверки новых заказов
+    Планировщик регулярной проверки новых заказов: для каждого магазина свой цикл опроса
+    с собственным адаптивным интервалом (shop.schedule), все в одном event loop
     """
-    logger.info('⏳ Запуск планировщика проверки заказов (каждые %s сек)', ORDER_CHECK_INTERVAL)
+    if not shops:
+        logger.error('Планировщик заказов не запущен: не настроен ни один магазин (KASPI_API или KASPI_SHOPS)')
+        return
+    await asyncio.gather(*(shop_order_worker(bot, shop) for shop in shops.values()))
+
+
+async def shop_order_worker(bot, shop: KaspiShop):
+    schedule = shop.schedule
+    logger.info(f'⏳ Запуск проверки заказов {shop.name} (каждые {schedule.min_interval}–{schedule.max_interval} сек)')
     while True:
+        found = 0
         try:
-            await show_new_orders(bot)
+            found = await show_new_orders(bot, shop=shop)
         except Exception as e:
-            logger.exception(f'Ошибка в планировщике заказов: {e}')
-        await asyncio.sleep(ORDER_CHECK_INTERVAL)
+            logger.exception(f'Ошибка в планировщике заказов {shop.name}: {e}')
+        schedule.record(found)
+        logger.info(f'Следующая проверка заказов {shop.name}: {schedule.describe()}')
+        await schedule.wait()
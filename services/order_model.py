@@ -0,0 +1,195 @@
+from typing import Any
+
+import msgspec
+
+# Структуры ответа Kaspi Shop API (JSON:API). Неизвестные поля пропускаются декодером,
+# strict=False допускает числа в виде строк. Заказы страницы декодируются по одному (OrdersPage.data —
+# сырой JSON), чтобы заказ с полем неожиданного типа не ломал всю страницу.
+
+
+class Customer(msgspec.Struct, gc=False):
+    firstName: str | None = None
+    lastName: str | None = None
+    cellPhone: str | None = None
+    email: str | None = None
+
+
+class Address(msgspec.Struct, gc=False):
+    town: str | None = None
+    streetName: str | None = None
+    streetNumber: str | None = None
+    apartment: str | None = None
+    formattedAddress: str | None = None
+
+
+class KaspiDelivery(msgspec.Struct, gc=False):
+    courierTransmissionDate: int | None = None
+    waybill: str | None = None
+
+
+class OrderAttributes(msgspec.Struct):
+    code: str | int | None = None  # Приводится к строке в Order.from_resource
+    totalPrice: int | float = 0
+    status: str | None = None
+    state: str | None = None
+    creationDate: int | None = None
+    customer: Customer | None = None
+    deliveryMode: str | None = None
+    deliveryType: str | None = None
+    signatureRequired: bool | None = None
+    paymentMethod: str | None = None
+    paymentStatus: str | None = None
+    deliveryAddress: Address | None = None
+    pickupPoint: Any = None
+    comment: str | None = None
+    waybillNumber: str | None = None
+    assembled: bool | None = None
+    kaspiDelivery: KaspiDelivery | None = None
+
+
+class ResourceId(msgspec.Struct):
+    type: str
+    id: str
+
+
+class Relationship(msgspec.Struct):
+    data: list[ResourceId] | ResourceId | None = None
+
+
+class IncludedResource(msgspec.Struct):
+    """
+    Ресурс из массива included составного документа (позиции заказа, товары)
+    """
+    type: str
+    id: str
+    attributes: dict = {}
+    relationships: dict[str, Relationship] = {}
+
+
+class OrderResource(msgspec.Struct):
+    id: str
+    attributes: OrderAttributes = msgspec.field(default_factory=OrderAttributes)
+    relationships: dict[str, Relationship] = {}
+
+
+class OrdersPage(msgspec.Struct):
+    data: list[msgspec.Raw] = []
+    meta: dict = {}
+    included: list[IncludedResource] = []
+
+
+class OrderDocument(msgspec.Struct):
+    data: OrderResource | None = None
+
+
+class EntryAttributes(msgspec.Struct):
+    quantity: int = 1
+    totalPrice: int | float = 0
+
+
+class EntryResource(msgspec.Struct):
+    id: str
+    attributes: EntryAttributes = msgspec.field(default_factory=EntryAttributes)
+
+
+class EntriesPage(msgspec.Struct):
+    data: list[EntryResource] = []
+
+
+class ProductAttributes(msgspec.Struct):
+    name: str | None = None
+
+
+class ProductResource(msgspec.Struct):
+    id: str | None = None
+    attributes: ProductAttributes = msgspec.field(default_factory=ProductAttributes)
+
+
+class ProductDocument(msgspec.Struct):
+    data: ProductResource | None = None
+
+
+# Модель заказа, с которой работает бот. Имена полей совпадают с ключами документов ORDERS_COLLECTION.
+
+
+class OrderEntry(msgspec.Struct, gc=False):
+    name: str = 'Товар'
+    quantity: int = 1
+    price: int | float = 0
+
+
+class Order(msgspec.Struct, gc=False):
+    order_id: str
+    code: str | None = None
+    products: list[OrderEntry] = []
+    status: str | None = None
+    state: str | None = None
+    date: int | None = None
+    totalPrice: int | float = 0
+    customer: Customer | None = None
+    deliveryMode: str | None = None
+    deliveryType: str | None = None
+    signatureRequired: bool | None = None
+    paymentMethod: str | None = None
+    paymentStatus: str | None = None
+    deliveryAddress: Address | None = None
+    pickupPoint: Any = None
+    comment: str | None = None
+    waybillNumber: str | None = None
+    assembled: bool | None = None
+    courierTransmissionDate: int | None = None
+    waybill: str | None = None
+    shop: str | None = None  # Имя магазина из KASPI_SHOPS
+
+    @property
+    def product_name(self) -> str:
+        return self.products[0].name if self.products else 'Товар'
+
+    @classmethod
+    def from_resource(cls, resource: OrderResource, products: list[OrderEntry], shop: str | None = None) -> 'Order':
+        attributes = resource.attributes
+        delivery = attributes.kaspiDelivery
+        return cls(
+            order_id=resource.id,
+            code=None if attributes.code is None else str(attributes.code),
+            products=products,
+            status=attributes.status,
+            state=attributes.state,
+            date=attributes.creationDate,
+            totalPrice=attributes.totalPrice,
+            customer=attributes.customer,
+            deliveryMode=attributes.deliveryMode,
+            deliveryType=attributes.deliveryType,
+            signatureRequired=attributes.signatureRequired,
+            paymentMethod=attributes.paymentMethod,
+            paymentStatus=attributes.paymentStatus,
+            deliveryAddress=attributes.deliveryAddress,
+            pickupPoint=attributes.pickupPoint,
+            comment=attributes.comment,
+            waybillNumber=attributes.waybillNumber,
+            assembled=attributes.assembled,
+            courierTransmissionDate=delivery.courierTransmissionDate if delivery else None,
+            waybill=delivery.waybill if delivery else None,
+            shop=shop,
+        )
+
+
+orders_page_decoder = msgspec.json.Decoder(OrdersPage, strict=False)
+order_resource_decoder = msgspec.json.Decoder(OrderResource, strict=False)
+order_document_decoder = msgspec.json.Decoder(OrderDocument, strict=False)
+entries_page_decoder = msgspec.json.Decoder(EntriesPage, strict=False)
+product_document_decoder = msgspec.json.Decoder(ProductDocument, strict=False)
+
+
+def order_to_doc(order: Order) -> dict:
+    """
+    Заказ в виде словаря для MongoDB
+    """
+    return msgspec.to_builtins(order)
+
+
+def order_from_doc(doc: dict) -> Order:
+    """
+    Заказ из документа MongoDB; служебные поля документа пропускаются
+    """
+    return msgspec.convert(doc, Order, strict=False)
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+import msgspec
+from loguru import logger
+from pymongo import UpdateOne
+
+from database.db import db
+from database.models import ORDERS_COLLECTION
+from services.kaspi_api import get_order
+from services.order_model import Order, order_to_doc, order_from_doc
+from services.order_sync import request_full_sweep
+from services.orders_snapshot import orders_snapshot
+from services.shops import get_shop, shops
+
+# Поля заказа, изменение которых требует нового уведомления
+FINGERPRINT_FIELDS = ('status', 'state', 'assembled', 'waybill', 'courierTransmissionDate')
+
+# Отпечатки заказов, если MongoDB недоступна (живут до перезапуска). Хранятся последние
+# MEMORY_FINGERPRINTS_LIMIT заказов: заказы из окна проверки встречаются каждый полный проход и не вытесняются
+MEMORY_FINGERPRINTS_LIMIT = 10000
+_memory_fingerprints: OrderedDict[str, str] = OrderedDict()
+# Отпечатки заказов, уведомления о которых ещё в очереди Telegram: пока они не доставлены,
+# повторный цикл не считает заказ изменившимся, а недоставленное уведомление повторится
+_delivering: dict[str, str] = {}
+_indexes_ready = False
+
+
+def order_fingerprint(order: Order) -> str:
+    """
+    Версия заказа: хэш полей FINGERPRINT_FIELDS
+    """
+    payload = json.dumps([getattr(order, field) for field in FINGERPRINT_FIELDS], default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+async def ensure_order_indexes():
+    global _indexes_ready
+    if _indexes_ready or db is None:
+        return
+    await db[ORDERS_COLLECTION].create_index('order_id', unique=True)
+    await db[ORDERS_COLLECTION].create_index('code')
+    _indexes_ready = True
+
+
+async def upsert_orders(orders: list[Order]) -> list[Order]:
+    """
+    Сохраняет заказы одной пачкой и возвращает только новые или изменившиеся (по отпечатку) заказы.
+    Отпечаток сохраняется не здесь, а в confirm_delivery — когда уведомление о заказе доставлено
+    """
+    if not orders:
+        return []
+    fingerprints = {order.order_id: order_fingerprint(order) for order in orders}
+    for order in orders:
+        orders_snapshot.put(order)
+
+    if db is None:
+        changed = [
+            order for order in orders
+            if (_delivering.get(order.order_id) or _memory_fingerprints.get(order.order_id)) != fingerprints[order.order_id]
+        ]
+        for order_id in fingerprints:
+            if order_id in _memory_fingerprints:
+                _memory_fingerprints.move_to_end(order_id)
+        return changed
+
+    try:
+        await ensure_order_indexes()
+        collection = db[ORDERS_COLLECTION]
+        known = {
+            doc['order_id']: doc.get('fingerprint')
+            async for doc in collection.find({'order_id': {'$in': list(fingerprints)}}, {'order_id': 1, 'fingerprint': 1})
+        }
+        now = datetime.utcnow()
+        changed = [
+            order for order in orders
+            if (_delivering.get(order.order_id) or known.get(order.order_id)) != fingerprints[order.order_id]
+        ]
+        if changed:
+            await collection.bulk_write([
+                UpdateOne(
+                    {'order_id': order.order_id},
+                    {
+                        '$set': {**order_to_doc(order), 'updated_at': now},
+                        '$setOnInsert': {'first_seen_at': now},
+                    },
+                    upsert=True,
+                )
+                for order in changed
+            ], ordered=False)
+        return changed
+    except Exception as e:
+        # Без базы лучше повторить уведомление, чем потерять заказ
+        logger.error(f'Ошибка сохранения заказов в MongoDB: {e}')
+        return orders
+
+
+async def confirm_delivery(order: Order, delivery: asyncio.Future | None):
+    """
+    Сохраняет отпечаток заказа из upsert_orders, когда уведомление о нём доставлено: delivery — future
+    очереди Telegram (None — отправлять было нечего). Если отправка не удалась или не завершилась
+    до остановки процесса, отпечаток не сохраняется и заказ будет показан снова; после неудачной
+    отправки следующий цикл перечитывает всё окно, чтобы не ждать полного прохода по расписанию
+    """
+    fingerprint = order_fingerprint(order)
+    _delivering[order.order_id] = fingerprint
+    if delivery is None:
+        await _save_fingerprint(order.order_id, fingerprint)
+        return
+
+    def on_done(done: asyncio.Future):
+        if done.cancelled() or done.exception() is not None or done.result() is None:
+            if _delivering.get(order.order_id) == fingerprint:
+                del _delivering[order.order_id]
+            if not done.cancelled():
+                asyncio.create_task(request_full_sweep(order.shop))
+            return
+        asyncio.create_task(_save_fingerprint(order.order_id, fingerprint))
+
+    delivery.add_done_callback(on_done)
+
+
+async def _save_fingerprint(order_id: str, fingerprint: str):
+    try:
+        if db is None:
+            _memory_fingerprints[order_id] = fingerprint
+            _memory_fingerprints.move_to_end(order_id)
+            while len(_memory_fingerprints) > MEMORY_FINGERPRINTS_LIMIT:
+                _memory_fingerprints.popitem(last=False)
+        else:
+            await db[ORDERS_COLLECTION].update_one({'order_id': order_id}, {'$set': {'fingerprint': fingerprint}})
+    except Exception as e:
+        logger.error(f'Ошибка сохранения отпечатка заказа {order_id} в MongoDB: {e}')
+    finally:
+        if _delivering.get(order_id) == fingerprint:
+            del _delivering[order_id]
+
+
+async def find_order(order_key: str) -> Order | None:
+    """
+    Ищет заказ по order_id или code в снимке заказов, затем в ORDERS_COLLECTION
+    """
+    order = orders_snapshot.get(order_key)
+    if order is not None or db is None:
+        return order
+    try:
+        doc = await db[ORDERS_COLLECTION].find_one({'$or': [{'order_id': order_key}, {'code': order_key}]}, {'_id': 0})
+    except Exception as e:
+        logger.warning(f'Ошибка поиска заказа {order_key} в MongoDB: {e}')
+        return None
+    if not doc:
+        return None
+    order = order_from_doc(doc)
+    orders_snapshot.put(order)
+    return order
+
+
+async def resolve_order(order_key: str, required: tuple = ()) -> Order | None:
+    """
+    Возвращает заказ по order_id или code: из локального индекса, а если его там нет или в нём
+    не заполнены поля required — запросом к Kaspi API магазина заказа (неизвестный заказ ищется
+    по всем магазинам). Пока автомат защиты открыт, get_order сразу возвращает None и используется
+    локальная копия. get_order не загружает товары: они берутся из локальной копии, а заказ
+    без товаров в снимок не попадает, чтобы не затереть полную запись.
+    """
+    order = await find_order(order_key)
+    if order and all(getattr(order, field) for field in required):
+        return order
+    candidates = [get_shop(order.shop)] if order and order.shop in shops else list(shops.values())
+    for shop in candidates:
+        fresh = await get_order(order_key, shop)
+        if fresh:
+            if not fresh.products and order is not None and order.products:
+                fresh = msgspec.structs.replace(fresh, products=order.products)
+            if fresh.products:
+                orders_snapshot.put(fresh)
+            return fresh
+    return order
@@ -0,0 +1,104 @@
+import re
+import time
+from datetime import datetime
+from loguru import logger
+
+from config.config import ORDER_SYNC_OVERLAP_MINUTES, ORDER_SYNC_FULL_SWEEP_INTERVAL
+from database.db import db
+from database.models import ORDER_SYNC_COLLECTION
+from services.order_model import Order
+
+# Отметки синхронизации, если MongoDB недоступна (живут до перезапуска)
+_memory_watermarks: dict[str, dict] = {}
+
+
+class OrderWatermark:
+    """
+    Отметка инкрементальной синхронизации для одного состояния заказов одного магазина:
+    cursor — максимальная creationDate (мс) среди уже обработанных заказов (заказы из окна перекрытия
+    приходят повторно, уведомления о них отсекает отпечаток в order_store),
+    swept_at — время последнего полного прохода по окну ORDER_LOOKBACK_DAYS (0 — проход нужен сейчас).
+    Фильтр Kaspi API есть только по creationDate, поэтому изменения заказов старше перекрытия видны
+    лишь при полном проходе — раз в ORDER_SYNC_FULL_SWEEP_INTERVAL или по request_full_sweep.
+    """
+
+    def __init__(self, state: str, cursor: int = 0, shop: str | None = None, swept_at: float = 0):
+        self.state = state
+        self.shop = shop
+        self.cursor = cursor
+        self.swept_at = swept_at
+        self.overlap_ms = ORDER_SYNC_OVERLAP_MINUTES * 60 * 1000
+
+    @property
+    def key(self) -> str:
+        return f'{self.shop}:{self.state}' if self.shop else self.state
+
+    @property
+    def full_sweep_due(self) -> bool:
+        return time.time() - self.swept_at >= ORDER_SYNC_FULL_SWEEP_INTERVAL
+
+    def date_from(self, lookback_ms: int) -> int:
+        """
+        Начало окна запроса: отметка минус перекрытие, но не раньше окна ORDER_LOOKBACK_DAYS;
+        при полном проходе — всё окно
+        """
+        if not self.cursor or self.full_sweep_due:
+            return lookback_ms
+        return max(lookback_ms, self.cursor - self.overlap_ms)
+
+    def observe(self, order: Order):
+        if order.date is None:
+            return
+        self.cursor = max(self.cursor, order.date)
+
+    def to_doc(self) -> dict:
+        return {
+            'cursor': self.cursor,
+            'swept_at': self.swept_at,
+            'updated_at': datetime.utcnow(),
+        }
+
+
+async def load_watermark(state: str, shop: str | None = None) -> OrderWatermark:
+    watermark = OrderWatermark(state, shop=shop)
+    doc = _memory_watermarks.get(watermark.key)
+    if db is not None:
+        try:
+            doc = await db[ORDER_SYNC_COLLECTION].find_one({'_id': watermark.key}) or doc
+        except Exception as e:
+            logger.warning(f'Не удалось загрузить отметку синхронизации для {watermark.key}: {e}')
+    if not doc:
+        return watermark
+    return OrderWatermark(state, doc.get('cursor', 0), shop, doc.get('swept_at', 0))
+
+
+async def save_watermark(watermark: OrderWatermark):
+    doc = watermark.to_doc()
+    _memory_watermarks[watermark.key] = doc
+    if db is None:
+        return
+    try:
+        await db[ORDER_SYNC_COLLECTION].update_one(
+            # recent_ids — поле прежних версий, больше не используется
+            {'_id': watermark.key}, {'$set': doc, '$unset': {'recent_ids': ''}}, upsert=True,
+        )
+    except Exception as e:
+        logger.warning(f'Не удалось сохранить отметку синхронизации для {watermark.key}: {e}')
+
+
+async def request_full_sweep(shop: str | None = None):
+    """
+    Следующий цикл планировщика перечитает всё окно заказов магазина (например, после формирования
+    накладной). Отметка сбрасывается и в MongoDB: планировщик может работать в другом экземпляре бота
+    """
+    prefix = f'{shop}:' if shop else ''
+    for key, doc in _memory_watermarks.items():
+        if key.startswith(prefix):
+            doc['swept_at'] = 0
+    if db is None:
+        return
+    try:
+        query = {'_id': {'$regex': f'^{re.escape(prefix)}'}} if prefix else {}
+        await db[ORDER_SYNC_COLLECTION].update_many(query, {'$set': {'swept_at': 0}})
+    except Exception as e:
+        logger.warning(f'Не удалось запросить полный проход заказов {shop or ""}: {e}')
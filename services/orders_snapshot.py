@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from loguru import logger
+
+from config.config import ORDER_CHECK_STATES, ORDER_LOOKBACK_DAYS, ORDER_SNAPSHOT_CHECK_INTERVAL, ORDER_SNAPSHOT_MAX_AGE
+from services.kaspi_api import iter_order_pages_by_states
+from services.order_model import Order
+from services.shops import KaspiShop, shops
+
+SNAPSHOT_LIMIT = 2000
+
+
+class OrdersSnapshot:
+    """
+    Последний удачный снимок заказов в памяти процесса. Обработчики и планировщик читают его сразу,
+    не дожидаясь Kaspi API. Снимок собирают циклы проверки заказов: каждый заказ — put, цикл, прочитавший
+    всё окно, — replace; полностью перечитывается (refresh) только устаревший снимок или после
+    восстановления Kaspi API.
+    Если API недоступен, остаётся прежний снимок, а error и age() показывают, насколько он устарел.
+    Заказы всех магазинов лежат вместе, время обновления и ошибки учитываются по магазинам.
+    """
+
+    def __init__(self, limit: int = SNAPSHOT_LIMIT):
+        self.limit = limit
+        self._orders: OrderedDict[str, Order] = OrderedDict()
+        self._codes: dict[str, str] = {}
+        self._updated: dict[str | None, float] = {}
+        self._errors: dict[str | None, str] = {}
+
+    @property
+    def updated_at(self) -> float | None:
+        """
+        Время обновления самого устаревшего магазина
+        """
+        return min(self._updated.values(), default=None)
+
+    @property
+    def error(self) -> str | None:
+        return '; '.join(f'{shop}: {error}' if shop else error for shop, error in self._errors.items()) or None
+
+    def put(self, order: Order):
+        self._orders[order.order_id] = order
+        self._orders.move_to_end(order.order_id)
+        if order.code:
+            self._codes[order.code] = order.order_id
+        while len(self._orders) > self.limit:
+            _, evicted = self._orders.popitem(last=False)
+            self._codes.pop(evicted.code, None)
+
+    def get(self, order_key: str) -> Order | None:
+        """
+        Заказ по order_id или code
+        """
+        return self._orders.get(order_key) or self._orders.get(self._codes.get(order_key, ''))
+
+    def orders(self, states=None) -> list[Order]:
+        return [order for order in self._orders.values() if states is None or order.state in states]
+
+    def age(self) -> float | None:
+        return None if self.updated_at is None else time.time() - self.updated_at
+
+    def describe_age(self) -> str:
+        age = self.age()
+        if age is None:
+            return 'данных ещё нет'
+        if age < 60:
+            return 'обновлено только что'
+        if age < 3600:
+            return f'обновлено {int(age // 60)} мин назад'
+        return f'обновлено {datetime.fromtimestamp(self.updated_at).strftime("%d.%m %H:%M")}'
+
+    def replace(self, orders: list[Order], shop: str | None = None):
+        """
+        Заменяет заказы магазина shop (без shop — весь снимок)
+        """
+        if shop is None:
+            self._orders.clear()
+            self._codes.clear()
+            self._updated.clear()
+            self._errors.clear()
+        else:
+            for order_id in [order_id for order_id, order in self._orders.items() if order.shop == shop]:
+                self._codes.pop(self._orders.pop(order_id).code, None)
+        for order in orders:
+            self.put(order)
+        self._updated[shop] = time.time()
+        self._errors.pop(shop, None)
+
+    async def refresh(self, states=None, shop: KaspiShop | None = None):
+        """
+        Полностью перечитывает заказы за ORDER_LOOKBACK_DAYS (без shop — всех магазинов, кроме тех,
+        у кого открыт автомат защиты). Заказы магазина заменяются только если все состояния
+        загрузились; отпечатки order_store не трогаются, уведомления остаются за планировщиком.
+        """
+        if shop is None:
+            await asyncio.gather(*(self.refresh(states, shop) for shop in shops.values() if not shop.breaker.is_open))
+            return
+        states = states or ORDER_CHECK_STATES
+        date_from = (datetime.now() + timedelta(days=1) - timedelta(days=ORDER_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        orders, errors = [], []
+        async for state, page, error in iter_order_pages_by_states(states, date_from=date_from, shop=shop):
+            if error is not None:
+                errors.append(f'{state}: {error}')
+            else:
+                orders.extend(page)
+        if errors:
+            self._errors[shop.name] = ', '.join(errors)
+            logger.warning(f'Снимок заказов {shop.name} не обновлён ({self.describe_age()}): {self._errors[shop.name]}')
+            return
+        self.replace(orders, shop.name)
+        logger.info(f'Снимок заказов {shop.name} обновлён: {len(orders)} заказов')
+
+    def shop_age(self, shop: str) -> float | None:
+        updated = self._updated.get(shop)
+        return None if updated is None else time.time() - updated
+
+    async def run(self, interval: float = ORDER_SNAPSHOT_CHECK_INTERVAL, max_age: float = ORDER_SNAPSHOT_MAX_AGE):
+        """
+        Раз в interval секунд перечитывает снимок магазинов, у которых он старше max_age (планировщик
+        давно не читал окно целиком) или автомат защиты только что закрылся; магазины с незакрытым
+        автоматом не опрашиваются. Запускается вместе с планировщиком в ведущем экземпляре
+        """
+        unavailable = set()
+        while True:
+            # Первый цикл планировщика обычно сам читает всё окно — снимок проверяется после него
+            await asyncio.sleep(interval)
+            try:
+                stale = []
+                for shop in shops.values():
+                    if shop.breaker.state != 'closed':
+                        unavailable.add(shop.name)
+                        continue
+                    age = self.shop_age(shop.name)
+                    if shop.name in unavailable or age is None or age >= max_age:
+                        stale.append(shop)
+                    unavailable.discard(shop.name)
+                await asyncio.gather(*(self.refresh(shop=shop) for shop in stale))
+            except Exception as e:
+                self._errors[None] = str(e)
+                logger.exception(f'Ошибка обновления снимка заказов: {e}')
+
+
+orders_snapshot = OrdersSnapshot()
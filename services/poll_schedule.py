@@ -0,0 +1,99 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+
+class PollSchedule:
+    """
+    Адаптивный интервал опроса: после цикла с найденными заказами — min_interval, после пустого
+    интервал растёт в backoff раз до max_interval. Вне рабочих часов (business_hours, по timezone)
+    опрос идёт раз в max_interval, но не позже их начала. К интервалу добавляется случайный
+    разброс jitter, чтобы запросы не шли строго по расписанию. reset() (ручная проверка)
+    возвращает минимальный интервал и будит ожидающий wait().
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, backoff: float, jitter: float,
+                 business_hours: tuple[int, int], timezone: str):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.business_hours = business_hours
+        self.tz = ZoneInfo(timezone)
+        self.interval = float(min_interval)
+        self.next_run: float | None = None
+        self.last_found = 0
+        self._wakeup: asyncio.Event | None = None
+        self._loop = None
+
+    def _event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def in_business_hours(self, now: datetime | None = None) -> bool:
+        now = now or datetime.now(self.tz)
+        start, end = self.business_hours
+        return start <= now.hour < end
+
+    def _seconds_until_open(self, now: datetime) -> float:
+        start, _ = self.business_hours
+        opening = now.replace(hour=start, minute=0, second=0, microsecond=0)
+        if opening <= now:
+            opening += timedelta(days=1)
+        return (opening - now).total_seconds()
+
+    def _delay(self) -> float:
+        now = datetime.now(self.tz)
+        if self.in_business_hours(now):
+            delay = self.interval
+        else:
+            delay = min(self.max_interval, max(self.min_interval, self._seconds_until_open(now)))
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def record(self, found: int) -> float:
+        """
+        Учитывает результат цикла и планирует следующий; возвращает задержку в секундах
+        """
+        self.last_found = found
+        if found:
+            self.interval = float(self.min_interval)
+        else:
+            self.interval = min(float(self.max_interval), self.interval * self.backoff)
+        delay = self._delay()
+        self.next_run = time.time() + delay
+        return delay
+
+    def reset(self):
+        self.interval = float(self.min_interval)
+        self.next_run = time.time() + self._delay()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait(self):
+        """
+        Ждёт next_run; после reset() пересчитывает ожидание по новому next_run
+        """
+        event = self._event()
+        while self.next_run is not None:
+            remaining = self.next_run - time.time()
+            if remaining <= 0:
+                return
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def describe(self) -> str:
+        text = f'интервал {int(self.interval // 60)} мин'
+        if not self.in_business_hours():
+            start, end = self.business_hours
+            text += f' (вне рабочих часов {start}:00–{end}:00)'
+        if self.next_run:
+            text += f', следующая проверка в {datetime.fromtimestamp(self.next_run, self.tz).strftime("%H:%M")}'
+        return text
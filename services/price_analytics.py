@@ -0,0 +1,334 @@
+import asyncio
+import html
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from aiogram import Bot
+from loguru import logger
+
+from config.config import MERCHANT_NAMES, PRICE_ANALYTICS_WINDOW_DAYS, PRICE_ANALYTICS_MAX_AGE
+from services.price_history import price_history
+from utils.notifications import notify_admin
+
+
+class Codes:
+    """
+    Номера для значений (товаров, продавцов): массивы NumPy хранят номера, а не сами значения
+    """
+
+    def __init__(self):
+        self.index: dict = {}
+        self.values: list = []
+
+    def code(self, value) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _seconds(value: datetime) -> float:
+    # Время в базе — naive UTC
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class PriceFrame:
+    """
+    Записи цен по столбцам: номер товара, номер продавца, цена, время (секунды UTC)
+    """
+    __slots__ = ('product', 'seller', 'price', 'ts')
+
+    def __init__(self, product, seller, price, ts):
+        self.product = np.asarray(product, dtype=np.int32)
+        self.seller = np.asarray(seller, dtype=np.int32)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.ts = np.asarray(ts, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.price)
+
+    @classmethod
+    def from_rows(cls, rows, products: Codes, sellers: Codes) -> 'PriceFrame':
+        """
+        rows — (товар, продавец, цена, время); время — datetime (UTC) или секунды
+        """
+        product, seller, price, ts = [], [], [], []
+        for row_product, row_seller, row_price, row_ts in rows:
+            if row_price is None:
+                continue
+            product.append(products.code(row_product))
+            seller.append(sellers.code(row_seller))
+            price.append(row_price)
+            ts.append(_seconds(row_ts) if isinstance(row_ts, datetime) else row_ts or 0)
+        return cls(product, seller, price, ts)
+
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    """
+    Маска начал групп в массиве, отсортированном по keys: строки, где меняется хотя бы один ключ
+    """
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    if len(changed):
+        changed[0] = True
+        for key in keys:
+            changed[1:] |= key[1:] != key[:-1]
+    return changed
+
+
+def _money(value: float) -> str:
+    return f'{value:,.0f}'.replace(',', ' ')
+
+
+class CatalogPrices:
+    """
+    Результат PriceAnalytics.compute: массивы по товарам (индекс — номер товара в products) и события
+    изменения цен. Места и разрыв — по последнему снимку выдачи; rolling_min/rolling_median — минимум
+    и медиана цены топ-1 по снимкам за окно.
+    """
+
+    def __init__(self, products: Codes, sellers: Codes, names: list, computed_at: float):
+        self.products = products
+        self.sellers = sellers
+        self.names = names
+        self.computed_at = computed_at
+        count = len(products)
+        self.top1_price = np.full(count, np.nan)
+        self.top1_seller = np.full(count, -1, dtype=np.int32)
+        self.my_price = np.full(count, np.nan)
+        self.my_rank = np.zeros(count, dtype=np.int32)  # 0 — товар продают только конкуренты
+        self.competitor_price = np.full(count, np.nan)  # лучшая цена среди конкурентов
+        self.sellers_count = np.zeros(count, dtype=np.int32)
+        self.rolling_min = np.full(count, np.nan)
+        self.rolling_median = np.full(count, np.nan)
+        self.snapshots = np.zeros(count, dtype=np.int32)
+        self.events = PriceFrame([], [], [], [])
+        self.events_old = np.zeros(0)
+        self.mine_found = False  # Хотя бы в одном товаре найден продавец из MERCHANT_NAMES
+
+    @property
+    def gap(self) -> np.ndarray:
+        """
+        На сколько моя цена выше цены топ-1 (0 — я в топ-1, nan — меня нет в выдаче)
+        """
+        return self.my_price - self.top1_price
+
+    @property
+    def lead(self) -> np.ndarray:
+        """
+        На сколько лучшая цена конкурента выше моей: запас, если я в топ-1
+        """
+        return self.competitor_price - self.my_price
+
+    def not_top1(self, limit: int | None = None) -> np.ndarray:
+        """
+        Номера товаров, где я продаю, но не на первом месте; сначала — с наибольшим разрывом
+        """
+        found = np.flatnonzero(self.my_rank > 1)
+        found = found[np.argsort(-self.gap[found], kind='stable')]
+        return found[:limit] if limit else found
+
+    def product_report(self, code: int) -> dict:
+        top1_seller = self.top1_seller[code]
+        return {
+            'product_id': self.products.values[code],
+            'name': self.names[code],
+            'rank': int(self.my_rank[code]),
+            'my_price': float(self.my_price[code]),
+            'top1_price': float(self.top1_price[code]),
+            'top1_seller': self.sellers.values[top1_seller] if top1_seller >= 0 else None,
+            'gap': float(self.gap[code]),
+            'rolling_min': float(self.rolling_min[code]),
+            'rolling_median': float(self.rolling_median[code]),
+        }
+
+    def price_changes(self, since: datetime | None = None) -> list[dict]:
+        """
+        Изменения цен продавцов за окно (или после since)
+        """
+        events = self.events
+        mask = events.ts >= _seconds(since) if since else np.ones(len(events), dtype=bool)
+        return [
+            {
+                'product_id': self.products.values[product], 'seller': self.sellers.values[seller],
+                'ts': datetime.utcfromtimestamp(ts), 'old': float(old), 'new': float(new),
+            }
+            for product, seller, ts, old, new in zip(
+                events.product[mask], events.seller[mask], events.ts[mask], self.events_old[mask], events.price[mask],
+            )
+        ]
+
+    @property
+    def merchants_missing(self) -> bool:
+        """
+        Цены проверены, но ни одного моего продавца в выдаче нет — скорее всего, не задан MERCHANT_NAMES
+        """
+        return not self.mine_found and bool(self.sellers_count.any())
+
+    def describe_not_top1(self, codes: np.ndarray | None = None, limit: int = 20) -> str:
+        if not self.sellers_count.any():
+            return '📭 Цены товаров ещё не проверялись.'
+        if self.merchants_missing:
+            return (
+                '⚠️ Ни в одном товаре не найден ваш продавец, места в выдаче не определить. '
+                'Укажите в MERCHANT_NAMES названия ваших магазинов, как на странице товара.'
+            )
+        codes = self.not_top1() if codes is None else codes
+        if not len(codes):
+            return '🏆 Во всех товарах ваша цена — первая в выдаче.'
+        lines = [f'📉 <b>Товаров не в топ-1: {len(codes)}</b>']
+        for code in codes[:limit]:
+            report = self.product_report(code)
+            # Названия товаров и продавцов взяты со страниц Kaspi, а сообщение отправляется в HTML
+            name = html.escape(str(report['name'] or report['product_id']))
+            seller = html.escape(str(report['top1_seller']))
+            lines.append(
+                f"• <b>{name}</b> — {report['rank']}-е место, ваша цена {_money(report['my_price'])} ₸, "
+                f"топ-1 {_money(report['top1_price'])} ₸ ({seller}), разница {_money(report['gap'])} ₸"
+            )
+        if len(codes) > limit:
+            lines.append(f'…и ещё {len(codes) - limit}')
+        return '\n'.join(lines)
+
+
+class PriceAnalytics:
+    """
+    Аналитика цен по всему каталогу за один проход на массивах NumPy: по последним снимкам выдачи —
+    моё место (конкурентный ранг, при равной цене место общее), разрыв до топ-1 и запас до ближайшего
+    конкурента; по истории за window_days — скользящие минимум и медиана цены топ-1 и события изменения
+    цен продавцов. Мои продавцы — MERCHANT_NAMES (без них мест в выдаче нет). Результат кэшируется на max_age секунд: запросы
+    вроде «где я не в топ-1» отвечаются из готовых массивов.
+    """
+
+    def __init__(self, merchants: list[str] = MERCHANT_NAMES, window_days: float = PRICE_ANALYTICS_WINDOW_DAYS,
+                 max_age: float = PRICE_ANALYTICS_MAX_AGE):
+        self.merchants = {name.strip().casefold() for name in merchants}
+        self.window_days = window_days
+        self.max_age = max_age
+        self.catalog: CatalogPrices | None = None
+        self._lock: asyncio.Lock | None = None
+        self._loop = None
+
+    def compute(self, snapshot: PriceFrame, history: PriceFrame, products: Codes, sellers: Codes,
+                names: list | None = None) -> CatalogPrices:
+        catalog = CatalogPrices(products, sellers, names or [None] * len(products), time.time())
+        count = len(products)
+        mine = np.fromiter((str(seller).strip().casefold() in self.merchants for seller in sellers.values), dtype=bool, count=len(sellers))
+
+        if len(snapshot):
+            # Снимок: сортировка по (товар, цена) — первая строка группы даёт топ-1
+            order = np.lexsort((snapshot.price, snapshot.product))
+            product, seller, price = snapshot.product[order], snapshot.seller[order], snapshot.price[order]
+            group_starts = _group_starts(product)
+            starts = np.flatnonzero(group_starts)
+            catalog.top1_price[product[starts]] = price[starts]
+            catalog.top1_seller[product[starts]] = seller[starts]
+            catalog.sellers_count[:] = np.bincount(product, minlength=count)
+            # Место строки — позиция первой строки с той же ценой внутри товара
+            position = np.arange(len(product))
+            group_start = np.maximum.accumulate(np.where(group_starts, position, 0))
+            run_start = np.maximum.accumulate(np.where(_group_starts(product, price), position, 0))
+            rank = run_start - group_start + 1
+            is_mine = mine[seller]
+            # Моя лучшая строка в товаре — первая из моих в порядке цены
+            my_rows = np.flatnonzero(is_mine)
+            catalog.mine_found = bool(len(my_rows))
+            my_products, first = np.unique(product[my_rows], return_index=True)
+            catalog.my_price[my_products] = price[my_rows[first]]
+            catalog.my_rank[my_products] = rank[my_rows[first]]
+            their_rows = np.flatnonzero(~is_mine)
+            their_products, first = np.unique(product[their_rows], return_index=True)
+            catalog.competitor_price[their_products] = price[their_rows[first]]
+
+        if len(history):
+            # Снимки истории: записи одного товара с одной отметкой времени; цена топ-1 — минимум в снимке
+            order = np.lexsort((history.ts, history.product))
+            product, ts, price = history.product[order], history.ts[order], history.price[order]
+            starts = np.flatnonzero(_group_starts(product, ts))
+            snap_product = product[starts]
+            snap_top1 = np.minimum.reduceat(price, starts)
+            counts = np.bincount(snap_product, minlength=count)
+            catalog.snapshots[:] = counts
+            product_starts = np.flatnonzero(_group_starts(snap_product))
+            catalog.rolling_min[snap_product[product_starts]] = np.minimum.reduceat(snap_top1, product_starts)
+            # Медиана по группам: сортировка цен внутри товара и середина каждой группы
+            values = snap_top1[np.lexsort((snap_top1, snap_product))]
+            present = np.flatnonzero(counts)
+            offsets = np.concatenate(([0], np.cumsum(counts)))[present]
+            sizes = counts[present]
+            catalog.rolling_median[present] = (values[offsets + (sizes - 1) // 2] + values[offsets + sizes // 2]) / 2
+
+            # События: соседние записи одного продавца в товаре с разной ценой
+            order = np.lexsort((history.ts, history.seller, history.product))
+            product, seller = history.product[order], history.seller[order]
+            ts, price = history.ts[order], history.price[order]
+            changed = np.flatnonzero(
+                (product[1:] == product[:-1]) & (seller[1:] == seller[:-1]) & (price[1:] != price[:-1])
+            ) + 1
+            catalog.events = PriceFrame(product[changed], seller[changed], price[changed], ts[changed])
+            catalog.events_old = price[changed - 1]
+        return catalog
+
+    async def refresh(self) -> CatalogPrices:
+        """
+        Загружает последние снимки и историю за окно и пересчитывает аналитику
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            started = time.perf_counter()
+            products, sellers, names = Codes(), Codes(), []
+            snapshot_rows = []
+            async for product_id, name, _, competitors in price_history.snapshots():
+                products.code(product_id)
+                names.append(name)
+                snapshot_rows.extend((product_id, c.get('seller'), c.get('price'), 0) for c in competitors)
+            snapshot = PriceFrame.from_rows(snapshot_rows, products, sellers)
+            since = datetime.utcnow() - timedelta(days=self.window_days)
+            history = PriceFrame.from_rows([row async for row in price_history.rows(since)], products, sellers)
+            # Товары, которые есть только в истории (например, удалены из отслеживания), — без названия
+            names.extend([None] * (len(products) - len(names)))
+            loaded = time.perf_counter()
+            if not self.merchants:
+                logger.warning('MERCHANT_NAMES не задан: аналитика цен не знает ваших продавцов и не определит места в выдаче')
+            self.catalog = self.compute(snapshot, history, products, sellers, names)
+            logger.info(
+                f'Аналитика цен: {len(products)} товаров, {len(history)} записей истории, '
+                f'загрузка {loaded - started:.2f} с, расчёт {(time.perf_counter() - loaded) * 1000:.1f} мс'
+            )
+            return self.catalog
+
+    async def get(self) -> CatalogPrices:
+        """
+        Аналитика не старше max_age секунд
+        """
+        if self.catalog is None or time.time() - self.catalog.computed_at > self.max_age:
+            return await self.refresh()
+        return self.catalog
+
+    async def notify_lost_top1(self, bot: Bot):
+        """
+        После проверки цен сообщает администратору о товарах, где я потерял первое место
+        (после запуска — обо всех товарах не в топ-1). Если моих продавцов в выдаче нет вовсе,
+        один раз предупреждает о MERCHANT_NAMES
+        """
+        previous = self.catalog
+        catalog = await self.refresh()
+        if catalog.merchants_missing:
+            if previous is None or not previous.merchants_missing:
+                await notify_admin(bot, catalog.describe_not_top1())
+            return
+        lost = catalog.not_top1()
+        if previous is not None:
+            was_behind = {previous.products.values[code] for code in previous.not_top1()}
+            lost = lost[[catalog.products.values[code] not in was_behind for code in lost]]
+        if len(lost):
+            await notify_admin(bot, catalog.describe_not_top1(lost))
+
+
+price_analytics = PriceAnalytics()
@@ -0,0 +1,197 @@
+from collections import deque
+from datetime import datetime, timedelta
+
+from loguru import logger
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+from config.config import PRICE_HISTORY_RETENTION_DAYS, PRICE_HISTORY_DAILY_RETENTION_DAYS, PRICE_HISTORY_MEMORY_ROWS
+from database.db import db
+from database.models import PRODUCTS_COLLECTION, PRICE_HISTORY_COLLECTION, PRICE_HISTORY_DAILY_COLLECTION
+
+# Документы одного товара и продавца попадают в общие блоки MongoDB: проверка цен идёт раз в 30 минут — сутки
+TIMESERIES_GRANULARITY = 'hours'
+
+
+def ranked(competitors: list[dict]) -> list[tuple[str, int, int]]:
+    """
+    Продавцы с ценой и местом по цене: (продавец, цена, место); при равной цене место общее
+    """
+    offers = sorted((c['price'], c['seller']) for c in competitors if c.get('price') is not None)
+    rows, rank = [], 0
+    for position, (price, seller) in enumerate(offers, 1):
+        if position == 1 or price != offers[position - 2][0]:
+            rank = position
+        rows.append((seller, price, rank))
+    return rows
+
+
+class PriceHistory:
+    """
+    История цен продавцов по товарам в time-series коллекции PRICE_HISTORY_COLLECTION:
+    { ts, meta: { product, seller }, price, rank }. Запись добавляется, когда проверка цен разобрала
+    изменившуюся страницу, — все продавцы товара с одной отметкой ts, так что записи с одинаковыми
+    product и ts образуют снимок выдачи. Подробные записи хранятся retention_days дней (TTL коллекции),
+    раз в сутки они сворачиваются в дневные агрегаты PRICE_HISTORY_DAILY_COLLECTION (min, max, last,
+    лучшее место), которые хранятся daily_retention_days дней. Записи, которые не удалось вставить,
+    повторяются со следующей пачкой (в очереди — не больше memory_rows, лишние старые отбрасываются).
+    Без MongoDB последние memory_rows записей и последние снимки товаров хранятся в памяти.
+    """
+
+    def __init__(self, retention_days: int = PRICE_HISTORY_RETENTION_DAYS,
+                 daily_retention_days: int = PRICE_HISTORY_DAILY_RETENTION_DAYS,
+                 memory_rows: int = PRICE_HISTORY_MEMORY_ROWS):
+        self.retention_days = retention_days
+        self.daily_retention_days = daily_retention_days
+        self._pending: list[dict] = []
+        self.memory_rows = memory_rows
+        self._rows: deque[tuple] = deque(maxlen=memory_rows)
+        self._latest: dict = {}
+        self._collections_ready = False
+        self.downsampled_until: datetime | None = None
+        self.counters = {'rows': 0, 'flushes': 0, 'errors': 0, 'dropped': 0, 'daily': 0}
+
+    def add(self, product: dict, competitors: list[dict], ts: datetime):
+        for seller, price, rank in ranked(competitors):
+            self._pending.append({'ts': ts, 'meta': {'product': product['_id'], 'seller': seller}, 'price': price, 'rank': rank})
+        if db is None:
+            self._latest[product['_id']] = (product.get('name'), ts, competitors)
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные записи одной вставкой; возвращает число записанных. При ошибке
+        записи возвращаются в очередь и повторяются со следующей пачкой
+        """
+        batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        if db is None:
+            self.counters['rows'] += len(batch)
+            self._rows.extend((doc['meta']['product'], doc['meta']['seller'], doc['price'], doc['ts']) for doc in batch)
+            return len(batch)
+        try:
+            await self._ensure_collections()
+            await db[PRICE_HISTORY_COLLECTION].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: остальные записи вставлены, повторять их не нужно
+            self.counters['errors'] += 1
+            written = e.details.get('nInserted', 0)
+            self.counters['rows'] += written
+            logger.error(f'История цен записана частично ({written} из {len(batch)}): {e.details.get("writeErrors", [])[:1]}')
+            return written
+        except Exception as e:
+            self.counters['errors'] += 1
+            self._pending[:0] = batch
+            overflow = len(self._pending) - self.memory_rows
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.counters['dropped'] += overflow
+            logger.error(f'Ошибка записи истории цен в MongoDB ({len(batch)} записей, повторим позже): {e}')
+            return 0
+        self.counters['flushes'] += 1
+        self.counters['rows'] += len(batch)
+        return len(batch)
+
+    async def _create_timeseries(self, name: str, retention_days: int):
+        expire = int(retention_days * 24 * 3600)
+        try:
+            await db.create_collection(
+                name, timeseries={'timeField': 'ts', 'metaField': 'meta', 'granularity': TIMESERIES_GRANULARITY},
+                expireAfterSeconds=expire,
+            )
+            logger.info(f'Создана time-series коллекция {name} (хранение {retention_days} дн.)')
+        except (CollectionInvalid, OperationFailure) as e:
+            if isinstance(e, OperationFailure) and e.code != 48:  # 48 — NamespaceExists
+                raise
+            # Коллекция уже есть: срок хранения берётся из настроек
+            await db.command('collMod', name, expireAfterSeconds=expire)
+        await db[name].create_index([('meta.product', 1), ('ts', -1)])
+
+    async def _ensure_collections(self):
+        if self._collections_ready:
+            return
+        await self._create_timeseries(PRICE_HISTORY_COLLECTION, self.retention_days)
+        await self._create_timeseries(PRICE_HISTORY_DAILY_COLLECTION, self.daily_retention_days)
+        self._collections_ready = True
+
+    async def snapshots(self):
+        """
+        Последний снимок выдачи каждого товара: (_id, название, ts, продавцы)
+        """
+        if db is None:
+            for product_id, (name, ts, competitors) in self._latest.items():
+                yield product_id, name, ts, competitors
+            return
+        cursor = db[PRODUCTS_COLLECTION].find(
+            {'competitors': {'$exists': True}}, {'name': 1, 'competitors': 1, 'last_checked_at': 1},
+        )
+        async for doc in cursor:
+            yield doc['_id'], doc.get('name'), doc.get('last_checked_at'), doc['competitors']
+
+    async def rows(self, since: datetime):
+        """
+        Записи истории с отметкой не раньше since: (товар, продавец, цена, ts)
+        """
+        if db is None:
+            for row in self._rows:
+                if row[3] >= since:
+                    yield row
+            return
+        cursor = db[PRICE_HISTORY_COLLECTION].find(
+            {'ts': {'$gte': since}}, {'_id': 0, 'ts': 1, 'meta': 1, 'price': 1},
+        ).batch_size(10000)
+        async for doc in cursor:
+            yield doc['meta']['product'], doc['meta']['seller'], doc['price'], doc['ts']
+
+    async def downsample(self, now: datetime | None = None) -> int:
+        """
+        Сворачивает подробную историю за завершившиеся сутки (UTC) в дневные агрегаты;
+        уже свёрнутые сутки пропускаются. Возвращает число записанных агрегатов
+        """
+        if db is None:
+            return 0
+        today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.downsampled_until is not None and self.downsampled_until >= today:
+            return 0
+        await self._ensure_collections()
+        daily = db[PRICE_HISTORY_DAILY_COLLECTION]
+        if self.downsampled_until is None:
+            last = await daily.find_one({}, {'ts': 1}, sort=[('ts', -1)])
+            if last is not None:
+                self.downsampled_until = last['ts'] + timedelta(days=1)
+            else:
+                first = await db[PRICE_HISTORY_COLLECTION].find_one({}, {'ts': 1}, sort=[('ts', 1)])
+                if first is None:
+                    self.downsampled_until = today
+                    return 0
+                self.downsampled_until = first['ts'].replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.downsampled_until >= today:
+            return 0
+        pipeline = [
+            {'$match': {'ts': {'$gte': self.downsampled_until, '$lt': today}}},
+            {'$sort': {'ts': 1}},
+            {'$group': {
+                '_id': {
+                    'product': '$meta.product', 'seller': '$meta.seller',
+                    'day': {'$dateTrunc': {'date': '$ts', 'unit': 'day'}},
+                },
+                'min': {'$min': '$price'}, 'max': {'$max': '$price'}, 'last': {'$last': '$price'},
+                'best_rank': {'$min': '$rank'}, 'samples': {'$sum': 1},
+            }},
+            {'$project': {
+                '_id': 0, 'ts': '$_id.day', 'meta': {'product': '$_id.product', 'seller': '$_id.seller'},
+                'min': 1, 'max': 1, 'last': 1, 'best_rank': 1, 'samples': 1,
+            }},
+        ]
+        docs = await db[PRICE_HISTORY_COLLECTION].aggregate(pipeline, allowDiskUse=True).to_list(None)
+        if docs:
+            await daily.insert_many(docs, ordered=False)
+        logger.info(f'История цен свёрнута по дням с {self.downsampled_until:%Y-%m-%d} по {today:%Y-%m-%d}: {len(docs)} агрегатов')
+        self.downsampled_until = today
+        self.counters['daily'] += len(docs)
+        return len(docs)
+
+    def stats(self) -> dict:
+        return {**self.counters, 'pending': len(self._pending), 'in_memory': len(self._rows)}
+
+
+price_history = PriceHistory()
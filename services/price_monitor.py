@@ -0,0 +1,215 @@
+import asyncio
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+from pymongo import UpdateOne
+
+from config.config import (
+    PRICE_CHECK_INTERVAL, PRICE_CHECK_INTERVALS, PRICE_CRAWL_CONCURRENCY, PRICE_CRAWL_HOST_CONCURRENCY,
+    PRICE_CRAWL_HOST_RATE, PRICE_CRAWL_BATCH, NOTIFY_IF_NOT_TOP1,
+)
+from database.db import db
+from database.models import PRODUCTS_COLLECTION
+from services.http_client import get_client
+from services.kaspi_parser import parse_page, page_fingerprint
+from services.price_analytics import price_analytics
+from services.price_history import price_history
+from services.rate_limiter import RateLimiter
+
+# Валидаторы и отпечаток страницы товара для условных запросов
+PAGE_FIELDS = ('page_etag', 'page_last_modified', 'page_hash')
+# checked — страниц загружено; not_modified — ответов 304; unchanged — прежний отпечаток; updated — новых цен;
+# writes — операций записи в MongoDB; history — записей истории цен
+RESULT_FIELDS = ('checked', 'not_modified', 'unchanged', 'updated', 'no_price', 'errors', 'writes', 'history')
+
+
+class PriceCrawler:
+    """
+    Проверка цен всех товаров из PRODUCTS_COLLECTION: concurrency задач загружают страницы через общий
+    клиент kaspi_site, у каждого сайта свой RateLimiter (не больше host_concurrency запросов одновременно
+    и host_rate в секунду, пауза на 429). Цены записываются пачками по batch_size через bulk_write:
+    last_price — текущая цена, min_price — минимум за всё время ($min).
+    Для каждого товара хранятся ETag, Last-Modified и отпечаток значимого фрагмента страницы (page_hash):
+    запрос условный, на 304 и на страницу с прежним отпечатком нет ни разбора HTML, ни записи цены.
+    Изменившиеся страницы разбираются в пуле процессов (parse_page), а не в цикле событий; продавцы
+    с ценами сохраняются в товаре (competitors) и добавляются в историю цен (price_history).
+    """
+
+    def __init__(self, concurrency: int = PRICE_CRAWL_CONCURRENCY, host_concurrency: int = PRICE_CRAWL_HOST_CONCURRENCY,
+                 host_rate: float = PRICE_CRAWL_HOST_RATE, batch_size: int = PRICE_CRAWL_BATCH):
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+        self.host_rate = host_rate
+        self.batch_size = batch_size
+        self._hosts: dict[str, RateLimiter] = {}
+        self._pending: list[UpdateOne] = []
+        self._task: asyncio.Task | None = None
+        self.last_result: dict | None = None
+
+    def _limiter(self, url: str) -> RateLimiter:
+        host = urlsplit(url).netloc
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = self._hosts[host] = RateLimiter(
+                f'kaspi_site [{host}]', self.host_rate, max(1, int(self.host_rate)), self.host_concurrency,
+            )
+        return limiter
+
+    async def fetch(self, url: str, product: dict | None = None) -> httpx.Response:
+        """
+        Загружает страницу; с product — условным запросом по его сохранённым ETag и Last-Modified
+        """
+        headers = {}
+        if product:
+            if product.get('page_etag'):
+                headers['If-None-Match'] = product['page_etag']
+            if product.get('page_last_modified'):
+                headers['If-Modified-Since'] = product['page_last_modified']
+        resp = await self._limiter(url).request(get_client('kaspi_site'), 'GET', url, headers=headers)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        return resp
+
+    async def _products(self):
+        projection = {'link': 1, 'name': 1, **{field: 1 for field in PAGE_FIELDS}}
+        async for doc in db[PRODUCTS_COLLECTION].find({'link': {'$nin': [None, '']}}, projection):
+            yield doc
+
+    async def _check(self, product: dict, result: dict):
+        link = product['link']
+        try:
+            resp = await self.fetch(link, product)
+            result['checked'] += 1
+            if resp.status_code == 304:
+                result['not_modified'] += 1
+                return
+            html = resp.text
+            page = {
+                'page_etag': resp.headers.get('ETag'),
+                'page_last_modified': resp.headers.get('Last-Modified'),
+                'page_hash': page_fingerprint(html),
+            }
+            changed = {field: value for field, value in page.items() if value != product.get(field)}
+            if 'page_hash' not in changed:
+                result['unchanged'] += 1
+                if changed:
+                    # Цены те же, но без новых ETag/Last-Modified следующий запрос не получит 304
+                    self._queue(product, {'$set': changed})
+                return
+            price, competitors = await parse_page(html)
+        except Exception as e:
+            result['errors'] += 1
+            logger.warning(f'Цена не получена ({product.get("name")}): {link}: {type(e).__name__}: {e}')
+            return
+        if price is None:
+            # Отпечаток не сохраняется: страницу разберём снова, когда разметка станет понятной
+            result['no_price'] += 1
+            return
+        result['updated'] += 1
+        now = datetime.utcnow()
+        self._queue(product, {
+            '$set': {**page, 'last_price': price, 'competitors': competitors, 'last_checked_at': now},
+            '$min': {'min_price': price},
+        })
+        price_history.add(product, competitors, now)
+
+    def _queue(self, product: dict, update: dict):
+        self._pending.append(UpdateOne({'_id': product['_id']}, update))
+        # Документ товара из переданного списка тоже обновляется: следующий проход пойдёт с новыми валидаторами
+        product.update(update['$set'])
+
+    async def _flush(self, result: dict):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        result['writes'] += len(batch)
+        result['history'] += await price_history.flush()
+        if db is None:
+            return
+        try:
+            await db[PRODUCTS_COLLECTION].bulk_write(batch, ordered=False)
+        except Exception as e:
+            result['errors'] += len(batch)
+            logger.error(f'Ошибка записи цен в MongoDB ({len(batch)} товаров): {e}')
+
+    async def crawl(self, products=None) -> dict:
+        """
+        Проверяет цены товаров (по умолчанию — всех товаров со ссылкой из базы; products — свой список
+        или асинхронный итератор документов с _id и link). Возвращает статистику прохода.
+        """
+        if products is None:
+            if db is None:
+                return {**dict.fromkeys(RESULT_FIELDS, 0), 'seconds': 0.0}
+            products = self._products()
+        started = time.perf_counter()
+        result = dict.fromkeys(RESULT_FIELDS, 0)
+        # Очередь ограничена: курсор MongoDB читается по мере проверки, а не целиком
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while (product := await queue.get()) is not None:
+                await self._check(product, result)
+                if len(self._pending) >= self.batch_size:
+                    await self._flush(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(products, '__aiter__'):
+                async for product in products:
+                    await queue.put(product)
+            else:
+                for product in products:
+                    await queue.put(product)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        await self._flush(result)
+        result['seconds'] = round(time.perf_counter() - started, 1)
+        self.last_result = result
+        logger.info(f'Проверка цен завершена: {result}, сайты: {self.stats()}')
+        return result
+
+    def crawl_in_background(self) -> asyncio.Task:
+        """
+        Запускает crawl, если он ещё не идёт; ручная проверка ждёт уже идущую
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.crawl())
+        return self._task
+
+    async def run(self, interval: float | None = None, bot=None):
+        """
+        Периодическая проверка цен с интервалом PRICE_CHECK_INTERVAL; после неё история цен сворачивается
+        по дням, а с NOTIFY_IF_NOT_TOP1 бот сообщает о товарах, где вы потеряли первое место
+        """
+        interval = interval or PRICE_CHECK_INTERVALS.get(PRICE_CHECK_INTERVAL, 3600)
+        logger.info(f'⏳ Запуск проверки цен (каждые {interval} сек)')
+        while True:
+            try:
+                await self.crawl_in_background()
+                await price_history.downsample()
+                if bot is not None and NOTIFY_IF_NOT_TOP1:
+                    await price_analytics.notify_lost_top1(bot)
+            except Exception as e:
+                logger.exception(f'Ошибка проверки цен: {e}')
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def describe(result: dict) -> str:
+        return (
+            f"✅ Проверено товаров: {result['checked']} за {result['seconds']} с\n"
+            f"Без изменений: {result['not_modified'] + result['unchanged']}, цены обновлены: {result['updated']}, "
+            f"без цены: {result['no_price']}, ошибок: {result['errors']}"
+        )
+
+    def stats(self) -> dict:
+        return {host: limiter.stats() for host, limiter in self._hosts.items()}
+
+
+price_crawler = PriceCrawler()
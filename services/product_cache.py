@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from loguru import logger
+
+from config.config import PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, PRODUCT_CACHE_PERSIST
+from database.db import db
+from database.models import PRODUCT_CACHE_COLLECTION
+
+
+class ProductCache:
+    """
+    LRU-кэш метаданных товаров с TTL в памяти процесса и необязательной записью в MongoDB.
+    Ключи: 'entry:<id позиции заказа>' и 'product:<id товара>'.
+    """
+
+    def __init__(self, max_size: int = PRODUCT_CACHE_SIZE, ttl: int = PRODUCT_CACHE_TTL, persist: bool = PRODUCT_CACHE_PERSIST):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist and db is not None
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._index_ready = False
+        # Загрузки, которые уже выполняются: параллельные запросы одного ключа ждут одну загрузку
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key: str) -> dict | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: dict):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def _ensure_index(self):
+        if self._index_ready:
+            return
+        await db[PRODUCT_CACHE_COLLECTION].create_index('updated_at', expireAfterSeconds=self.ttl)
+        # Флаг — только после успешного создания: при ошибке индекс попробуем создать со следующей записью
+        self._index_ready = True
+
+    async def get(self, key: str) -> dict | None:
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.persist:
+            try:
+                doc = await db[PRODUCT_CACHE_COLLECTION].find_one({'_id': key})
+                if doc and doc['updated_at'] > datetime.utcnow() - timedelta(seconds=self.ttl):
+                    value = {'name': doc.get('name'), 'product_id': doc.get('product_id')}
+                    self._set_memory(key, value)
+                    self.db_hits += 1
+                    return value
+            except Exception as e:
+                logger.warning(f'Ошибка чтения кэша товаров из MongoDB: {e}')
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        self._set_memory(key, value)
+        if self.persist:
+            try:
+                await self._ensure_index()
+                await db[PRODUCT_CACHE_COLLECTION].update_one(
+                    {'_id': key},
+                    {'$set': {**value, 'updated_at': datetime.utcnow()}},
+                    upsert=True,
+                )
+            except Exception as e:
+                logger.warning(f'Ошибка записи кэша товаров в MongoDB: {e}')
+
+    async def get_or_fetch(self, key: str, fetch) -> dict | None:
+        """
+        Возвращает значение из кэша, а при промахе вызывает fetch() один раз на ключ,
+        даже если ключ одновременно запрашивают несколько задач. None из fetch не кэшируется.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await fetch()
+            if value is not None:
+                await self.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получают ожидающие задачи; если их нет, исключение не должно попасть в лог asyncio
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def clear(self):
+        self._items.clear()
+        self.hits = self.db_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.db_hits + self.misses
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.db_hits) / total, 3) if total else 0.0,
+        }
+
+
+product_cache = ProductCache()
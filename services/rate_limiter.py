@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+from loguru import logger
+
+from services.circuit_breaker import CircuitBreaker
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After в секундах или в виде HTTP-даты
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Клиентский ограничитель запросов к API: token bucket (rate запросов в секунду, запас burst)
+    и адаптивный лимит одновременных запросов. На 429/5xx лимит уменьшается вдвое и все запросы
+    ждут Retry-After, на успешных ответах лимит постепенно возвращается к max_concurrency.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int, max_retries: int = 3, breaker: CircuitBreaker | None = None):
+        self.name = name
+        self.breaker = breaker
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.concurrency = float(max_concurrency)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._active = 0
+        self._loop = None
+        self._condition = None
+        self._bucket_lock = None
+        self.counters = {'requests': 0, 'throttled': 0, 'server_errors': 0, 'retries': 0, 'waited_seconds': 0.0}
+
+    def _bind_loop(self):
+        # Примитивы asyncio привязаны к циклу событий; бенчмарки запускают несколько циклов подряд
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._active = 0
+            self._condition = asyncio.Condition()
+            self._bucket_lock = asyncio.Lock()
+
+    async def _take_token(self):
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if self._paused_until > now:
+                    delay = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+                self.counters['waited_seconds'] += delay
+                await asyncio.sleep(delay)
+
+    async def _acquire_slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < max(1, int(self.concurrency)))
+            self._active += 1
+
+    async def _release_slot(self):
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _on_success(self):
+        if self.concurrency < self.max_concurrency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def _on_throttle(self, delay: float, status: int):
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning(
+            f'{self.name}: ответ {status}, пауза {delay:.1f} c, лимит параллельных запросов {int(self.concurrency)}'
+        )
+
+    async def _send(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        await self._take_token()
+        await self._acquire_slot()
+        try:
+            self.counters['requests'] += 1
+            return await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if self.breaker:
+                self.breaker.record_failure()
+            raise
+        finally:
+            await self._release_slot()
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Выполняет запрос с учётом лимитов. 429 повторяется для любых методов (запрос не был обработан),
+        5xx — только для GET. После max_retries возвращается последний ответ.
+        Если автомат защиты открыт, сразу выбрасывает CircuitOpenError.
+        """
+        self._bind_loop()
+        for attempt in range(self.max_retries + 1):
+            probe = self.breaker.before_request() if self.breaker else False
+            try:
+                if probe:
+                    # Пробный запрос ограничен по времени целиком, вместе с ожиданием лимитов
+                    resp = await asyncio.wait_for(self._send(client, method, url, **kwargs), self.breaker.probe_timeout)
+                else:
+                    resp = await self._send(client, method, url, **kwargs)
+            except asyncio.TimeoutError:
+                if probe:
+                    self.breaker.record_failure()
+                raise
+            finally:
+                if probe:
+                    # Отмена или ошибка вне HTTP не должны навсегда оставить автомат в half_open
+                    self.breaker.release_probe()
+
+            if self.breaker:
+                if resp.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+            retryable = resp.status_code == 429 or (resp.status_code in RETRY_STATUSES and method == 'GET')
+            if resp.status_code not in RETRY_STATUSES:
+                self._on_success()
+                return resp
+            self.counters['throttled' if resp.status_code == 429 else 'server_errors'] += 1
+            delay = parse_retry_after(resp.headers.get('Retry-After'))
+            if delay is None:
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 0.5)
+            self._on_throttle(delay, resp.status_code)
+            if not retryable or attempt == self.max_retries:
+                return resp
+            self.counters['retries'] += 1
+        return resp
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            'waited_seconds': round(self.counters['waited_seconds'], 1),
+            'concurrency': int(self.concurrency),
+            'active': self._active,
+            **({'breaker': self.breaker.state} if self.breaker else {}),
+        }
+
@@ -0,0 +1,56 @@
+from config.config import (
+    KASPI_SHOPS, KASPI_RATE_LIMIT, KASPI_RATE_BURST, KASPI_CONCURRENCY, KASPI_MAX_RETRIES,
+    KASPI_BREAKER_FAILURES, KASPI_BREAKER_RESET, KASPI_BREAKER_PROBE_TIMEOUT,
+    ORDER_CHECK_INTERVAL, ORDER_CHECK_MIN_INTERVAL, ORDER_CHECK_BACKOFF, ORDER_CHECK_JITTER,
+    ORDER_CHECK_BUSINESS_HOURS, ORDER_CHECK_TIMEZONE,
+)
+from services.circuit_breaker import CircuitBreaker
+from services.poll_schedule import PollSchedule
+from services.rate_limiter import RateLimiter
+
+
+class KaspiShop:
+    """
+    Магазин Kaspi со своим токеном API. Пул соединений у всех магазинов общий (http_client),
+    а лимиты запросов, автомат защиты и расписание опроса заказов — свои у каждого магазина.
+    """
+
+    def __init__(self, name: str, token: str):
+        self.name = name
+        self.token = token
+        self.headers = {
+            'Content-Type': 'application/vnd.api+json',
+            'X-Auth-Token': token,
+            'Accept': 'application/vnd.api+json',
+            'User-Agent': 'KaspiBot/1.0',
+        }
+        self.breaker = CircuitBreaker(f'Kaspi API [{name}]', KASPI_BREAKER_FAILURES, KASPI_BREAKER_RESET, KASPI_BREAKER_PROBE_TIMEOUT)
+        self.limiter = RateLimiter(
+            f'Kaspi API [{name}]', KASPI_RATE_LIMIT, KASPI_RATE_BURST, KASPI_CONCURRENCY, KASPI_MAX_RETRIES, self.breaker,
+        )
+        self.schedule = PollSchedule(
+            ORDER_CHECK_MIN_INTERVAL, ORDER_CHECK_INTERVAL, ORDER_CHECK_BACKOFF, ORDER_CHECK_JITTER,
+            ORDER_CHECK_BUSINESS_HOURS, ORDER_CHECK_TIMEZONE,
+        )
+
+    def __repr__(self) -> str:
+        return f'KaspiShop({self.name!r})'
+
+    @property
+    def tag(self) -> str:
+        """
+        Подпись магазина в уведомлениях; при одном магазине пустая
+        """
+        return f'🏪 {self.name}\n' if len(shops) > 1 else ''
+
+
+shops: dict[str, KaspiShop] = {name: KaspiShop(name, token) for name, token in KASPI_SHOPS.items()}
+
+
+def get_shop(name: str | None = None) -> KaspiShop | None:
+    """
+    Магазин по имени; без имени (или для заказа без магазина) — первый настроенный
+    """
+    if name in shops:
+        return shops[name]
+    return next(iter(shops.values()), None)
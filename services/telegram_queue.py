@@ -0,0 +1,349 @@
+import asyncio
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InlineKeyboardMarkup
+from loguru import logger
+
+from config.config import (
+    TELEGRAM_RATE_LIMIT, TELEGRAM_CHAT_INTERVAL, TELEGRAM_BATCH_WINDOW, TELEGRAM_QUEUE_SIZE, TELEGRAM_MAX_RETRIES,
+)
+
+MESSAGE_LIMIT = 4096
+KEYBOARD_LIMIT = 100  # Кнопок в одной inline-клавиатуре
+BATCH_SEPARATOR = '\n\n〰〰〰〰〰\n\n'
+TAG_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)[^>]*>')
+ENTITY_RE = re.compile(r'&(#\d+|#x[0-9a-fA-F]+|\w+);')
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    text: str
+    reply_markup: Any = None
+    batch: bool = False
+    label: str | None = None  # Подпись кнопок сообщения, когда оно отправляется в пачке с другими
+    message_id: int | None = None  # Для правки уже отправленного сообщения
+    edit_text: bool = True  # False — правится только клавиатура
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: asyncio.Future | None = None
+
+
+def _open_tags(html: str) -> list[tuple[str, str]]:
+    """
+    Теги, не закрытые к концу фрагмента: (имя, открывающий тег)
+    """
+    stack = []
+    for match in TAG_RE.finditer(html):
+        name = match.group(2).lower()
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i:]
+                break
+    return stack
+
+
+def _cut_position(text: str, limit: int) -> int:
+    """
+    Место разреза не дальше limit: по границе строки, а если её нет — не внутри тега или сущности (&amp;)
+    """
+    cut = text.rfind('\n', 0, limit)
+    if cut > 0:
+        return cut
+    cut = limit
+    tag_start = text.rfind('<', 0, cut)
+    if tag_start > text.rfind('>', 0, cut):
+        cut = tag_start
+    entity_start = text.rfind('&', 0, cut)
+    if entity_start != -1:
+        entity = ENTITY_RE.match(text, entity_start)
+        if entity and entity.end() > cut:
+            cut = entity_start
+    return cut if cut > 0 else limit
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """
+    Делит HTML-текст на части не длиннее limit, по возможности по границам строк. Теги, открытые
+    на месте разреза, закрываются в конце части и открываются заново в начале следующей
+    """
+    chunks = []
+    while len(text) > limit:
+        budget = limit
+        while True:
+            cut = _cut_position(text, budget)
+            stack = _open_tags(text[:cut])
+            closing = ''.join(f'</{name}>' for name, _ in reversed(stack))
+            if cut + len(closing) <= limit or budget <= 1:
+                break
+            budget = min(budget - 1, limit - len(closing))
+        chunks.append(text[:cut] + closing)
+        text = ''.join(tag for _, tag in stack) + text[cut:].lstrip('\n')
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def _buttons(markup) -> int:
+    if not isinstance(markup, InlineKeyboardMarkup):
+        return 0
+    return sum(len(row) for row in markup.inline_keyboard)
+
+
+def compose(parts: list[tuple[str, Any, str | None]]) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Текст и клавиатура пачки из частей (text, reply_markup, label), как их отправляет очередь:
+    тексты через BATCH_SEPARATOR, inline-клавиатуры объединяются, кнопки подписываются label своей части
+    """
+    if len(parts) == 1:
+        return parts[0][0], parts[0][1]
+    rows = []
+    for _, markup, label in parts:
+        if not isinstance(markup, InlineKeyboardMarkup):
+            continue
+        for row in markup.inline_keyboard:
+            if label:
+                row = [button.model_copy(update={'text': f'№{label}: {button.text}'}) for button in row]
+            rows.append(list(row))
+    text = BATCH_SEPARATOR.join(text for text, _, _ in parts)
+    return text, InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+class TelegramQueue:
+    """
+    Очередь исходящих сообщений: отправка идёт отдельной задачей, поэтому опрос заказов не ждёт Telegram.
+    Соблюдает общий лимит бота (rate сообщений в секунду) и интервал между сообщениями в один чат,
+    на TelegramRetryAfter ждёт указанное время и повторяет. Сообщения с batch=True, накопившиеся
+    за batch_window, склеиваются в одно (не длиннее 4096 символов) с общей клавиатурой.
+    """
+
+    def __init__(self, rate: float, chat_interval: float, batch_window: float, max_size: int, max_retries: int):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.batch_window = batch_window
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self._pending: dict[int, deque[OutgoingMessage]] = {}
+        self._next_send: dict[int, float] = {}
+        self._global_next = 0.0
+        self._size = 0
+        self._bot: Bot | None = None
+        self._loop = None
+        self._worker: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._changed: asyncio.Condition | None = None
+        self.counters = {'queued': 0, 'sent': 0, 'edited': 0, 'batched': 0, 'retry_after': 0, 'retries': 0, 'dropped': 0}
+
+    def _bind_loop(self, bot: Bot):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._pending.clear()
+            self._size = 0
+            self._wakeup = asyncio.Event()
+            self._changed = asyncio.Condition()
+            self._worker = None
+        self._bot = bot
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def send(self, bot: Bot, chat_id: int, text: str, reply_markup=None, batch: bool = False, label: str | None = None) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь и сразу возвращает future с отправленным Message
+        (для пачки — общим сообщением). Если очередь заполнена, ждёт свободного места.
+        """
+        self._bind_loop(bot)
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._size < self.max_size)
+            message = OutgoingMessage(chat_id, text, reply_markup, batch, label, future=self._loop.create_future())
+            self._pending.setdefault(chat_id, deque()).append(message)
+            self._size += 1
+        self.counters['queued'] += 1
+        self._wakeup.set()
+        return message.future
+
+    async def edit(self, bot: Bot, chat_id: int, message_id: int, text: str, reply_markup=None, edit_text: bool = True) -> asyncio.Future:
+        """
+        Ставит в очередь правку отправленного сообщения (edit_message_text или, при edit_text=False,
+        edit_message_reply_markup). Future завершится ошибкой, если сообщение нельзя изменить.
+        """
+        self._bind_loop(bot)
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._size < self.max_size)
+            message = OutgoingMessage(
+                chat_id, text, reply_markup, message_id=message_id, edit_text=edit_text,
+                future=self._loop.create_future(),
+            )
+            self._pending.setdefault(chat_id, deque()).append(message)
+            self._size += 1
+        self.counters['queued'] += 1
+        self._wakeup.set()
+        return message.future
+
+    async def flush(self, timeout: float | None = None):
+        """
+        Ждёт, пока очередь опустеет
+        """
+        if self._changed is None or self._loop is not asyncio.get_running_loop():
+            return
+
+        async def wait_empty():
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._size == 0)
+
+        try:
+            await asyncio.wait_for(wait_empty(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'В очереди Telegram осталось {self._size} сообщений')
+
+    async def close(self, timeout: float = 10):
+        await self.flush(timeout)
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    def _ready_at(self, chat_id: int) -> float:
+        head = self._pending[chat_id][0]
+        ready = max(self._next_send.get(chat_id, 0.0), self._global_next)
+        if head.batch:
+            # Даём соседним карточкам время попасть в ту же пачку
+            ready = max(ready, head.enqueued_at + self.batch_window)
+        return ready
+
+    def _take_batch(self, chat_id: int) -> list[OutgoingMessage]:
+        pending = self._pending[chat_id]
+        batch = [pending.popleft()]
+        if batch[0].batch:
+            length = len(batch[0].text)
+            buttons = _buttons(batch[0].reply_markup)
+            while pending and pending[0].batch:
+                candidate = pending[0]
+                if length + len(BATCH_SEPARATOR) + len(candidate.text) > MESSAGE_LIMIT:
+                    break
+                if buttons + _buttons(candidate.reply_markup) > KEYBOARD_LIMIT:
+                    break
+                length += len(BATCH_SEPARATOR) + len(candidate.text)
+                buttons += _buttons(candidate.reply_markup)
+                batch.append(pending.popleft())
+        if not pending:
+            del self._pending[chat_id]
+        return batch
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            chat_id = min(self._pending, key=self._ready_at)
+            delay = self._ready_at(chat_id) - time.monotonic()
+            if delay > 0:
+                # Новые сообщения могут оказаться готовыми раньше — просыпаемся и на них
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            batch = self._take_batch(chat_id)
+            try:
+                await self._deliver(chat_id, batch)
+            except Exception as e:
+                logger.exception(f'Ошибка очереди Telegram: {e}')
+                self._resolve(batch, error=e)
+            finally:
+                async with self._changed:
+                    self._size -= len(batch)
+                    self._changed.notify_all()
+
+    async def _deliver(self, chat_id: int, batch: list[OutgoingMessage]):
+        if batch[0].message_id is not None:
+            edited = await self._call_with_retries(chat_id, lambda: self._edit_message(batch[0]))
+            if edited is None:
+                self._resolve(batch, error=RuntimeError(f'Сообщение {batch[0].message_id} в чате {chat_id} не изменено'))
+            else:
+                self.counters['edited'] += 1
+                self._resolve(batch, result=edited)
+            return
+        if len(batch) > 1:
+            self.counters['batched'] += len(batch)
+        text, reply_markup = compose([(message.text, message.reply_markup, message.label) for message in batch])
+        chunks = split_text(text)
+        sent = None
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            sent = await self._call_with_retries(chat_id, lambda: self._bot.send_message(chat_id, chunk, reply_markup=markup))
+            if sent is None:
+                self._resolve(batch, error=RuntimeError(f'Сообщение в чат {chat_id} не отправлено'))
+                return
+            self.counters['sent'] += 1
+        self._resolve(batch, result=sent)
+
+    async def _edit_message(self, message: OutgoingMessage):
+        try:
+            if not message.edit_text:
+                return await self._bot.edit_message_reply_markup(
+                    chat_id=message.chat_id, message_id=message.message_id, reply_markup=message.reply_markup,
+                )
+            return await self._bot.edit_message_text(
+                message.text, chat_id=message.chat_id, message_id=message.message_id, reply_markup=message.reply_markup,
+            )
+        except TelegramBadRequest as e:
+            # Повторная правка тем же содержимым — не ошибка
+            if 'message is not modified' in str(e):
+                return True
+            raise
+
+    async def _call_with_retries(self, chat_id: int, call):
+        for attempt in range(self.max_retries + 1):
+            # Части длинного сообщения и повторы тоже соблюдают лимиты
+            delay = max(self._next_send.get(chat_id, 0.0), self._global_next) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            self._global_next = max(self._global_next, now) + 1 / self.rate
+            self._next_send[chat_id] = now + self.chat_interval
+            try:
+                return await call()
+            except TelegramRetryAfter as e:
+                self.counters['retry_after'] += 1
+                logger.warning(f'Telegram: ограничение частоты, пауза {e.retry_after} с')
+                self._next_send[chat_id] = time.monotonic() + e.retry_after
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.counters['retries'] += 1
+                logger.warning(f'Telegram недоступен ({e}), повтор {attempt + 1}/{self.max_retries}')
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except TelegramAPIError as e:
+                logger.error(f'Telegram отклонил сообщение в чат {chat_id}: {e}')
+                break
+        self.counters['dropped'] += 1
+        return None
+
+    @staticmethod
+    def _resolve(batch: list[OutgoingMessage], result=None, error: Exception | None = None):
+        for message in batch:
+            if message.future and not message.future.done():
+                if error is not None:
+                    message.future.set_exception(error)
+                    # Результат ждут не все отправители; не засоряем лог «Future exception was never retrieved»
+                    message.future.exception()
+                else:
+                    message.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {**self.counters, 'pending': self._size}
+
+
+telegram_queue = TelegramQueue(
+    TELEGRAM_RATE_LIMIT, TELEGRAM_CHAT_INTERVAL, TELEGRAM_BATCH_WINDOW, TELEGRAM_QUEUE_SIZE, TELEGRAM_MAX_RETRIES,
+)
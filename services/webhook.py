@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import time
+from contextlib import AbstractAsyncContextManager
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+
+from config.config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, HEALTH_PATH
+from services.leader_lease import scheduler_lease
+from services.orders_snapshot import orders_snapshot
+from services.shops import shops
+from services.telegram_queue import telegram_queue
+
+
+def webhook_secret() -> str:
+    """
+    Секрет для заголовка X-Telegram-Bot-Api-Secret-Token: WEBHOOK_SECRET или производный от BOT_TOKEN,
+    одинаковый у всех экземпляров бота
+    """
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f'webhook:{BOT_TOKEN}'.encode()).hexdigest()[:32]
+
+
+async def health(request: web.Request) -> web.Response:
+    """
+    Состояние процесса для балансировщика и мониторинга
+    """
+    return web.json_response({
+        'status': 'ok',
+        'uptime': int(time.time() - request.app['started_at']),
+        'scheduler': scheduler_lease.status(),
+        'telegram_queue': telegram_queue.stats(),
+        'orders_snapshot': orders_snapshot.describe_age(),
+        'shops': {
+            name: {'breaker': shop.breaker.status(), 'schedule': shop.schedule.describe()}
+            for name, shop in shops.items()
+        },
+    })
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, lifespan: AbstractAsyncContextManager | None = None) -> web.Application:
+    """
+    aiohttp-приложение: POST WEBHOOK_PATH принимает обновления Telegram (с проверкой секрета),
+    GET HEALTH_PATH — проверка состояния. Каждое обновление обрабатывается отдельной задачей,
+    Telegram сразу получает ответ 200. lifespan (фоновые задачи бота) живёт, пока работает приложение.
+    """
+    app = web.Application()
+    app['started_at'] = time.time()
+    app.router.add_get(HEALTH_PATH, health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True, secret_token=webhook_secret()).register(app, path=WEBHOOK_PATH)
+
+    async def register_webhook():
+        url = WEBHOOK_URL + WEBHOOK_PATH
+        await bot.set_webhook(url, secret_token=webhook_secret(), allowed_updates=dp.resolve_used_update_types())
+        logger.info(f'Webhook установлен: {url}')
+
+    dp.startup.register(register_webhook)
+
+    if lifespan is not None:
+        async def background(app: web.Application):
+            async with lifespan:
+                yield
+
+        app.cleanup_ctx.append(background)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, lifespan: AbstractAsyncContextManager | None = None):
+    """
+    Запускает сервер webhook на WEBHOOK_HOST:WEBHOOK_PORT и работает до отмены
+    """
+    runner = web.AppRunner(create_webhook_app(dp, bot, lifespan))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f'Сервер webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,33 @@
+import random
+import sys
+from loguru import logger
+from config.config import LOG_LEVEL, LOG_BODY_SAMPLE_RATE, LOG_BODY_MAX_CHARS
+
+
+def setup_logging():
+    """
+    Настраивает loguru: запись в stderr идёт из отдельного потока через очередь (enqueue=True),
+    поэтому вывод логов не блокирует цикл событий
+    """
+    logger.remove()
+    logger.add(sys.stderr, level=LOG_LEVEL, enqueue=True, backtrace=False, diagnose=False)
+
+
+def truncate(text, limit: int = LOG_BODY_MAX_CHARS) -> str:
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}... (+{len(text) - limit} символов)'
+
+
+def log_body(label: str, body):
+    """
+    Пишет тело ответа или большой объект в лог: на уровне DEBUG всегда, на INFO — только для доли
+    LOG_BODY_SAMPLE_RATE вызовов. body может быть функцией без аргументов: она вызывается, только если
+    запись действительно попадёт в лог. Тело обрезается до LOG_BODY_MAX_CHARS.
+    """
+    get_body = body if callable(body) else (lambda: body)
+    if LOG_BODY_SAMPLE_RATE and random.random() < LOG_BODY_SAMPLE_RATE:
+        logger.opt(lazy=True).info('{}: {}', lambda: label, lambda: truncate(get_body()))
+    else:
+        logger.opt(lazy=True).debug('{}: {}', lambda: label, lambda: truncate(get_body()))
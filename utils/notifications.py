@@ -1,11 +1,13 @@
 from aiogram import Bot, types
 from config.config import ADMIN_ID
 from typing import Optional
+from services.telegram_queue import telegram_queue
 
-async def notify_admin(bot: Bot, text: str, reply_markup: Optional['types.ReplyKeyboardMarkup | types.InlineKeyboardMarkup'] = None):
+async def notify_admin(bot: Bot, text: str, reply_markup: Optional['types.ReplyKeyboardMarkup | types.InlineKeyboardMarkup'] = None, batch: bool = False, label: Optional[str] = None):
     """
-    Отправляет уведомление админу в дружелюбном стиле.
+    Отправляет уведомление админу в дружелюбном стиле через очередь отправки (telegram_queue).
+    С batch=True несколько уведомлений подряд приходят одним сообщением, кнопки подписываются label.
     Пример:
     await notify_admin(bot, '🚚 <b>Новый заказ!</b>\nТовар: <b>iPhone 15 Pro</b>\nСтатус: На доставке\n№123456789')
     """
-    await bot.send_message(ADMIN_ID, text, reply_markup=reply_markup) 
\ No newline at end of file
+    return await telegram_queue.send(bot, ADMIN_ID, text, reply_markup=reply_markup, batch=batch, label=label)